@@ -0,0 +1,134 @@
+"""
+Admission control for the prediction endpoints.
+
+`AdmissionController` caps how many prediction requests are being decoded,
+queued or inferred at once; requests beyond the cap are rejected straight
+away instead of piling up in memory. `UploadSizeLimitMiddleware` rejects
+oversized uploads with 413 while the body is still streaming in, before
+FastAPI has spooled the whole multipart body. It also records how long the
+body took to arrive and be parsed as the `upload` stage, which happens before
+the endpoint runs.
+"""
+
+import json
+import math
+import threading
+import time
+from typing import Any, Dict
+
+from metrics import record_stage
+
+
+class AdmissionController:
+    """Bounded count of requests in the prediction pipeline"""
+
+    def __init__(self, max_pending: int):
+        self.max_pending = max_pending
+        self.pending = 0
+        self.admitted = 0
+        self.rejected = 0
+        self._lock = threading.Lock()
+
+    def try_acquire(self) -> bool:
+        """Admit a request if there is room; never blocks"""
+        with self._lock:
+            if self.max_pending > 0 and self.pending >= self.max_pending:
+                self.rejected += 1
+                return False
+            self.pending += 1
+            self.admitted += 1
+            return True
+
+    def release(self):
+        with self._lock:
+            self.pending -= 1
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "max_pending": self.max_pending,
+            "pending": self.pending,
+            "admitted": self.admitted,
+            "rejected": self.rejected,
+        }
+
+
+def retry_after_seconds(estimated_wait: float) -> str:
+    """Retry-After header value: the estimated wait rounded up, at least one second"""
+    return str(max(1, math.ceil(estimated_wait)))
+
+
+class UploadTooLarge(Exception):
+    pass
+
+
+class UploadSizeLimitMiddleware:
+    """ASGI middleware enforcing per-path request body limits while the body streams in"""
+
+    def __init__(self, app, limits: Dict[str, int]):
+        self.app = app
+        self.limits = limits
+
+    async def __call__(self, scope, receive, send):
+        limit = self.limits.get(scope.get("path")) if scope["type"] == "http" else None
+        if not limit:
+            await self.app(scope, receive, send)
+            return
+
+        # Declared sizes are rejected before reading anything
+        headers = dict(scope.get("headers") or [])
+        content_length = headers.get(b"content-length")
+        if content_length is not None and content_length.isdigit() and int(content_length) > limit:
+            await self._reject(send, limit)
+            return
+
+        received = 0
+        exceeded = False
+        response_started = False
+        upload_start = None
+
+        async def limited_receive():
+            nonlocal received, exceeded, upload_start
+            if upload_start is None:
+                upload_start = time.perf_counter()
+            message = await receive()
+            if message["type"] == "http.request":
+                received += len(message.get("body", b""))
+                if received > limit:
+                    exceeded = True
+                    raise UploadTooLarge()
+                if not message.get("more_body", False):
+                    # Called from the body parser, inside the request's metrics context
+                    record_stage("upload", time.perf_counter() - upload_start)
+            return message
+
+        async def guarded_send(message):
+            nonlocal response_started
+            # The body parser may turn our exception into its own error response; replace it
+            if exceeded:
+                return
+            response_started = response_started or message["type"] == "http.response.start"
+            await send(message)
+
+        try:
+            await self.app(scope, limited_receive, guarded_send)
+        except Exception:
+            # UploadTooLarge, or whatever the body parser wrapped it in
+            if not exceeded:
+                raise
+
+        if exceeded and not response_started:
+            await self._reject(send, limit)
+
+    @staticmethod
+    async def _reject(send, limit: int):
+        body = json.dumps({"detail": f"Upload too large (maximum {limit // (1024 * 1024)} MB)"}).encode()
+        await send({
+            "type": "http.response.start",
+            "status": 413,
+            "headers": [
+                (b"content-type", b"application/json"),
+                (b"content-length", str(len(body)).encode()),
+                (b"connection", b"close"),
+            ],
+        })
+        await send({"type": "http.response.body", "body": body})
@@ -0,0 +1,418 @@
+#!/usr/bin/env python3
+"""
+Load-testing and latency benchmark for the CropGuard AI API.
+
+Starts the API (as a subprocess by default, or in-process) together with the
+stub LLM from stub_llm.py, drives /predict and /treatment at a fixed
+concurrency with synthetic images of several resolutions, and reports
+p50/p95/p99 latency, requests/sec and server RSS. Results are written as JSON
+so runs can be compared across commits.
+
+By default every /predict request sends a different image and the server runs
+without its prediction cache, so the numbers measure decoding and inference.
+--prediction-cache instead replays a small pool of images against a cached
+server to measure the cache-hit path:
+
+    python benchmark_api.py --concurrency 8 --requests 200
+    python benchmark_api.py --prediction-cache --images-per-resolution 4
+    python benchmark_api.py --url http://localhost:8000 --endpoints predict
+    python benchmark_api.py --compare old.json new.json
+"""
+
+import argparse
+import asyncio
+import io
+import json
+import os
+import random
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime, timezone
+from typing import Dict, List, Optional
+
+import httpx
+import numpy as np
+from PIL import Image
+
+# --- Config ---
+API_PORT = 8010
+LLM_PORT = 8011
+RESOLUTIONS = [224, 512, 1024, 2048]
+OUTPUT_PATH = "benchmark_results.json"
+STARTUP_TIMEOUT = 300  # Seconds to wait for the model to load
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def make_synthetic_images(resolutions: List[int], count: int, seed: int = 0) -> List[Dict]:
+    """`count` distinct random-noise JPEGs, cycling through the resolutions
+
+    Noise defeats draft-mode shortcuts, so decode cost is realistic.
+    """
+    rng = np.random.default_rng(seed)
+    images = []
+    for i in range(count):
+        # Leaf photos are rarely square; vary the aspect ratio a little
+        size = resolutions[i % len(resolutions)]
+        width, height = size, int(size * rng.uniform(0.75, 1.0))
+        pixels = rng.integers(0, 256, size=(height, width, 3), dtype=np.uint8)
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG", quality=90)
+        images.append({"resolution": size, "bytes": buffer.getvalue()})
+    return images
+
+
+def read_rss_mb(pid: int) -> Optional[float]:
+    """Resident set size of a process in MB (Linux /proc, psutil elsewhere if installed)"""
+    try:
+        with open(f"/proc/{pid}/status") as f:
+            for line in f:
+                if line.startswith("VmRSS:"):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    try:
+        import psutil
+        return psutil.Process(pid).memory_info().rss / (1024 * 1024)
+    except Exception:
+        return None
+
+
+def percentiles(latencies: List[float]) -> Dict[str, float]:
+    if not latencies:
+        return {}
+    values = np.array(latencies) * 1000
+    return {
+        "p50_ms": round(float(np.percentile(values, 50)), 2),
+        "p95_ms": round(float(np.percentile(values, 95)), 2),
+        "p99_ms": round(float(np.percentile(values, 99)), 2),
+        "mean_ms": round(float(values.mean()), 2),
+        "max_ms": round(float(values.max()), 2),
+    }
+
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except Exception:
+        return None
+
+
+# --- Servers under test ---
+class ServerProcess:
+    """A uvicorn or script subprocess with a readiness probe"""
+
+    def __init__(self, args: List[str], env: Dict[str, str], log_path: str):
+        self.log = open(log_path, "w")
+        self.process = subprocess.Popen(args, env=env, stdout=self.log, stderr=subprocess.STDOUT)
+
+    @property
+    def pid(self) -> int:
+        return self.process.pid
+
+    def stop(self):
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+
+
+class InProcessServer:
+    """Runs main:app with uvicorn on a background thread of this process"""
+
+    def __init__(self, port: int):
+        import uvicorn
+        import main
+
+        config = uvicorn.Config(main.app, host="127.0.0.1", port=port, log_level="warning")
+        self.server = uvicorn.Server(config)
+        self.thread = threading.Thread(target=self.server.run, daemon=True)
+        self.thread.start()
+
+    @property
+    def pid(self) -> int:
+        return os.getpid()
+
+    def stop(self):
+        self.server.should_exit = True
+        self.thread.join(timeout=10)
+
+
+def wait_until_ready(url: str, timeout: float, server=None):
+    """Poll /health until the server reports ready (model loaded and warmed up)"""
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        if isinstance(server, ServerProcess) and server.process.poll() is not None:
+            raise RuntimeError(f"Server exited during startup, see {server.log.name}")
+        try:
+            response = httpx.get(f"{url}/health", timeout=2)
+            if response.status_code == 200 and response.json().get("ready"):
+                return response.json()
+        except (httpx.HTTPError, ValueError):
+            pass
+        time.sleep(0.5)
+    raise TimeoutError(f"{url} not ready after {timeout:.0f}s")
+
+
+def start_servers(args):
+    """Start the stub LLM and the API; returns (api_url, api_server, servers to stop)"""
+    servers = []
+    env = dict(os.environ)
+    if not args.real_llm:
+        llm = ServerProcess(
+            [sys.executable, os.path.join(APP_DIR, "stub_llm.py"),
+             "--port", str(args.llm_port), "--delay", str(args.llm_delay)],
+            env, "benchmark_stub_llm.log"
+        )
+        servers.append(llm)
+        env["OPENROUTER_BASE_URL"] = f"http://127.0.0.1:{args.llm_port}/v1"
+        env["OPENROUTER_API_KEY"] = "stub"
+    if not args.prediction_cache:
+        env["PREDICTION_CACHE_SIZE"] = "0"
+
+    url = f"http://127.0.0.1:{args.port}"
+    if args.mode == "inprocess":
+        # main.py reads its settings at import time
+        os.environ.update(env)
+        api = InProcessServer(args.port)
+    else:
+        api = ServerProcess(
+            [sys.executable, "-m", "uvicorn", "main:app", "--app-dir", APP_DIR,
+             "--host", "127.0.0.1", "--port", str(args.port)],
+            env, "benchmark_api.log"
+        )
+    servers.append(api)
+    return url, api, servers
+
+
+# --- Load generation ---
+def prediction_cache_hits(url: str) -> Optional[int]:
+    try:
+        return httpx.get(f"{url}/health", timeout=10).json()["prediction_cache"]["hits"]
+    except (httpx.HTTPError, KeyError, TypeError, ValueError):
+        return None
+
+
+async def run_scenario(
+    url: str, endpoint: str, args, images: List[Dict], warmup_images: List[Dict], classes: List[str],
+    pid: Optional[int]
+):
+    """Drive one endpoint at fixed concurrency and summarise latency, throughput and memory"""
+    rng = random.Random(args.seed)
+    latencies: List[float] = []
+    by_resolution: Dict[int, List[float]] = {}
+    errors: Dict[str, int] = {}
+    issued = 0
+    rss_samples = []
+
+    def next_request():
+        nonlocal issued
+        if issued >= args.requests:
+            return None
+        issued += 1
+        if endpoint == "predict":
+            # A distinct image per request unless the cache-hit path is being measured
+            image = rng.choice(images) if args.prediction_cache else images[issued - 1]
+            return image["resolution"], {"files": {"file": ("bench.jpg", image["bytes"], "image/jpeg")}}
+        payload = {"disease_name": rng.choice(classes), "confidence": round(rng.uniform(0.5, 1.0), 2)}
+        return None, {"json": payload}
+
+    async def worker(client: httpx.AsyncClient):
+        while True:
+            item = next_request()
+            if item is None:
+                return
+            resolution, kwargs = item
+            start = time.perf_counter()
+            try:
+                response = await client.post(f"{url}/{endpoint}", **kwargs)
+                elapsed = time.perf_counter() - start
+                if response.status_code != 200:
+                    errors[str(response.status_code)] = errors.get(str(response.status_code), 0) + 1
+                    continue
+            except httpx.HTTPError as e:
+                errors[type(e).__name__] = errors.get(type(e).__name__, 0) + 1
+                continue
+            latencies.append(elapsed)
+            if resolution is not None:
+                by_resolution.setdefault(resolution, []).append(elapsed)
+
+    async def sample_rss(stop: asyncio.Event):
+        while not stop.is_set():
+            rss = read_rss_mb(pid) if pid else None
+            if rss is not None:
+                rss_samples.append(rss)
+            try:
+                await asyncio.wait_for(stop.wait(), timeout=0.25)
+            except asyncio.TimeoutError:
+                pass
+
+    limits = httpx.Limits(max_connections=args.concurrency)
+    async with httpx.AsyncClient(timeout=args.timeout, limits=limits) as client:
+        # Warm-up requests are not recorded, and use their own images so they cannot warm the cache
+        for image in warmup_images:
+            await client.post(f"{url}/predict", files={"file": ("warmup.jpg", image["bytes"], "image/jpeg")})
+
+        hits_before = prediction_cache_hits(url)
+        stop = asyncio.Event()
+        sampler = asyncio.create_task(sample_rss(stop))
+        start = time.perf_counter()
+        await asyncio.gather(*(worker(client) for _ in range(args.concurrency)))
+        wall = time.perf_counter() - start
+        stop.set()
+        await sampler
+        hits_after = prediction_cache_hits(url)
+
+    result = {
+        "endpoint": f"/{endpoint}",
+        "requests": args.requests,
+        "succeeded": len(latencies),
+        "errors": errors,
+        "wall_seconds": round(wall, 3),
+        "requests_per_sec": round(len(latencies) / wall, 2) if wall else 0.0,
+        "latency": percentiles(latencies),
+        "prediction_cache_hits": hits_after - hits_before if None not in (hits_before, hits_after) else None,
+        "rss_mb": {
+            "start": round(rss_samples[0], 1),
+            "peak": round(max(rss_samples), 1),
+            "end": round(rss_samples[-1], 1),
+        } if rss_samples else None,
+    }
+    if by_resolution:
+        result["latency_by_resolution"] = {
+            str(size): percentiles(values) for size, values in sorted(by_resolution.items())
+        }
+    return result
+
+
+def print_result(result: Dict):
+    latency = result["latency"]
+    print(f"\n📊 {result['endpoint']}: {result['succeeded']}/{result['requests']} ok, "
+          f"{result['requests_per_sec']:.2f} req/s")
+    if latency:
+        print(f"   latency p50 {latency['p50_ms']:.1f} ms | p95 {latency['p95_ms']:.1f} ms | "
+              f"p99 {latency['p99_ms']:.1f} ms | max {latency['max_ms']:.1f} ms")
+    for size, stats in result.get("latency_by_resolution", {}).items():
+        print(f"   {size:>5}px   p50 {stats['p50_ms']:.1f} ms | p95 {stats['p95_ms']:.1f} ms")
+    if result["endpoint"] == "/predict" and result["prediction_cache_hits"] is not None:
+        print(f"   prediction cache hits: {result['prediction_cache_hits']}/{result['succeeded']}")
+    if result["rss_mb"]:
+        rss = result["rss_mb"]
+        print(f"   server RSS {rss['start']:.0f} -> {rss['end']:.0f} MB (peak {rss['peak']:.0f} MB)")
+    if result["errors"]:
+        print(f"   ⚠️ errors: {result['errors']}")
+
+
+def compare(old_path: str, new_path: str):
+    """Print the change in throughput and tail latency between two result files"""
+    with open(old_path) as f:
+        old = {r["endpoint"]: r for r in json.load(f)["results"]}
+    with open(new_path) as f:
+        new = {r["endpoint"]: r for r in json.load(f)["results"]}
+
+    print(f"{'endpoint':<12}{'metric':<10}{'old':>12}{'new':>12}{'change':>10}")
+    for endpoint in old.keys() & new.keys():
+        rows = [("req/s", old[endpoint]["requests_per_sec"], new[endpoint]["requests_per_sec"])]
+        for key in ("p50_ms", "p95_ms", "p99_ms"):
+            if key in old[endpoint]["latency"] and key in new[endpoint]["latency"]:
+                rows.append((key, old[endpoint]["latency"][key], new[endpoint]["latency"][key]))
+        for metric, before, after in rows:
+            change = (after - before) / before * 100 if before else 0.0
+            print(f"{endpoint:<12}{metric:<10}{before:>12.2f}{after:>12.2f}{change:>+9.1f}%")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark API throughput and tail latency")
+    parser.add_argument("--mode", choices=["subprocess", "inprocess"], default="subprocess",
+                        help="Run the API as a uvicorn subprocess or on a thread of this process")
+    parser.add_argument("--url", help="Benchmark an already running server instead of starting one")
+    parser.add_argument("--port", type=int, default=API_PORT)
+    parser.add_argument("--llm-port", type=int, default=LLM_PORT)
+    parser.add_argument("--llm-delay", type=float, default=0.5, help="Simulated stub LLM latency in seconds")
+    parser.add_argument("--real-llm", action="store_true", help="Use the configured LLM instead of the stub")
+    parser.add_argument("--endpoints", nargs="+", choices=["predict", "treatment"], default=["predict", "treatment"])
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--requests", type=int, default=100, help="Requests per endpoint")
+    parser.add_argument("--warmup", type=int, default=4, help="Unrecorded /predict calls before each scenario")
+    parser.add_argument("--resolutions", type=int, nargs="+", default=RESOLUTIONS)
+    parser.add_argument("--prediction-cache", action="store_true",
+                        help="Keep the server's prediction cache on and replay a small image pool (cache-hit path)")
+    parser.add_argument("--images-per-resolution", type=int, default=4,
+                        help="Size of the replayed image pool per resolution with --prediction-cache")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    parser.add_argument("--compare", nargs=2, metavar=("OLD", "NEW"), help="Compare two result files and exit")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return 0
+
+    if args.prediction_cache:
+        count = args.images_per_resolution * len(args.resolutions)
+        print(f"🧊 Mode: prediction cache ON, replaying {count} images (measures the cache-hit path)")
+    else:
+        count = args.requests
+        print("🔥 Mode: prediction cache OFF, a distinct image per request (measures inference)")
+    if args.url:
+        print("⚠️ External server: its own PREDICTION_CACHE_SIZE applies; cache hits are reported per run")
+
+    print("🖼️ Generating synthetic images...")
+    images = make_synthetic_images(args.resolutions, count, args.seed)
+    warmup_images = make_synthetic_images(args.resolutions, args.warmup, args.seed + 1)
+
+    servers, pid = [], None
+    try:
+        if args.url:
+            url = args.url.rstrip("/")
+        else:
+            print(f"🚀 Starting API ({args.mode})...")
+            url, api, servers = start_servers(args)
+            pid = api.pid
+        health = wait_until_ready(url, STARTUP_TIMEOUT, servers[-1] if servers else None)
+        classes = httpx.get(f"{url}/classes").json()["classes"]
+        print(f"✅ Server ready: backend {health.get('backend')}, precision {health.get('precision')}")
+
+        results = []
+        for endpoint in args.endpoints:
+            print(f"\n🔄 {args.requests} requests to /{endpoint} at concurrency {args.concurrency}...")
+            result = asyncio.run(run_scenario(url, endpoint, args, images, warmup_images, classes, pid))
+            print_result(result)
+            results.append(result)
+
+        final_health = httpx.get(f"{url}/health").json()
+    finally:
+        for server in reversed(servers):
+            server.stop()
+
+    report = {
+        "timestamp": datetime.now(timezone.utc).isoformat(),
+        "commit": git_commit(),
+        "config": {
+            "mode": "external" if args.url else args.mode,
+            "concurrency": args.concurrency,
+            "requests": args.requests,
+            "resolutions": args.resolutions,
+            "llm": "real" if args.real_llm else f"stub ({args.llm_delay}s)",
+            "prediction_cache": args.prediction_cache,
+            "distinct_images": len(images),
+            "cpu_count": os.cpu_count(),
+        },
+        "server": {key: health.get(key) for key in ("device", "backend", "precision", "model_load_seconds")},
+        "results": results,
+        "final_health": final_health,
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\n💾 Results written to {args.output}")
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
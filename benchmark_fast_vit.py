@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+"""
+Speed/accuracy benchmark of the fast ViT modes in fast_vit.py.
+
+For every mode (reduced resolution, token merging, or both) the model is
+loaded fresh, timed on synthetic batches and evaluated on eval.py's test set.
+The report shows latency, top-1 accuracy and agreement with the full model's
+predictions, so a VIT_FAST_MODE for the server can be picked from it:
+
+    python benchmark_fast_vit.py
+    python benchmark_fast_vit.py --modes full tome=8 res=160 res=192,tome=4 --precision int8
+"""
+
+import argparse
+import json
+import os
+import statistics
+import time
+
+import numpy as np
+import torch
+from torch.utils.data import DataLoader
+
+from eval import TestImageDataset, evaluate, test_dir, checkpoint_path
+from fast_vit import apply_fast_mode, format_fast_mode, parse_fast_mode
+from model_loader import load_classifier
+from precision import PRECISIONS, apply_precision, autocast_context, resolve_precision
+
+# --- Config ---
+DEFAULT_MODES = ["full", "tome=4", "tome=8", "tome=16", "res=192", "res=160", "res=160,tome=4"]
+OUTPUT_PATH = "fast_vit_results.json"
+
+
+def time_forward(model, size, batch_size, precision, iters, warmup):
+    """Median milliseconds per image for batches of synthetic input"""
+    batch = torch.randn(batch_size, 3, size, size)
+    timings = []
+    with torch.inference_mode(), autocast_context(precision):
+        for i in range(warmup + iters):
+            start = time.perf_counter()
+            model(batch)
+            if i >= warmup:
+                timings.append((time.perf_counter() - start) * 1000 / batch_size)
+    return statistics.median(timings)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Latency and accuracy of the fast ViT inference modes")
+    parser.add_argument("--modes", nargs="+", default=DEFAULT_MODES,
+                        help='Modes to compare, e.g. "full" "tome=8" "res=160,tome=4"')
+    parser.add_argument("--checkpoint", default=checkpoint_path)
+    parser.add_argument("--test-dir", default=test_dir)
+    parser.add_argument("--precision", default="fp32", choices=PRECISIONS)
+    parser.add_argument("--batch-sizes", type=int, nargs="+", default=[1, 8], help="Batch sizes to time")
+    parser.add_argument("--iters", type=int, default=10)
+    parser.add_argument("--warmup", type=int, default=2)
+    parser.add_argument("--eval-batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--output", default=OUTPUT_PATH)
+    args = parser.parse_args()
+
+    precision = resolve_precision(args.precision)
+    results = []
+    reference_predictions = None
+
+    for spec in args.modes:
+        mode = parse_fast_mode("" if spec == "full" else spec)
+        name = format_fast_mode(mode)
+        print(f"\n===== {name} =====")
+
+        model, class_names = load_classifier(args.checkpoint)
+        size = apply_fast_mode(model, "" if spec == "full" else spec)
+        model = apply_precision(model, precision)
+
+        latency = {
+            batch_size: time_forward(model, size, batch_size, precision, args.iters, args.warmup)
+            for batch_size in args.batch_sizes
+        }
+
+        accuracy, agreement = None, None
+        dataset = TestImageDataset(args.test_dir, class_names, size)
+        if len(dataset):
+            loader = DataLoader(dataset, batch_size=args.eval_batch_size, num_workers=args.workers)
+            logits, labels, _ = evaluate(model, loader, precision)
+            predictions = logits.argmax(axis=1)
+            accuracy = float(np.mean(predictions == labels))
+            # Agreement with the first mode (normally the full model) isolates the approximation error
+            if reference_predictions is None:
+                reference_predictions = predictions
+            agreement = float(np.mean(predictions == reference_predictions))
+        else:
+            print(f"⚠️ No labelled test images in {args.test_dir}; reporting latency only")
+
+        results.append({
+            "mode": name,
+            "input_size": size,
+            "tokens": (size // model.patch_embed.patch_size[0]) ** 2,
+            "ms_per_image": {str(b): round(ms, 2) for b, ms in latency.items()},
+            "accuracy": accuracy,
+            "agreement": agreement,
+        })
+
+    # --- Summary ---
+    baseline = results[0]
+    print(f"\nFast ViT modes ({precision}, {args.checkpoint}):\n")
+    header = f"{'mode':<18}{'input':>7}{'tokens':>8}"
+    header += "".join(f"{f'ms/img@{b}':>12}" for b in args.batch_sizes)
+    header += f"{'speedup':>9}{'top-1':>9}{'Δ top-1':>9}{'agree':>8}"
+    print(header)
+    for result in results:
+        last_batch = str(args.batch_sizes[-1])
+        speedup = baseline["ms_per_image"][last_batch] / result["ms_per_image"][last_batch]
+        row = f"{result['mode']:<18}{result['input_size']:>7}{result['tokens']:>8}"
+        row += "".join(f"{result['ms_per_image'][str(b)]:>12.1f}" for b in args.batch_sizes)
+        row += f"{speedup:>8.2f}x"
+        if result["accuracy"] is not None:
+            delta = (result["accuracy"] - baseline["accuracy"]) * 100
+            row += f"{result['accuracy'] * 100:>8.2f}%{delta:>+8.2f}%{result['agreement'] * 100:>7.1f}%"
+        print(row)
+
+    with open(args.output, "w") as f:
+        json.dump({"precision": precision, "checkpoint": args.checkpoint, "results": results}, f, indent=2)
+    print(f"\n💾 Results saved to {args.output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,473 @@
+#!/usr/bin/env python3
+"""
+Persistent vector index over ViT embeddings for "similar cases" lookup.
+
+Vectors are the model's pooled pre-logits embeddings (the input of
+`model.head`), L2-normalized so that the inner product is cosine similarity.
+Until `train_size` vectors have been added the index is an exact float32 scan.
+After that it is trained into an IVF-SQ8 index:
+
+- a spherical k-means coarse quantizer splits the vectors into inverted lists;
+- each vector is stored as int8 codes with a per-dimension scale (768 bytes
+  per ViT-Base vector instead of 3 KB), so millions fit in RAM on CPU;
+- searches only scan the `nprobe` lists closest to the query.
+
+Everything is kept in append-only files under one directory, so adding a
+vector costs a few hundred bytes of I/O. Metadata (label, source, filename,
+...) stays on disk and is read back only for the returned neighbors.
+
+Reference images can be added from the command line (stop the server first):
+
+    python embedding_index.py add reference_images/
+    python embedding_index.py train --nlist 1024
+    python embedding_index.py search leaf.jpg -k 5
+"""
+
+import argparse
+import hashlib
+import json
+import math
+import os
+import threading
+import time
+from typing import Any, Dict, List, Optional, Sequence, Tuple
+
+import numpy as np
+import torch
+
+from fast_vit import apply_fast_mode, format_fast_mode
+from preprocess import IMAGE_SIZE, preprocess_image
+
+# --- Config ---
+INDEX_DIR = "embedding_index"
+INDEX_FILE = "index.json"
+VECTORS_FILE = "vectors.f32"  # Untrained: float32 rows
+CODES_FILE = "codes.i8"  # Trained: int8 rows
+LISTS_FILE = "lists.i32"  # Trained: inverted list of each row
+CENTROIDS_FILE = "centroids.npy"
+SCALE_FILE = "scale.npy"
+METADATA_FILE = "metadata.jsonl"
+TRAIN_SIZE = 4096  # Vectors before switching from exact search to IVF-SQ8
+MAX_TRAIN_SAMPLES = 65536
+NPROBE = 8
+
+
+def normalize_rows(x: np.ndarray) -> np.ndarray:
+    return x / np.maximum(np.linalg.norm(x, axis=-1, keepdims=True), 1e-12)
+
+
+def model_input_size(model) -> int:
+    """Resolution the model runs at (smaller under a reduced-resolution fast mode)"""
+    patch_embed = getattr(model, "patch_embed", None)
+    return patch_embed.img_size[0] if patch_embed is not None else IMAGE_SIZE
+
+
+def embedding_identity(model) -> str:
+    """Fingerprint the layers and inference mode that shape the embedding
+
+    The patch embedding and final norm change whenever the backbone is
+    fine-tuned, but not when only the head is retrained (train_head.py), so
+    the index survives head-only retraining. Reduced resolution and token
+    merging (fast_vit.py) shift the embeddings too, so they get their own
+    identity and an index is never mixed across modes.
+    """
+    digest = hashlib.sha256()
+    state = model.state_dict()
+    for name in ("patch_embed.proj.weight", "norm.weight", "norm.bias"):
+        if name in state:
+            digest.update(state[name].detach().float().contiguous().numpy().tobytes())
+    identity = digest.hexdigest()[:16]
+
+    mode = {}
+    if model_input_size(model) != IMAGE_SIZE:
+        mode["res"] = model_input_size(model)
+    if getattr(model, "tome_r", 0):
+        mode["tome"] = model.tome_r
+    return f"{identity}-{format_fast_mode(mode)}" if mode else identity
+
+
+def spherical_kmeans(x: np.ndarray, k: int, iterations: int = 10, seed: int = 0) -> np.ndarray:
+    """k-means on unit vectors with cosine assignment; returns unit centroids"""
+    rng = np.random.default_rng(seed)
+    centroids = x[rng.choice(len(x), k, replace=False)].copy()
+    for _ in range(iterations):
+        assignments = np.argmax(x @ centroids.T, axis=1)
+        sums = np.zeros_like(centroids)
+        np.add.at(sums, assignments, x)
+        counts = np.bincount(assignments, minlength=k)
+        # Re-seed empty clusters from random points
+        empty = counts == 0
+        sums[empty] = x[rng.choice(len(x), int(empty.sum()))]
+        centroids = normalize_rows(sums)
+    return centroids
+
+
+class _Growable:
+    """Append-only array with amortized doubling"""
+
+    def __init__(self, row_shape: Tuple[int, ...], dtype, data: Optional[np.ndarray] = None):
+        self.size = 0 if data is None else len(data)
+        capacity = max(1024, self.size)
+        self._data = np.empty((capacity,) + row_shape, dtype=dtype)
+        if data is not None:
+            self._data[:self.size] = data
+
+    def append(self, rows: np.ndarray):
+        needed = self.size + len(rows)
+        if needed > len(self._data):
+            grown = np.empty((max(needed, 2 * len(self._data)),) + self._data.shape[1:], dtype=self._data.dtype)
+            grown[:self.size] = self._data[:self.size]
+            self._data = grown
+        self._data[self.size:needed] = rows
+        self.size = needed
+
+    @property
+    def view(self) -> np.ndarray:
+        return self._data[:self.size]
+
+
+class EmbeddingIndex:
+    """Exact, then IVF-SQ8, cosine-similarity index persisted under `path`"""
+
+    def __init__(self, path: str, dim: int, identity: Optional[str] = None,
+                 train_size: int = TRAIN_SIZE, nprobe: int = NPROBE, read_only: bool = False):
+        self.path = path
+        self.read_only = read_only
+        self.dim = dim
+        self.identity = identity
+        self.train_size = train_size
+        self.nprobe = nprobe
+        self.trained = False
+        self.centroids: Optional[np.ndarray] = None
+        self.scale: Optional[np.ndarray] = None
+        self._lock = threading.Lock()
+
+        if not read_only:
+            os.makedirs(path, exist_ok=True)
+        self._load()
+
+    # --- Persistence ---
+    def _file(self, name: str) -> str:
+        return os.path.join(self.path, name)
+
+    def _load(self):
+        info = {}
+        if os.path.exists(self._file(INDEX_FILE)):
+            with open(self._file(INDEX_FILE)) as f:
+                info = json.load(f)
+            if info["dim"] != self.dim:
+                raise ValueError(f"{self.path} holds {info['dim']}-d vectors, model produces {self.dim}-d")
+            if self.identity and info.get("identity") and info["identity"] != self.identity:
+                raise ValueError(
+                    f"{self.path} was built with a different backbone or VIT_FAST_MODE "
+                    f"({info['identity']}, model is {self.identity}); use another directory or move it aside"
+                )
+            self.trained = info.get("trained", False)
+
+        # Metadata lines are the source of truth for how many rows were completely written
+        offsets = [0]
+        if os.path.exists(self._file(METADATA_FILE)):
+            with open(self._file(METADATA_FILE), "rb") as f:
+                for line in f:
+                    if not line.endswith(b"\n"):
+                        break
+                    offsets.append(offsets[-1] + len(line))
+
+        if self.trained:
+            self.centroids = np.load(self._file(CENTROIDS_FILE))
+            self.scale = np.load(self._file(SCALE_FILE))
+            codes = self._read_rows(CODES_FILE, np.int8, (self.dim,))
+            lists = self._read_rows(LISTS_FILE, np.int32, ())
+            count = min(len(codes), len(lists), len(offsets) - 1)
+            self._rows = _Growable((self.dim,), np.int8, codes[:count])
+            self._assignments = _Growable((), np.int32, lists[:count])
+            self._rebuild_lists()
+            row_files = [(CODES_FILE, self.dim), (LISTS_FILE, 4)]
+        else:
+            vectors = self._read_rows(VECTORS_FILE, np.float32, (self.dim,))
+            count = min(len(vectors), len(offsets) - 1)
+            self._rows = _Growable((self.dim,), np.float32, vectors[:count])
+            self._assignments = None
+            row_files = [(VECTORS_FILE, 4 * self.dim)]
+        self._offsets = _Growable((), np.int64, np.array(offsets[:count], dtype=np.int64))
+
+        if self.read_only:
+            self._row_file = self._list_file = self._metadata_file = None
+            return
+
+        # Drop a partially written tail (e.g. after a crash) so the files line up again
+        for name, row_bytes in row_files + [(METADATA_FILE, None)]:
+            if os.path.exists(self._file(name)):
+                os.truncate(self._file(name), offsets[count] if row_bytes is None else count * row_bytes)
+
+        self._open_appenders()
+        if not info:
+            self._write_info()
+
+    def _read_rows(self, name: str, dtype, row_shape: Tuple[int, ...]) -> np.ndarray:
+        if not os.path.exists(self._file(name)):
+            return np.empty((0,) + row_shape, dtype=dtype)
+        data = np.fromfile(self._file(name), dtype=np.uint8)
+        row_bytes = np.dtype(dtype).itemsize * int(np.prod(row_shape))
+        complete = len(data) // row_bytes * row_bytes
+        return data[:complete].view(dtype).reshape((-1,) + row_shape)
+
+    def _open_appenders(self):
+        if self.trained:
+            self._row_file = open(self._file(CODES_FILE), "ab")
+            self._list_file = open(self._file(LISTS_FILE), "ab")
+        else:
+            self._row_file = open(self._file(VECTORS_FILE), "ab")
+            self._list_file = None
+        self._metadata_file = open(self._file(METADATA_FILE), "ab")
+
+    def _close_appenders(self):
+        for f in (self._row_file, self._list_file, self._metadata_file):
+            if f is not None:
+                f.close()
+
+    def _write_info(self):
+        info = {
+            "dim": self.dim,
+            "identity": self.identity,
+            "trained": self.trained,
+            "nlist": len(self.centroids) if self.centroids is not None else 0,
+        }
+        tmp_path = self._file(INDEX_FILE) + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump(info, f)
+        os.replace(tmp_path, self._file(INDEX_FILE))
+
+    def flush(self):
+        with self._lock:
+            for f in (self._row_file, self._list_file, self._metadata_file):
+                if f is not None:
+                    f.flush()
+
+    def close(self):
+        with self._lock:
+            self._close_appenders()
+
+    # --- Building ---
+    def __len__(self) -> int:
+        return self._rows.size
+
+    def _quantize(self, x: np.ndarray) -> np.ndarray:
+        return np.clip(np.rint(x / self.scale), -127, 127).astype(np.int8)
+
+    def _assign(self, x: np.ndarray) -> np.ndarray:
+        return np.argmax(x @ self.centroids.T, axis=1).astype(np.int32)
+
+    def _rebuild_lists(self):
+        assignments = self._assignments.view
+        order = np.argsort(assignments, kind="stable").astype(np.int64)
+        bounds = np.searchsorted(assignments[order], np.arange(len(self.centroids) + 1))
+        self._lists = [_Growable((), np.int64, order[bounds[i]:bounds[i + 1]]) for i in range(len(self.centroids))]
+
+    def add(self, vectors: np.ndarray, metadata: Sequence[Dict[str, Any]]) -> List[int]:
+        """Append vectors (n, dim) with one metadata dict each; returns their ids"""
+        if self.read_only:
+            raise RuntimeError(f"{self.path} is opened read-only")
+        vectors = normalize_rows(np.asarray(vectors, dtype=np.float32).reshape(-1, self.dim))
+        with self._lock:
+            start = len(self)
+            ids = list(range(start, start + len(vectors)))
+
+            offsets = []
+            for vector_id, meta in zip(ids, metadata):
+                offsets.append(self._metadata_file.tell())
+                record = {"id": vector_id, "added_at": time.time(), **meta}
+                self._metadata_file.write((json.dumps(record) + "\n").encode())
+
+            if self.trained:
+                codes = self._quantize(vectors)
+                assignments = self._assign(vectors)
+                self._row_file.write(codes.tobytes())
+                self._list_file.write(assignments.tobytes())
+                self._rows.append(codes)
+                self._assignments.append(assignments)
+                for vector_id, list_id in zip(ids, assignments):
+                    self._lists[list_id].append(np.array([vector_id], dtype=np.int64))
+            else:
+                self._row_file.write(vectors.tobytes())
+                self._rows.append(vectors)
+            self._offsets.append(np.array(offsets, dtype=np.int64))
+
+            if not self.trained and len(self) >= self.train_size:
+                self._train()
+        return ids
+
+    def train(self, nlist: Optional[int] = None, seed: int = 0):
+        """(Re)build the coarse quantizer and int8 codes from the stored vectors"""
+        if self.read_only:
+            raise RuntimeError(f"{self.path} is opened read-only")
+        with self._lock:
+            self._train(nlist, seed)
+
+    def _train(self, nlist: Optional[int] = None, seed: int = 0):
+        start = time.perf_counter()
+        vectors = self._rows.view
+        if self.trained:
+            # Re-training works from the dequantized codes
+            vectors = normalize_rows(vectors.astype(np.float32) * self.scale)
+        if len(vectors) == 0:
+            return
+
+        rng = np.random.default_rng(seed)
+        sample = vectors[rng.choice(len(vectors), min(len(vectors), MAX_TRAIN_SAMPLES), replace=False)]
+        nlist = min(nlist or max(1, int(4 * math.sqrt(len(vectors)))), len(sample))
+
+        self.centroids = spherical_kmeans(sample, nlist, seed=seed)
+        # Per-dimension scale from a high percentile, so a few outliers don't waste the int8 range
+        self.scale = np.maximum(np.percentile(np.abs(sample), 99.9, axis=0), 1e-6).astype(np.float32) / 127
+
+        codes = np.empty((len(vectors), self.dim), dtype=np.int8)
+        assignments = np.empty(len(vectors), dtype=np.int32)
+        for i in range(0, len(vectors), 65536):
+            chunk = vectors[i:i + 65536]
+            codes[i:i + len(chunk)] = self._quantize(chunk)
+            assignments[i:i + len(chunk)] = self._assign(chunk)
+
+        # Rewrite the row files, then switch the index over atomically via index.json
+        self._close_appenders()
+        for name, array in ((CODES_FILE, codes), (LISTS_FILE, assignments)):
+            array.tofile(self._file(name) + ".tmp")
+            os.replace(self._file(name) + ".tmp", self._file(name))
+        np.save(self._file(CENTROIDS_FILE), self.centroids)
+        np.save(self._file(SCALE_FILE), self.scale)
+
+        self.trained = True
+        self._write_info()
+        if os.path.exists(self._file(VECTORS_FILE)):
+            os.remove(self._file(VECTORS_FILE))
+
+        self._rows = _Growable((self.dim,), np.int8, codes)
+        self._assignments = _Growable((), np.int32, assignments)
+        self._rebuild_lists()
+        self._open_appenders()
+        print(f"Embedding index trained: {len(vectors)} vectors, {nlist} lists "
+              f"in {time.perf_counter() - start:.1f}s")
+
+    # --- Querying ---
+    def search(self, query: np.ndarray, k: int = 5) -> List[Dict[str, Any]]:
+        """Top-k most similar stored vectors, each as its metadata plus `score` (cosine similarity)"""
+        query = normalize_rows(np.asarray(query, dtype=np.float32).reshape(self.dim))
+        with self._lock:
+            if len(self) == 0:
+                return []
+            if self.trained:
+                probe = np.argsort(-(self.centroids @ query))[:self.nprobe]
+                candidates = np.concatenate([self._lists[i].view for i in probe])
+                scores = self._rows.view[candidates].astype(np.float32) @ (query * self.scale)
+            else:
+                candidates = np.arange(len(self))
+                scores = self._rows.view @ query
+
+            k = min(k, len(candidates))
+            if k == 0:
+                return []
+            top = np.argpartition(-scores, k - 1)[:k]
+            top = top[np.argsort(-scores[top])]
+            offsets = [int(self._offsets.view[candidates[i]]) for i in top]
+            if self._metadata_file is not None:
+                self._metadata_file.flush()
+
+        results = []
+        with open(self._file(METADATA_FILE), "rb") as f:
+            for offset, i in zip(offsets, top):
+                f.seek(offset)
+                results.append({**json.loads(f.readline()), "score": round(float(scores[i]), 4)})
+        return results
+
+    def stats(self) -> Dict[str, Any]:
+        return {
+            "vectors": len(self),
+            "dim": self.dim,
+            "trained": self.trained,
+            "nlist": len(self.centroids) if self.centroids is not None else 0,
+            "nprobe": self.nprobe,
+            "bytes_per_vector": self.dim if self.trained else 4 * self.dim,
+        }
+
+
+# --- Command line: reference images ---
+def list_labelled_images(root: str) -> List[Tuple[str, str]]:
+    """(path, label) pairs; labels come from the class folder, or from the file name as in eval.py"""
+    from eval import extract_label
+
+    images = []
+    for directory, _, files in sorted(os.walk(root)):
+        for fname in sorted(files):
+            if not fname.lower().endswith(('.jpg', '.jpeg', '.png')):
+                continue
+            label = os.path.basename(directory) if directory != root else extract_label(fname)
+            images.append((os.path.join(directory, fname), label))
+    return images
+
+
+@torch.inference_mode()
+def embed_images(model, paths: List[str], batch_size: int) -> np.ndarray:
+    size = model_input_size(model)
+    embeddings = []
+    for i in range(0, len(paths), batch_size):
+        batch = torch.stack([preprocess_image(path, size) for path in paths[i:i + batch_size]])
+        embeddings.append(model.forward_head(model.forward_features(batch), pre_logits=True).float().numpy())
+        print(f"   {min(i + batch_size, len(paths))}/{len(paths)} images embedded", end="\r")
+    print()
+    return np.concatenate(embeddings) if embeddings else np.empty((0, model.num_features), dtype=np.float32)
+
+
+def main():
+    from model_loader import load_classifier
+
+    parser = argparse.ArgumentParser(description="Manage the similar-cases embedding index")
+    parser.add_argument("--index-dir", default=INDEX_DIR)
+    parser.add_argument("--checkpoint", default="vit_plantvillage.pth")
+    parser.add_argument("--vit-mode", default=os.getenv("VIT_FAST_MODE", ""),
+                        help="Fast ViT mode the server runs with, e.g. res=160 (default: $VIT_FAST_MODE)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    add_parser = subparsers.add_parser("add", help="Embed and add labelled reference images")
+    add_parser.add_argument("image_dir")
+    add_parser.add_argument("--batch-size", type=int, default=16)
+    add_parser.add_argument("--source", default="reference")
+
+    train_parser = subparsers.add_parser("train", help="(Re)train the IVF lists, e.g. after the index has grown")
+    train_parser.add_argument("--nlist", type=int, help="Number of inverted lists (default: 4 * sqrt(vectors))")
+
+    search_parser = subparsers.add_parser("search", help="Find the images most similar to one image")
+    search_parser.add_argument("image")
+    search_parser.add_argument("-k", type=int, default=5)
+
+    subparsers.add_parser("stats", help="Print index statistics")
+    args = parser.parse_args()
+
+    model, _ = load_classifier(args.checkpoint)
+    apply_fast_mode(model, args.vit_mode)
+    index = EmbeddingIndex(args.index_dir, model.num_features, identity=embedding_identity(model))
+
+    if args.command == "add":
+        images = list_labelled_images(args.image_dir)
+        print(f"🔄 Embedding {len(images)} reference images...")
+        vectors = embed_images(model, [path for path, _ in images], args.batch_size)
+        index.add(vectors, [
+            {"label": label, "source": args.source, "filename": os.path.relpath(path, args.image_dir)}
+            for path, label in images
+        ])
+        print(f"✅ Added {len(images)} images; index now holds {len(index)} vectors")
+    elif args.command == "train":
+        index.train(args.nlist)
+    elif args.command == "search":
+        query = embed_images(model, [args.image], 1)[0]
+        start = time.perf_counter()
+        neighbors = index.search(query, args.k)
+        print(f"Top {len(neighbors)} neighbors in {(time.perf_counter() - start) * 1000:.1f} ms:")
+        for neighbor in neighbors:
+            print(f"   {neighbor['score']:.4f}  {neighbor.get('label')}  {neighbor.get('filename')}")
+
+    print(json.dumps(index.stats(), indent=1))
+    index.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -1,78 +1,228 @@
-import os
-import torch
-from PIL import Image
-from torchvision import transforms
-from sklearn.metrics import classification_report, confusion_matrix
-import timm
-import numpy as np
-import re
-
-# --- Config ---
-test_dir = "test/test_renamed"
-checkpoint_path = "vit_plantvillage.pth"
-device = "cpu"
-
-# --- Load checkpoint ---
-checkpoint = torch.load(checkpoint_path, map_location=device)
-class_names = checkpoint["class_names"]
-
-# --- Model ---
-model = timm.create_model("vit_base_patch16_224", pretrained=False)
-model.head = torch.nn.Linear(model.head.in_features, len(class_names))
-model.load_state_dict(checkpoint["model_state_dict"])
-model = model.to(device)
-model.eval()
-
-# --- Transform ---
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5))
-])
-
-# --- Helper to get true label from filename ---
-def extract_label(filename):
-    name = os.path.splitext(filename)[0]  # remove extension
-    label = re.sub(r'\d+$', '', name)     # remove trailing digits
-    return label
-
-# --- Collect predictions ---
-y_true, y_pred = [], []
-
-for fname in os.listdir(test_dir):
-    if not fname.lower().endswith(('.jpg', '.jpeg', '.png')):
-        continue
-
-    label_name = extract_label(fname)
-    if label_name not in class_names:
-        print(f"⚠️ Skipping {fname}: unknown class {label_name}")
-        continue
-
-    img_path = os.path.join(test_dir, fname)
-    img = Image.open(img_path).convert("RGB")
-    img_t = transform(img).unsqueeze(0).to(device)
-
-    with torch.no_grad():
-        output = model(img_t)
-        pred = torch.argmax(output, dim=1).item()
-
-    y_true.append(class_names.index(label_name))
-    y_pred.append(pred)
-
-# --- Metrics ---
-print("\nClassification Report:\n")
-# Find classes actually present in test set
-present_classes = sorted(list(set([class_names[i] for i in y_true])), key=lambda x: class_names.index(x))
-present_indices = [class_names.index(c) for c in present_classes]
-
-print("\nClassification Report:\n")
-print(classification_report(
-    y_true, y_pred, labels=present_indices, target_names=present_classes, digits=4
-))
-
-
-cm = confusion_matrix(y_true, y_pred)
-print("Confusion Matrix:\n", cm)
-
-accuracy = np.mean(np.array(y_true) == np.array(y_pred))
-print(f"\nOverall Accuracy: {accuracy * 100:.2f}%")
+import os
+import time
+import argparse
+import torch
+from torch.utils.data import Dataset, DataLoader
+from sklearn.metrics import classification_report, confusion_matrix
+import numpy as np
+import re
+from model_loader import load_classifier
+from preprocess import preprocess_image
+from prepare_dataset import PreparedImageDataset
+from precision import PRECISIONS, apply_precision, autocast_context, resolve_precision
+
+# --- Config ---
+test_dir = "test/test_renamed"
+checkpoint_path = "vit_plantvillage.pth"
+device = "cpu"
+logits_path = "eval_logits.npz"
+
+# --- Helper to get true label from filename ---
+def extract_label(filename):
+    name = os.path.splitext(filename)[0]  # remove extension
+    label = re.sub(r'\d+$', '', name)     # remove trailing digits
+    return label
+
+# --- Dataset ---
+class TestImageDataset(Dataset):
+    """Labelled test images; labels come from the file names"""
+
+    def __init__(self, test_dir, class_names, size=224):
+        self.size = size
+        self.paths, self.labels = [], []
+        for fname in sorted(os.listdir(test_dir)):
+            if not fname.lower().endswith(('.jpg', '.jpeg', '.png')):
+                continue
+
+            label_name = extract_label(fname)
+            if label_name not in class_names:
+                print(f"⚠️ Skipping {fname}: unknown class {label_name}")
+                continue
+
+            self.paths.append(os.path.join(test_dir, fname))
+            self.labels.append(class_names.index(label_name))
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, idx):
+        # Decoding and preprocessing run in the DataLoader worker processes
+        return preprocess_image(self.paths[idx], self.size), self.labels[idx]
+
+# --- Collect logits ---
+def evaluate(model, loader, precision="fp32"):
+    """Run the model over (images, labels) batches; returns (logits, labels, seconds spent in the forward pass)"""
+    all_logits, all_labels = [], []
+    inference_time = 0.0
+
+    with torch.inference_mode():
+        for imgs, labels in loader:
+            start = time.perf_counter()
+            with autocast_context(precision):
+                output = model(imgs.to(device))
+            inference_time += time.perf_counter() - start
+
+            all_logits.append(output.float().cpu())
+            all_labels.append(labels)
+
+    return torch.cat(all_logits).numpy(), torch.cat(all_labels).numpy(), inference_time
+
+def save_logits(path, logits, labels, paths, class_names):
+    np.savez_compressed(
+        path, logits=logits, labels=labels,
+        paths=np.array(paths), class_names=np.array(class_names)
+    )
+    print(f"💾 Logits saved to {path}")
+
+def load_logits(path):
+    data = np.load(path)
+    return data["logits"], data["labels"], list(data["class_names"])
+
+# --- Metrics ---
+def print_report(logits, labels, class_names, threshold=0.0):
+    """Print metrics from saved or fresh logits; predictions below `threshold` confidence are rejected"""
+    probs = torch.softmax(torch.from_numpy(logits), dim=1).numpy()
+    confidence = probs.max(axis=1)
+    accepted = confidence >= threshold
+    y_true = labels[accepted].tolist()
+    y_pred = probs.argmax(axis=1)[accepted].tolist()
+
+    if threshold > 0:
+        print(f"\nConfidence threshold {threshold:.2f}: {accepted.sum()}/{len(labels)} predictions accepted "
+              f"({accepted.mean() * 100:.2f}% coverage)")
+    if not y_true:
+        print("⚠️ No predictions above the confidence threshold")
+        return 0.0
+
+    # Find classes actually present in test set
+    present_classes = sorted(list(set([class_names[i] for i in y_true])), key=lambda x: class_names.index(x))
+    present_indices = [class_names.index(c) for c in present_classes]
+
+    print("\nClassification Report:\n")
+    print(classification_report(
+        y_true, y_pred, labels=present_indices, target_names=present_classes, digits=4
+    ))
+
+    cm = confusion_matrix(y_true, y_pred)
+    print("Confusion Matrix:\n", cm)
+
+    accuracy = np.mean(np.array(y_true) == np.array(y_pred))
+    print(f"\nOverall Accuracy: {accuracy * 100:.2f}%")
+    return accuracy
+
+def print_cascade_report(fast_logits, full_logits, labels, thresholds, fast_ms, full_ms):
+    """Escalation rate, accuracy and cost of the fast -> full model cascade at each confidence threshold"""
+    fast_probs = torch.softmax(torch.from_numpy(fast_logits), dim=1).numpy()
+    fast_pred = fast_probs.argmax(axis=1)
+    full_pred = full_logits.argmax(axis=1)
+    full_accuracy = np.mean(full_pred == labels)
+
+    print("\nCascade (fast model first, full model below the threshold):\n")
+    print(f"fast model alone: {np.mean(fast_pred == labels) * 100:.2f}% at {fast_ms:.1f} ms/image, "
+          f"full model alone: {full_accuracy * 100:.2f}% at {full_ms:.1f} ms/image\n")
+    print(f"{'threshold':<11}{'escalated':>11}{'fast-path acc':>15}{'combined':>11}{'Δ vs full':>11}"
+          f"{'ms/image':>10}{'speedup':>9}")
+    for threshold in thresholds:
+        escalated = fast_probs.max(axis=1) < threshold
+        combined = np.where(escalated, full_pred, fast_pred)
+        accuracy = np.mean(combined == labels)
+        kept = ~escalated
+        fast_path_accuracy = f"{np.mean(fast_pred[kept] == labels[kept]) * 100:.2f}%" if kept.any() else "-"
+        # Escalated images pay for both models
+        latency = fast_ms + escalated.mean() * full_ms
+        print(
+            f"{threshold:<11.2f}{escalated.mean() * 100:>10.2f}%{fast_path_accuracy:>15}{accuracy * 100:>10.2f}%"
+            f"{(accuracy - full_accuracy) * 100:>+10.2f}%{latency:>10.1f}{full_ms / latency:>8.2f}x"
+        )
+
+def logits_path_for(base_path, precision, multiple):
+    if not multiple:
+        return base_path
+    stem, ext = os.path.splitext(base_path)
+    return f"{stem}_{precision}{ext}"
+
+def load_test_set(args, class_names):
+    """Return (dataset, batch iterable) for the test split"""
+    if args.prepared:
+        # Pre-resized shards: batches are zero-copy slices, no decoding workers needed
+        dataset = PreparedImageDataset(os.path.join(args.prepared, "test"))
+        if dataset.classes != class_names:
+            raise ValueError(f"{args.prepared} was prepared with different classes than {args.checkpoint}")
+        return dataset, dataset.iter_batches(args.batch_size)
+    dataset = TestImageDataset(args.test_dir, class_names)
+    return dataset, DataLoader(dataset, batch_size=args.batch_size, num_workers=args.workers)
+
+def main():
+    parser = argparse.ArgumentParser(description="Evaluate the trained model on the test set")
+    parser.add_argument("--test-dir", default=test_dir)
+    parser.add_argument("--checkpoint", default=checkpoint_path)
+    parser.add_argument(
+        "--precision", nargs="+", default=["fp32"], choices=PRECISIONS,
+        help="One or more inference precision modes to evaluate and compare"
+    )
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="DataLoader worker processes for decoding")
+    parser.add_argument("--save-logits", default=logits_path,
+                        help="Where to save logits and labels (suffixed per precision when comparing)")
+    parser.add_argument("--prepared", help="Read the test split from a prepare_dataset.py output directory")
+    parser.add_argument("--from-logits", help="Recompute metrics from saved logits without running the model")
+    parser.add_argument("--threshold", type=float, default=0.0,
+                        help="Reject predictions below this confidence when computing metrics")
+    parser.add_argument("--cascade", help="Fast first-pass checkpoint to evaluate as a cascade in front of --checkpoint")
+    parser.add_argument("--cascade-thresholds", type=float, nargs="+", default=[0.5, 0.7, 0.8, 0.9, 0.95, 0.99],
+                        help="Fast-model confidence below which images escalate to the full model")
+    args = parser.parse_args()
+
+    if args.from_logits:
+        logits, labels, class_names = load_logits(args.from_logits)
+        print_report(logits, labels, class_names, args.threshold)
+        return
+
+    results = []
+    for requested in args.precision:
+        precision = resolve_precision(requested)
+        model, class_names = load_classifier(args.checkpoint, device)
+        model = apply_precision(model, precision)
+
+        dataset, loader = load_test_set(args, class_names)
+        if len(dataset) == 0:
+            print("⚠️ No labelled test images found")
+            return
+
+        print(f"\n===== Precision: {precision} =====")
+        logits, labels, inference_time = evaluate(model, loader, precision)
+        save_logits(
+            logits_path_for(args.save_logits, precision, len(args.precision) > 1),
+            logits, labels, dataset.paths, class_names
+        )
+
+        accuracy = print_report(logits, labels, class_names, args.threshold)
+        results.append((precision, accuracy, inference_time * 1000 / len(dataset)))
+
+        if args.cascade:
+            fast_model, fast_class_names = load_classifier(args.cascade, device)
+            if fast_class_names != class_names:
+                raise ValueError(f"{args.cascade} was trained on different classes than {args.checkpoint}")
+            fast_model = apply_precision(fast_model, precision)
+            _, fast_loader = load_test_set(args, class_names)
+            fast_logits, _, fast_time = evaluate(fast_model, fast_loader, precision)
+            print_cascade_report(
+                fast_logits, logits, labels, args.cascade_thresholds,
+                fast_time * 1000 / len(dataset), inference_time * 1000 / len(dataset)
+            )
+
+    # --- Accuracy vs latency summary ---
+    if len(results) > 1:
+        baseline_accuracy = results[0][1]
+        baseline_latency = results[0][2]
+        print("\nPrecision comparison:\n")
+        print(f"{'precision':<10}{'top-1':>10}{'Δ top-1':>10}{'ms/image':>12}{'speedup':>10}")
+        for precision, accuracy, latency in results:
+            print(
+                f"{precision:<10}{accuracy * 100:>9.2f}%{(accuracy - baseline_accuracy) * 100:>+9.2f}%"
+                f"{latency:>12.1f}{baseline_latency / latency:>9.2f}x"
+            )
+
+if __name__ == "__main__":
+    main()
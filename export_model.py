@@ -0,0 +1,175 @@
+#!/usr/bin/env python3
+"""
+Export the trained checkpoint to ahead-of-time artifacts and compare backends.
+
+    python export_model.py export --formats torchscript onnx
+    python export_model.py verify
+    python export_model.py benchmark --batch-size 8
+"""
+
+import argparse
+import inspect
+import json
+import os
+import time
+import warnings
+
+import torch
+
+from model_backends import ARTIFACT_FILES, BACKENDS, MANIFEST_NAME, load_backend, load_manifest
+from model_loader import load_classifier
+from prediction_cache import checkpoint_identity
+
+# --- Config ---
+CHECKPOINT_PATH = "vit_plantvillage.pth"
+ARTIFACT_DIR = "artifacts"
+INPUT_SHAPE = (3, 224, 224)
+
+
+def export_torchscript(model, path):
+    example = torch.randn(2, *INPUT_SHAPE)
+    with torch.no_grad():
+        traced = torch.jit.trace(model, example)
+        traced = torch.jit.freeze(traced)
+    traced.save(path)
+
+
+def export_onnx(model, path):
+    example = torch.randn(2, *INPUT_SHAPE)
+    kwargs = {}
+    if "dynamo" in inspect.signature(torch.onnx.export).parameters:
+        # The TorchScript-based exporter handles timm's ViT without extra dependencies
+        kwargs["dynamo"] = False
+    torch.onnx.export(
+        model,
+        (example,),
+        path,
+        input_names=["input"],
+        output_names=["logits"],
+        dynamic_axes={"input": {0: "batch"}, "logits": {0: "batch"}},
+        opset_version=17,
+        **kwargs,
+    )
+
+
+EXPORTERS = {
+    "torchscript": export_torchscript,
+    "onnx": export_onnx,
+}
+
+
+def export(args):
+    os.makedirs(args.artifact_dir, exist_ok=True)
+    model, class_names = load_classifier(args.checkpoint)
+
+    artifacts = {}
+    for fmt in args.formats:
+        path = os.path.join(args.artifact_dir, ARTIFACT_FILES[fmt])
+        print(f"📦 Exporting {fmt} -> {path}")
+        start = time.perf_counter()
+        with warnings.catch_warnings():
+            warnings.simplefilter("ignore")
+            EXPORTERS[fmt](model, path)
+        print(f"   done in {time.perf_counter() - start:.1f}s")
+        artifacts[fmt] = ARTIFACT_FILES[fmt]
+
+    # Merge with any artifacts exported earlier from the same checkpoint
+    checkpoint_id = checkpoint_identity(args.checkpoint)
+    manifest_path = os.path.join(args.artifact_dir, MANIFEST_NAME)
+    if os.path.exists(manifest_path):
+        previous = load_manifest(args.artifact_dir)
+        if previous.get("checkpoint_id") == checkpoint_id:
+            artifacts = {**previous.get("artifacts", {}), **artifacts}
+
+    with open(manifest_path, "w") as f:
+        json.dump({
+            "checkpoint": args.checkpoint,
+            "checkpoint_id": checkpoint_id,
+            "class_names": class_names,
+            "input_shape": list(INPUT_SHAPE),
+            "artifacts": artifacts,
+        }, f, indent=2)
+    print(f"✅ Manifest written to {manifest_path}")
+
+
+def load_backends(args):
+    eager_model, _ = load_classifier(args.checkpoint)
+    models = {}
+    for backend in args.backends:
+        try:
+            models[backend] = load_backend(backend, eager_model=eager_model, artifact_dir=args.artifact_dir)
+        except (FileNotFoundError, ImportError) as e:
+            print(f"⚠️ Skipping {backend}: {e}")
+    return eager_model, models
+
+
+def verify(args):
+    """Check that every backend produces the same logits as the eager model"""
+    eager_model, models = load_backends(args)
+    torch.manual_seed(0)
+    batch = torch.randn(args.batch_size, *INPUT_SHAPE)
+
+    with torch.no_grad():
+        reference = eager_model(batch)
+
+        all_ok = True
+        for backend, model in models.items():
+            logits = model(batch)
+            max_diff = float((logits - reference).abs().max())
+            same_top1 = bool(torch.equal(logits.argmax(dim=1), reference.argmax(dim=1)))
+            ok = max_diff <= args.atol and same_top1
+            all_ok = all_ok and ok
+            print(f"{'✅' if ok else '❌'} {backend:<12} max |Δlogit| = {max_diff:.2e}, same top-1: {same_top1}")
+
+    return 0 if all_ok else 1
+
+
+def benchmark(args):
+    """Report per-backend throughput on random batches"""
+    _, models = load_backends(args)
+    batch = torch.randn(args.batch_size, *INPUT_SHAPE)
+
+    print(f"\n{'backend':<12}{'ms/batch':>12}{'images/s':>12}")
+    with torch.no_grad():
+        for backend, model in models.items():
+            for _ in range(args.warmup):
+                model(batch)
+            start = time.perf_counter()
+            for _ in range(args.iters):
+                model(batch)
+            elapsed = (time.perf_counter() - start) / args.iters
+            print(f"{backend:<12}{elapsed * 1000:>12.1f}{args.batch_size / elapsed:>12.1f}")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Export and compare model backends")
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH)
+    parser.add_argument("--artifact-dir", default=ARTIFACT_DIR)
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    export_parser = subparsers.add_parser("export", help="Write TorchScript/ONNX artifacts")
+    export_parser.add_argument("--formats", nargs="+", default=list(EXPORTERS), choices=list(EXPORTERS))
+
+    verify_parser = subparsers.add_parser("verify", help="Check all backends produce the same logits")
+    verify_parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    verify_parser.add_argument("--batch-size", type=int, default=4)
+    verify_parser.add_argument("--atol", type=float, default=1e-3)
+
+    bench_parser = subparsers.add_parser("benchmark", help="Report per-backend throughput")
+    bench_parser.add_argument("--backends", nargs="+", default=list(BACKENDS), choices=BACKENDS)
+    bench_parser.add_argument("--batch-size", type=int, default=8)
+    bench_parser.add_argument("--iters", type=int, default=10)
+    bench_parser.add_argument("--warmup", type=int, default=2)
+
+    args = parser.parse_args()
+    if args.command == "export":
+        export(args)
+        return 0
+    if args.command == "verify":
+        return verify(args)
+    return benchmark(args)
+
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,161 @@
+"""
+Faster, approximate inference modes for the ViT classifier.
+
+Both modes are training-free and can be combined:
+
+- Reduced resolution (`res=160`): the model runs at a smaller input size with
+  its position embeddings interpolated to the smaller patch grid, e.g. 100
+  patch tokens at 160x160 instead of 196 at 224x224.
+- Token merging (`tome=8`, ToMe, Bolya et al. 2023): after the attention of
+  every block, the 8 most similar pairs of tokens are merged by bipartite soft
+  matching, so each later block sees fewer tokens. Merged tokens are size-
+  weighted averages and attention is weighted by token size, which keeps
+  accuracy close to the full model for small `r`.
+
+Modes are given as comma-separated specs, e.g. "res=192,tome=4"; an empty
+spec is the unmodified model. See benchmark_fast_vit.py for the speed and
+accuracy of each setting.
+"""
+
+import math
+import types
+from typing import Callable, Dict, Optional, Tuple
+
+import torch
+import torch.nn.functional as F
+
+from preprocess import IMAGE_SIZE
+
+MODE_KEYS = ("res", "tome")
+
+
+def parse_fast_mode(spec: Optional[str]) -> Dict[str, int]:
+    """Parse "res=160,tome=8" into {"res": 160, "tome": 8}"""
+    mode = {}
+    for item in (spec or "").split(","):
+        if not item.strip():
+            continue
+        key, _, value = item.partition("=")
+        key = key.strip().lower()
+        if key not in MODE_KEYS or not value.strip().isdigit():
+            raise ValueError(f"Invalid fast mode '{item}'. Use e.g. res=160,tome=8")
+        mode[key] = int(value)
+    return mode
+
+
+def format_fast_mode(mode: Dict[str, int]) -> str:
+    return ",".join(f"{key}={mode[key]}" for key in MODE_KEYS if key in mode) or "full"
+
+
+def apply_fast_mode(model: torch.nn.Module, spec: Optional[str]) -> int:
+    """Configure the model in place for a fast mode; returns the input resolution to preprocess to"""
+    mode = parse_fast_mode(spec)
+    size = mode.get("res", IMAGE_SIZE)
+    if size != IMAGE_SIZE:
+        set_resolution(model, size)
+    if mode.get("tome"):
+        set_token_merging(model, mode["tome"])
+    return size
+
+
+# --- Reduced resolution ---
+def set_resolution(model: torch.nn.Module, size: int):
+    """Run the ViT at size x size, interpolating its position embeddings to the new patch grid"""
+    patch_size = model.patch_embed.patch_size[0]
+    if size % patch_size:
+        raise ValueError(f"Resolution must be a multiple of the patch size ({patch_size}), got {size}")
+    model.set_input_size(img_size=(size, size))
+
+
+# --- Token merging ---
+def bipartite_soft_matching(metric: torch.Tensor, r: int) -> Callable[[torch.Tensor], torch.Tensor]:
+    """
+    Return a function merging the `r` most similar token pairs of (B, N, C) tensors (summing them)
+
+    Tokens are split alternately into two sets; every token of the first set is matched with its most
+    similar token of the second, and the `r` best-matched pairs are merged. The class token (index 0)
+    is never merged and stays first.
+    """
+    tokens = metric.shape[1]
+    r = min(r, (tokens - 1) // 2)
+    if r <= 0:
+        return lambda x: x
+
+    with torch.no_grad():
+        metric = metric / metric.norm(dim=-1, keepdim=True)
+        a, b = metric[:, ::2, :], metric[:, 1::2, :]
+        scores = a @ b.transpose(-1, -2)
+        scores[:, 0, :] = -math.inf
+
+        node_max, node_idx = scores.max(dim=-1)
+        edge_idx = node_max.argsort(dim=-1, descending=True)[..., None]
+        unmerged_idx = edge_idx[:, r:, :].sort(dim=1)[0]  # Sorted, so the class token stays first
+        src_idx = edge_idx[:, :r, :]
+        dst_idx = node_idx[..., None].gather(dim=1, index=src_idx)
+
+    def merge(x: torch.Tensor) -> torch.Tensor:
+        src, dst = x[:, ::2, :], x[:, 1::2, :]
+        n, t, c = src.shape
+        unmerged = src.gather(dim=1, index=unmerged_idx.expand(n, t - r, c))
+        src = src.gather(dim=1, index=src_idx.expand(n, r, c))
+        dst = dst.scatter_reduce(1, dst_idx.expand(n, r, c), src, reduce="sum")
+        return torch.cat([unmerged, dst], dim=1)
+
+    return merge
+
+
+def _attention(attn, x: torch.Tensor, size: Optional[torch.Tensor]) -> Tuple[torch.Tensor, torch.Tensor]:
+    """timm Attention forward that also returns the head-averaged keys (the merging metric)"""
+    batch, tokens, _ = x.shape
+    qkv = attn.qkv(x).reshape(batch, tokens, 3, attn.num_heads, attn.head_dim).permute(2, 0, 3, 1, 4)
+    q, k, v = qkv.unbind(0)
+    q, k = attn.q_norm(q), attn.k_norm(k)
+
+    # Proportional attention: a token standing for s patches gets s times the weight
+    mask = None if size is None else size.log()[:, None, None, :, 0].to(q.dtype)
+    x = F.scaled_dot_product_attention(q, k, v, attn_mask=mask)
+
+    x = x.transpose(1, 2).reshape(batch, tokens, -1)
+    x = getattr(attn, "norm", torch.nn.Identity())(x)
+    x = attn.proj(x)
+    return x, k.mean(dim=1)
+
+
+def _merging_block(block, x: torch.Tensor, size: Optional[torch.Tensor], r: int):
+    """One transformer block with token merging between attention and MLP; returns (x, size)"""
+    attn_out, keys = _attention(block.attn, block.norm1(x), size)
+    x = x + block.drop_path1(block.ls1(attn_out))
+
+    if r > 0:
+        merge = bipartite_soft_matching(keys, r)
+        if size is None:
+            size = torch.ones_like(x[..., :1])
+        x = merge(x * size)
+        size = merge(size)
+        x = x / size
+
+    x = x + block.drop_path2(block.ls2(block.mlp(block.norm2(x))))
+    return x, size
+
+
+def _forward_features_merging(self, x: torch.Tensor, attn_mask=None, is_causal: bool = False) -> torch.Tensor:
+    x = self.patch_embed(x)
+    x = self._pos_embed(x)
+    x = self.patch_drop(x)
+    x = self.norm_pre(x)
+
+    size = None
+    for block in self.blocks:
+        x, size = _merging_block(block, x, size, self.tome_r)
+    return self.norm(x)
+
+
+def set_token_merging(model: torch.nn.Module, r: int):
+    """Merge `r` tokens per block from now on (0 restores the original forward pass)"""
+    if getattr(model, "num_reg_tokens", 0) or model.num_prefix_tokens != 1 or model.global_pool != "token":
+        raise ValueError("Token merging supports ViTs with a single class token used for pooling")
+    model.tome_r = r
+    if r > 0:
+        model.forward_features = types.MethodType(_forward_features_merging, model)
+    elif "forward_features" in vars(model):
+        del model.forward_features
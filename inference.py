@@ -0,0 +1,230 @@
+"""
+Dynamic micro-batching for model inference.
+
+Requests submitted to the engine are held in a shared queue for at most
+`max_wait_ms` (or until `max_batch_size` tensors are waiting) and then run
+through the model as a single batched forward pass. Each caller receives its
+own row of the batched output (a tuple of rows when `predict_fn` returns a
+tuple of batched outputs, with `None` members passed through as `None`).
+
+Forward passes run on a dedicated executor (see `make_executor`) so that the
+asyncio event loop stays free to serve lightweight endpoints while the model
+is busy. Each request records its time in the queue and in the forward pass
+as the `queue` and `forward` stages (see metrics.py).
+
+The queue can be bounded (`max_queue_depth`) and requests can carry a
+deadline; a full queue fails fast with `QueueFullError` and requests whose
+deadline passes before their batch runs fail with `DeadlineExceededError`
+without using the model.
+"""
+
+import asyncio
+import time
+from collections import Counter
+from concurrent.futures import Executor, ThreadPoolExecutor
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+import torch
+
+from metrics import record_stage
+
+
+class QueueFullError(RuntimeError):
+    """The inference queue is at its maximum depth"""
+
+
+class DeadlineExceededError(TimeoutError):
+    """The request's deadline passed before it was run"""
+
+
+def make_executor(max_workers: int, torch_threads: int, name: str) -> ThreadPoolExecutor:
+    """Create a bounded thread pool whose workers each use a fixed torch intra-op thread budget"""
+    def _init_worker():
+        torch.set_num_threads(torch_threads)
+
+    return ThreadPoolExecutor(
+        max_workers=max_workers,
+        thread_name_prefix=name,
+        initializer=_init_worker,
+    )
+
+
+class BatchingInferenceEngine:
+    """Collect single-image tensors into batches and run them together"""
+
+    def __init__(
+        self,
+        predict_fn: Callable[[torch.Tensor], torch.Tensor],
+        max_batch_size: int = 8,
+        max_wait_ms: float = 5.0,
+        executor: Optional[Executor] = None,
+        max_queue_depth: int = 0,
+    ):
+        if max_batch_size < 1:
+            raise ValueError("max_batch_size must be at least 1")
+
+        self.predict_fn = predict_fn
+        self.max_batch_size = max_batch_size
+        self.max_wait_ms = max_wait_ms
+        self.executor = executor
+        self.max_queue_depth = max_queue_depth  # 0 means unbounded
+
+        self._queue: Optional[asyncio.Queue] = None
+        self._worker: Optional[asyncio.Task] = None
+
+        # --- Occupancy statistics ---
+        self._batches = 0
+        self._items = 0
+        self._batch_sizes: Counter = Counter()
+        self._last_batch_size = 0
+        self._rejected = 0
+        self._expired = 0
+        self._forward_ewma: Optional[float] = None  # Seconds per batch
+
+    @property
+    def running(self) -> bool:
+        return self._worker is not None and not self._worker.done()
+
+    async def start(self):
+        """Start the background batching loop"""
+        if self.running:
+            return
+        self._queue = asyncio.Queue(maxsize=self.max_queue_depth)
+        self._worker = asyncio.create_task(self._run())
+
+    async def stop(self):
+        """Stop the batching loop and fail any requests still queued"""
+        if self._worker is None:
+            return
+        self._worker.cancel()
+        try:
+            await self._worker
+        except asyncio.CancelledError:
+            pass
+        self._worker = None
+
+        while self._queue is not None and not self._queue.empty():
+            _, future, _, _ = self._queue.get_nowait()
+            if not future.done():
+                future.set_exception(RuntimeError("Inference engine stopped"))
+
+    async def submit(self, img_tensor: torch.Tensor, deadline: Optional[float] = None) -> torch.Tensor:
+        """Queue one preprocessed image (C, H, W) and wait for its output row
+
+        `deadline` is a `time.monotonic()` timestamp after which the request is abandoned.
+        """
+        if not self.running:
+            raise RuntimeError("Inference engine is not running")
+
+        timeout = None
+        if deadline is not None:
+            timeout = deadline - time.monotonic()
+            if timeout <= 0:
+                self._expired += 1
+                raise DeadlineExceededError("Deadline exceeded before inference")
+
+        future = asyncio.get_running_loop().create_future()
+        try:
+            self._queue.put_nowait((img_tensor, future, time.perf_counter(), deadline))
+        except asyncio.QueueFull:
+            self._rejected += 1
+            raise QueueFullError(f"Inference queue is full ({self.max_queue_depth} images waiting)")
+
+        try:
+            # On timeout the future is cancelled, and the batching loop skips it
+            row, queued, forward = await asyncio.wait_for(future, timeout)
+        except asyncio.TimeoutError:
+            self._expired += 1
+            raise DeadlineExceededError("Deadline exceeded while waiting for inference")
+
+        record_stage("queue", queued)
+        record_stage("forward", forward)
+        return row
+
+    def estimated_wait(self) -> float:
+        """Rough seconds until a newly queued image would be served"""
+        per_batch = self._forward_ewma or 0.0
+        return (self._queue.qsize() // self.max_batch_size + 1) * per_batch if self._queue is not None else 0.0
+
+    async def _collect_batch(self) -> List[Tuple[torch.Tensor, asyncio.Future, float, Optional[float]]]:
+        """Wait for the first request, then gather more until full or timed out"""
+        batch = [await self._queue.get()]
+        deadline = time.monotonic() + self.max_wait_ms / 1000.0
+
+        while len(batch) < self.max_batch_size:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            try:
+                batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+            except asyncio.TimeoutError:
+                break
+
+        return batch
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = await self._collect_batch()
+
+            # Drop requests whose callers have already gone away or whose deadline has passed
+            now = time.monotonic()
+            for _, future, _, deadline in batch:
+                if deadline is not None and deadline <= now and not future.done():
+                    self._expired += 1
+                    future.set_exception(DeadlineExceededError("Deadline exceeded while queued"))
+            batch = [item for item in batch if not item[1].done()]
+            if not batch:
+                continue
+
+            start = time.perf_counter()
+            try:
+                outputs = await loop.run_in_executor(
+                    self.executor, self._forward, [tensor for tensor, _, _, _ in batch]
+                )
+            except Exception as e:
+                for _, future, _, _ in batch:
+                    if not future.done():
+                        future.set_exception(e)
+                continue
+            forward = time.perf_counter() - start
+
+            self._record_batch(len(batch), forward)
+            for row, (_, future, enqueued, _) in zip(self._split_rows(outputs, len(batch)), batch):
+                if not future.done():
+                    future.set_result((row, start - enqueued, forward))
+
+    def _forward(self, tensors: List[torch.Tensor]) -> torch.Tensor:
+        return self.predict_fn(torch.stack(tensors))
+
+    @staticmethod
+    def _split_rows(outputs, size: int):
+        if isinstance(outputs, tuple):
+            return zip(*(output if output is not None else [None] * size for output in outputs))
+        return outputs
+
+    def _record_batch(self, size: int, forward: float):
+        self._forward_ewma = forward if self._forward_ewma is None else 0.8 * self._forward_ewma + 0.2 * forward
+        self._batches += 1
+        self._items += size
+        self._batch_sizes[size] += 1
+        self._last_batch_size = size
+
+    def stats(self) -> Dict[str, Any]:
+        """Batch occupancy statistics for tuning batch size and wait window"""
+        mean_batch_size = self._items / self._batches if self._batches else 0.0
+        return {
+            "max_batch_size": self.max_batch_size,
+            "max_wait_ms": self.max_wait_ms,
+            "batches": self._batches,
+            "images": self._items,
+            "mean_batch_size": round(mean_batch_size, 2),
+            "mean_occupancy": round(mean_batch_size / self.max_batch_size, 3),
+            "last_batch_size": self._last_batch_size,
+            "queue_depth": self._queue.qsize() if self._queue is not None else 0,
+            "max_queue_depth": self.max_queue_depth,
+            "rejected": self._rejected,
+            "expired": self._expired,
+            "mean_forward_ms": round(self._forward_ewma * 1000, 1) if self._forward_ewma is not None else None,
+            "batch_size_histogram": {str(k): v for k, v in sorted(self._batch_sizes.items())},
+        }
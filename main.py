@@ -1,17 +1,35 @@
-from fastapi import FastAPI, File, UploadFile, HTTPException
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, File, UploadFile, HTTPException, Request
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
 from fastapi.middleware.cors import CORSMiddleware
+from PIL import Image
 from pydantic import BaseModel
 import torch
-from PIL import Image
-from torchvision import transforms
-import timm
 import io
 import os
-from typing import Dict, Any
-from openai import OpenAI
+import asyncio
+import functools
+import json
+import time
+import tarfile
+import zipfile
+from typing import Dict, Any, List, Tuple
+from openai import AsyncOpenAI
+import httpx
 import re
 from dotenv import load_dotenv
+from inference import BatchingInferenceEngine, DeadlineExceededError, QueueFullError, make_executor
+from admission import AdmissionController, UploadSizeLimitMiddleware, retry_after_seconds
+from prediction_cache import PredictionCache, checkpoint_identity, hash_image_bytes
+from treatment_cache import TreatmentCache, make_treatment_key
+from precision import apply_precision, autocast_context, resolve_precision
+from model_backends import load_backend, load_manifest
+from model_loader import load_classifier
+from fast_vit import apply_fast_mode, format_fast_mode, parse_fast_mode
+from tiling import aggregate_tiles, decode_tiles
+from embedding_index import EmbeddingIndex, embedding_identity
+from prediction_log import PredictionLog, make_record
+from preprocess import IMAGE_SIZE, decode_image, resize_normalize, to_uint8_tensor
+from metrics import RequestTimings, current_timings, record_stage, registry, run_in_executor, timed_stage
 
 # Load environment variables from .env file
 load_dotenv()
@@ -19,20 +37,101 @@ load_dotenv()
 # --- Configuration ---
 CHECKPOINT_PATH = "vit_plantvillage.pth"
 DEVICE = "cpu"  # Use CPU for deployment, can be changed to "cuda" if GPU available
+INFERENCE_PRECISION = os.getenv("INFERENCE_PRECISION", "fp32")  # fp32, bf16 (autocast) or int8 (dynamic quantization)
+MODEL_BACKEND = os.getenv("MODEL_BACKEND", "eager")  # eager, compile, torchscript or onnx
+ARTIFACT_DIR = os.getenv("ARTIFACT_DIR", "artifacts")  # Exported artifacts, see export_model.py
+# Approximate faster ViT, e.g. "res=160" and/or "tome=8" (see fast_vit.py and benchmark_fast_vit.py); eager/compile only
+VIT_FAST_MODE = os.getenv("VIT_FAST_MODE", "")
+
+# --- Micro-batching Configuration ---
+MAX_BATCH_SIZE = int(os.getenv("MAX_BATCH_SIZE", "8"))  # Max images per forward pass
+BATCH_WAIT_MS = float(os.getenv("BATCH_WAIT_MS", "5"))  # Max time to wait for a batch to fill
+
+# --- Executor Configuration ---
+# Decoding, preprocessing and inference run off the event loop in bounded thread pools
+PREPROCESS_WORKERS = int(os.getenv("PREPROCESS_WORKERS", str(min(4, os.cpu_count() or 1))))
+TORCH_THREADS = int(os.getenv("TORCH_THREADS", str(os.cpu_count() or 1)))  # Intra-op threads for the forward pass
+
+# --- Batch Prediction Configuration ---
+BATCH_PREDICT_SIZE = int(os.getenv("BATCH_PREDICT_SIZE", "16"))  # Images per forward pass in /predict/batch
+MAX_BATCH_FILES = int(os.getenv("MAX_BATCH_FILES", "1000"))  # Max images accepted by one /predict/batch call
+MAX_ARCHIVE_EXTRACT_MB = float(os.getenv("MAX_ARCHIVE_EXTRACT_MB", "1024"))  # Uncompressed image bytes per /predict/batch call
+
+# --- Admission Control Configuration ---
+MAX_QUEUE_DEPTH = int(os.getenv("MAX_QUEUE_DEPTH", "64"))  # Images waiting for inference before 503, 0 is unbounded
+MAX_PENDING_PREDICTIONS = int(os.getenv("MAX_PENDING_PREDICTIONS", "128"))  # Requests in the pipeline before 429
+REQUEST_DEADLINE_MS = float(os.getenv("REQUEST_DEADLINE_MS", "10000"))  # /predict gives up after this, 0 disables
+MAX_UPLOAD_MB = float(os.getenv("MAX_UPLOAD_MB", "10"))  # Per /predict request, enforced while streaming
+MAX_BATCH_UPLOAD_MB = float(os.getenv("MAX_BATCH_UPLOAD_MB", "512"))  # Per /predict/batch request
+
+# --- Warm-up Configuration ---
+# Comma-separated batch sizes to run before reporting ready; default is every size the server uses, "0" disables
+WARMUP_BATCH_SIZES = os.getenv("WARMUP_BATCH_SIZES")
+WARMUP_ITERATIONS = int(os.getenv("WARMUP_ITERATIONS", "1"))  # Forward passes per warm-up batch size
+
+# --- Prediction Cache Configuration ---
+PREDICTION_CACHE_SIZE = int(os.getenv("PREDICTION_CACHE_SIZE", "1024"))  # 0 disables the cache
+PREDICTION_CACHE_TTL = float(os.getenv("PREDICTION_CACHE_TTL", "3600"))  # Seconds, 0 means no expiry
+
+# --- Tiled Prediction Configuration (/predict/tiled) ---
+TILE_MAX_TILES = int(os.getenv("TILE_MAX_TILES", "64"))  # Windows per image; larger images are downscaled to fit
+TILE_STRIDE = int(os.getenv("TILE_STRIDE", "0"))  # Pixels between windows, 0 is the tile size (no overlap)
+TILE_DISEASE_THRESHOLD = float(os.getenv("TILE_DISEASE_THRESHOLD", "0.5"))  # Tile disease probability that decides
+MAX_TILED_UPLOAD_MB = float(os.getenv("MAX_TILED_UPLOAD_MB", "50"))  # High-resolution uploads are larger
+
+# --- Cascade Configuration ---
+# Small first-pass model (e.g. `train.py --model mobilenetv3_small_100 --teacher vit_plantvillage.pth`); unset disables
+CASCADE_CHECKPOINT = os.getenv("CASCADE_CHECKPOINT")
+CASCADE_THRESHOLD = float(os.getenv("CASCADE_THRESHOLD", "0.9"))  # Escalate to the ViT below this first-pass confidence
+
+# --- Similar-Image Search Configuration (see embedding_index.py; eager backend only) ---
+EMBEDDING_INDEX_DIR = os.getenv("EMBEDDING_INDEX_DIR", "embedding_index")  # Empty disables /similar
+INDEX_PREDICTIONS = os.getenv("INDEX_PREDICTIONS", "1") == "1"  # Add each new /predict upload to the index
+EMBEDDING_INDEX_NPROBE = int(os.getenv("EMBEDDING_INDEX_NPROBE", "8"))  # Inverted lists scanned per search
+SIMILAR_MAX_K = 50
+
+# --- Prediction Log Configuration (see prediction_log.py) ---
+PREDICTION_LOG_PATH = os.getenv("PREDICTION_LOG_PATH", "predictions.db")  # SQLite file, empty disables the log
+PREDICTION_LOG_MAX_PENDING = int(os.getenv("PREDICTION_LOG_MAX_PENDING", "10000"))  # Records buffered in memory
+PREDICTION_LOG_MAX_WAIT_MS = float(os.getenv("PREDICTION_LOG_MAX_WAIT_MS", "50"))  # Wait for a full buffer, then drop
+
+# --- Metrics Configuration ---
+SERVER_TIMING = os.getenv("SERVER_TIMING", "0") == "1"  # Return per-stage timings in a Server-Timing header
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+ARCHIVE_EXTENSIONS = ('.zip', '.tar', '.tar.gz', '.tgz')
 
 # --- OpenRouter Configuration ---
 OPENROUTER_API_KEY = os.getenv("OPENROUTER_API_KEY")
-OPENROUTER_BASE_URL = "https://openrouter.ai/api/v1"
+OPENROUTER_BASE_URL = os.getenv("OPENROUTER_BASE_URL", "https://openrouter.ai/api/v1")
 OPENROUTER_MODEL = "meta-llama/llama-3.3-70b-instruct:free"
+LLM_TIMEOUT = float(os.getenv("LLM_TIMEOUT", "60"))  # Seconds per upstream call
+LLM_MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "20"))  # Pooled connections to the LLM API
+TREATMENT_CACHE_PATH = os.getenv("TREATMENT_CACHE_PATH")  # Optional SQLite file for persistent caching
+TREATMENT_CACHE_SIZE = int(os.getenv("TREATMENT_CACHE_SIZE", "1024"))  # Recommendations kept in memory (LRU)
+LLM_EXTRA_HEADERS = {
+    "HTTP-Referer": "https://cropguard-ai.vercel.app",
+    "X-Title": "CropGuard AI Disease Detection",
+}
 
-# Initialize OpenAI client for OpenRouter
+# Initialize async OpenAI client for OpenRouter with a pooled HTTP client
 openai_client = None
 if OPENROUTER_API_KEY:
-    openai_client = OpenAI(
+    openai_client = AsyncOpenAI(
         base_url=OPENROUTER_BASE_URL,
         api_key=OPENROUTER_API_KEY,
+        timeout=LLM_TIMEOUT,
+        http_client=httpx.AsyncClient(
+            limits=httpx.Limits(
+                max_connections=LLM_MAX_CONNECTIONS,
+                max_keepalive_connections=LLM_MAX_CONNECTIONS,
+            ),
+            timeout=httpx.Timeout(LLM_TIMEOUT, connect=10.0),
+        ),
     )
 
+treatment_cache = TreatmentCache(db_path=TREATMENT_CACHE_PATH, max_size=TREATMENT_CACHE_SIZE)
+
 # --- Pydantic Models ---
 class TreatmentRequest(BaseModel):
     disease_name: str
@@ -41,7 +140,100 @@ class TreatmentRequest(BaseModel):
 # --- Global variables for model ---
 model = None
 class_names = None
-transform = None
+transform = None  # Preprocessing function applied to uploaded image bytes
+model_id = None
+precision = None
+model_load_seconds = None
+input_size = IMAGE_SIZE  # Smaller with a reduced-resolution VIT_FAST_MODE
+vit_mode = "full"
+inference_engine = None
+preprocess_executor = None
+inference_executor = None
+worker_pool = None  # Set in pre-forked workers, see serve.py
+warmup_task = None
+warmup_seconds = None
+warmup_error = None
+warmup_batch_sizes: List[int] = []  # Parsed from WARMUP_BATCH_SIZES at startup
+embedding_index = None
+fast_model = None  # First stage of the cascade, see CASCADE_CHECKPOINT
+fast_model_name = None
+fast_engine = None
+cascade_stats = {"fast": 0, "escalated": 0}
+embedding_index_writable = True  # False in all but one pre-forked worker, see serve.py
+prediction_log = None  # Opened per process at startup; serve.py workers share the SQLite file
+
+prediction_cache = PredictionCache(max_size=PREDICTION_CACHE_SIZE, ttl_seconds=PREDICTION_CACHE_TTL)
+admission = AdmissionController(max_pending=MAX_PENDING_PREDICTIONS)
+
+# --- Metrics (exposed on /metrics; stage histograms are recorded via metrics.timed_stage) ---
+request_seconds = registry.histogram(
+    "cropguard_request_seconds", "Time until the response headers are sent",
+    labelnames=("method", "route", "status")
+)
+requests_in_flight = registry.gauge("cropguard_requests_in_flight", "Requests currently being handled")
+registry.gauge(
+    "cropguard_inference_queue_depth", "Images waiting for a batched forward pass",
+    lambda: inference_engine.stats()["queue_depth"] if inference_engine else 0
+)
+rejected_requests = registry.counter(
+    "cropguard_rejected_requests_total", "Requests rejected by admission control", labelnames=("reason",)
+)
+registry.gauge(
+    "cropguard_pending_predictions", "Prediction requests admitted and not yet finished",
+    lambda: admission.pending
+)
+registry.gauge(
+    "cropguard_inference_batches_total", "Batched forward passes run",
+    lambda: inference_engine.stats()["batches"] if inference_engine else 0, kind="counter"
+)
+registry.gauge(
+    "cropguard_inference_images_total", "Images run through batched forward passes",
+    lambda: inference_engine.stats()["images"] if inference_engine else 0, kind="counter"
+)
+registry.gauge(
+    "cropguard_prediction_cache_hits_total", "Prediction cache hits",
+    lambda: prediction_cache.stats()["hits"], kind="counter"
+)
+registry.gauge(
+    "cropguard_prediction_cache_misses_total", "Prediction cache misses",
+    lambda: prediction_cache.stats()["misses"], kind="counter"
+)
+registry.gauge(
+    "cropguard_treatment_cache_hits_total", "Treatment cache hits (memory and disk)",
+    lambda: treatment_cache.stats()["hits"], kind="counter"
+)
+registry.gauge(
+    "cropguard_llm_requests_in_flight", "Upstream LLM calls currently in progress",
+    lambda: treatment_cache.stats()["inflight"]
+)
+registry.gauge(
+    "cropguard_cascade_fast_total", "Predictions answered by the cascade's first-pass model",
+    lambda: cascade_stats["fast"], kind="counter"
+)
+registry.gauge(
+    "cropguard_cascade_escalated_total", "Predictions escalated from the first-pass model to the ViT",
+    lambda: cascade_stats["escalated"], kind="counter"
+)
+registry.gauge(
+    "cropguard_prediction_log_written_total", "Predictions written to the persistent prediction log",
+    lambda: prediction_log.written if prediction_log else 0, kind="counter"
+)
+registry.gauge(
+    "cropguard_prediction_log_dropped_total", "Prediction log records dropped because the write buffer was full",
+    lambda: prediction_log.dropped if prediction_log else 0, kind="counter"
+)
+registry.gauge(
+    "cropguard_prediction_log_failed_total", "Prediction log records that could not be written to the database",
+    lambda: prediction_log.failed if prediction_log else 0, kind="counter"
+)
+registry.gauge(
+    "cropguard_prediction_log_pending", "Prediction log records waiting to be written",
+    lambda: prediction_log.stats()["pending"] if prediction_log else 0
+)
+registry.gauge(
+    "cropguard_embedding_index_vectors", "Vectors in the similar-image index",
+    lambda: len(embedding_index) if embedding_index is not None else 0
+)
 
 # --- Initialize FastAPI app ---
 app = FastAPI(
@@ -50,6 +242,37 @@ app = FastAPI(
     version="1.0.0"
 )
 
+@app.middleware("http")
+async def record_request_metrics(request: Request, call_next):
+    """Track in-flight requests and latency; optionally return the stage timings as Server-Timing"""
+    timings = RequestTimings()
+    token = current_timings.set(timings)
+    requests_in_flight.inc()
+    start = time.perf_counter()
+    status = 500
+    try:
+        response = await call_next(request)
+        status = response.status_code
+    finally:
+        # Streaming responses are counted until their headers are sent, not until the body ends
+        elapsed = time.perf_counter() - start
+        requests_in_flight.dec()
+        current_timings.reset(token)
+        route = getattr(request.scope.get("route"), "path", "unmatched")
+        request_seconds.observe(elapsed, method=request.method, route=route, status=str(status))
+
+    if SERVER_TIMING:
+        response.headers["Server-Timing"] = timings.server_timing(total=elapsed)
+    return response
+
+# --- Upload size limits, checked while the body streams in ---
+app.add_middleware(UploadSizeLimitMiddleware, limits={
+    "/predict": int(MAX_UPLOAD_MB * 1024 * 1024),
+    "/predict/batch": int(MAX_BATCH_UPLOAD_MB * 1024 * 1024),
+    "/similar": int(MAX_UPLOAD_MB * 1024 * 1024),
+    "/predict/tiled": int(MAX_TILED_UPLOAD_MB * 1024 * 1024),
+})
+
 # --- CORS middleware ---
 app.add_middleware(
     CORSMiddleware,
@@ -61,30 +284,321 @@ app.add_middleware(
 
 def load_model():
     """Load the trained Vision Transformer model"""
-    global model, class_names, transform
+    global model, class_names, transform, model_id, precision, model_load_seconds, input_size, vit_mode
+    load_start = time.perf_counter()
+
+    if MODEL_BACKEND in ("torchscript", "onnx"):
+        # Exported artifacts carry their own class names; no need to rebuild the timm model
+        manifest = load_manifest(ARTIFACT_DIR)
+        class_names = manifest["class_names"]
+        if os.path.exists(CHECKPOINT_PATH) and checkpoint_identity(CHECKPOINT_PATH) != manifest["checkpoint_id"]:
+            print(f"⚠️ Artifacts in {ARTIFACT_DIR} were exported from a different checkpoint than {CHECKPOINT_PATH}")
+
+        model = load_backend(MODEL_BACKEND, artifact_dir=ARTIFACT_DIR, num_threads=TORCH_THREADS)
+        if INFERENCE_PRECISION != "fp32":
+            print(f"⚠️ INFERENCE_PRECISION={INFERENCE_PRECISION} is ignored by the {MODEL_BACKEND} backend")
+        if VIT_FAST_MODE:
+            print(f"⚠️ VIT_FAST_MODE={VIT_FAST_MODE} is ignored by the {MODEL_BACKEND} backend")
+        precision = "fp32"
+        model_id = f"{manifest['checkpoint_id']}-{MODEL_BACKEND}"
+    else:
+        if not os.path.exists(CHECKPOINT_PATH):
+            raise FileNotFoundError(f"Model checkpoint not found: {CHECKPOINT_PATH}")
+
+        model, class_names = load_classifier(CHECKPOINT_PATH, DEVICE)
+        input_size = apply_fast_mode(model, VIT_FAST_MODE)
+        vit_mode = format_fast_mode(parse_fast_mode(VIT_FAST_MODE))
+
+        precision = resolve_precision(INFERENCE_PRECISION)
+        model = apply_precision(model, precision)
+        model = load_backend(MODEL_BACKEND, eager_model=model)
+        model_id = f"{checkpoint_identity(CHECKPOINT_PATH)}-{precision}"
+        if VIT_FAST_MODE:
+            model_id += f"-{vit_mode}"
+
+    if CASCADE_CHECKPOINT:
+        load_fast_model()
+        # Cascade answers differ from the ViT's, so they must not share cached predictions
+        model_id += f"+{checkpoint_identity(CASCADE_CHECKPOINT)}@{CASCADE_THRESHOLD}"
+
+    # Shared fast preprocessing (same as predict.py and eval.py), timed per stage
+    transform = preprocess_upload
+
+    model_load_seconds = time.perf_counter() - load_start
+    print(f"Model loaded successfully in {model_load_seconds:.2f}s with {len(class_names)} classes: {class_names}")
+    print(f"Inference backend: {MODEL_BACKEND}, precision: {precision}, "
+          f"mode: {vit_mode} at {input_size}x{input_size}")
+
+def load_fast_model():
+    """Load the cascade's first-pass model; it must predict the same classes as the ViT"""
+    global fast_model, fast_model_name
+    fast_model, fast_class_names = load_classifier(CASCADE_CHECKPOINT, DEVICE)
+    if fast_class_names != class_names:
+        raise ValueError(f"{CASCADE_CHECKPOINT} was trained on different classes than the main model")
+    fast_model = apply_precision(fast_model, precision)
+    fast_model_name = fast_model.pretrained_cfg.get("architecture", CASCADE_CHECKPOINT)
+    print(f"Cascade enabled: {fast_model_name} first, ViT below {CASCADE_THRESHOLD:.2f} confidence")
+
+def preprocess_upload(contents: bytes) -> torch.Tensor:
+    """Decode and preprocess one uploaded image, recording the decode and transform stages"""
+    with timed_stage("decode"):
+        image = decode_image(contents, input_size)
+    with timed_stage("transform"):
+        return resize_normalize(to_uint8_tensor(image), (input_size, input_size))
+
+def tile_upload(contents: bytes, max_tiles: int):
+    """Decode an upload into a batch of model-sized tiles, recording the decode stage"""
+    with timed_stage("decode"):
+        return decode_tiles(contents, input_size, TILE_STRIDE or input_size, max_tiles)
+
+def get_warmup_batch_sizes() -> List[int]:
+    """Batch sizes to warm up: 1..MAX_BATCH_SIZE (micro-batcher, /predict/tiled), BATCH_PREDICT_SIZE (/predict/batch)"""
+    if WARMUP_BATCH_SIZES is None:
+        return sorted(set(range(1, MAX_BATCH_SIZE + 1)) | {BATCH_PREDICT_SIZE})
+    try:
+        sizes = {int(size) for size in WARMUP_BATCH_SIZES.split(",") if size.strip()}
+        if any(size < 0 for size in sizes):
+            raise ValueError
+    except ValueError:
+        raise ValueError(
+            f"Invalid WARMUP_BATCH_SIZES={WARMUP_BATCH_SIZES!r}: use comma-separated batch sizes, e.g. 1,8,16, or 0"
+        ) from None
+    return sorted(size for size in sizes if size > 0)
+
+async def warm_up():
+    """Run synthetic inputs through preprocessing and every batch size before reporting ready"""
+    global warmup_seconds, warmup_error
+    loop = asyncio.get_running_loop()
+    batch_sizes = warmup_batch_sizes
+    start = time.perf_counter()
+    if not batch_sizes:
+        warmup_seconds = 0.0
+        return
+
+    try:
+        # A noisy JPEG exercises the decoder and resize kernels in every preprocessing thread
+        pixels = torch.randint(0, 256, (480, 640, 3), dtype=torch.uint8).numpy()
+        buffer = io.BytesIO()
+        Image.fromarray(pixels).save(buffer, format="JPEG")
+        await asyncio.gather(*(
+            loop.run_in_executor(preprocess_executor, transform, buffer.getvalue())
+            for _ in range(PREPROCESS_WORKERS)
+        ))
+
+        # Allocator growth, oneDNN kernel selection and compilation happen per input shape
+        for batch_size in batch_sizes:
+            batch = torch.randn(batch_size, 3, input_size, input_size)
+            for _ in range(WARMUP_ITERATIONS):
+                await loop.run_in_executor(inference_executor, run_model_batch, batch)
+                if fast_model is not None:
+                    await loop.run_in_executor(inference_executor, run_fast_batch, batch)
+    except Exception as e:
+        warmup_error = str(e)
+        print(f"❌ Warm-up failed: {e}")
+        return
+
+    warmup_seconds = time.perf_counter() - start
+    print(f"🔥 Warm-up finished in {warmup_seconds:.2f}s (batch sizes {batch_sizes})")
+
+def get_warmup_state() -> str:
+    if warmup_task is None:
+        return "pending"
+    if not warmup_task.done():
+        return "running"
+    if warmup_error is not None or warmup_task.cancelled():
+        return "failed"
+    return "done" if warmup_batch_sizes else "disabled"
+
+def is_ready() -> bool:
+    """Model loaded and warmed up (in every worker, under serve.py)"""
+    warm = get_warmup_state() in ("done", "disabled")
+    return model is not None and warm and (worker_pool is None or worker_pool.all_ready())
 
-    if not os.path.exists(CHECKPOINT_PATH):
-        raise FileNotFoundError(f"Model checkpoint not found: {CHECKPOINT_PATH}")
+def supports_embeddings() -> bool:
+    """Pooled embeddings need the timm model itself, not a compiled or exported graph"""
+    return MODEL_BACKEND == "eager" and hasattr(model, "forward_head")
 
-    # Load checkpoint
-    checkpoint = torch.load(CHECKPOINT_PATH, map_location=DEVICE)
-    class_names = checkpoint["class_names"]
+def run_model_batch(batch: torch.Tensor, with_embeddings: bool = False):
+    """
+    Run a batch of preprocessed images through the model and return class probabilities
+
+    With `with_embeddings`, returns (probabilities, embeddings) where embeddings are the pooled
+    pre-logits features (None if the backend can't provide them); computing them costs nothing extra.
+    """
+    embeddings = None
+    with torch.no_grad(), autocast_context(precision):
+        if with_embeddings and supports_embeddings():
+            embeddings = model.forward_head(model.forward_features(batch.to(DEVICE)), pre_logits=True)
+            outputs = model.head(embeddings)
+        else:
+            outputs = model(batch.to(DEVICE))
+    probabilities = torch.softmax(outputs.float(), dim=1).cpu()
+    if not with_embeddings:
+        return probabilities
+    return probabilities, embeddings.float().cpu() if embeddings is not None else None
+
+def open_embedding_index():
+    """Open (or create) the similar-image index for the loaded model, if enabled and supported"""
+    global embedding_index
+    if not EMBEDDING_INDEX_DIR:
+        return
+    if not supports_embeddings():
+        print(f"⚠️ /similar is disabled: the {MODEL_BACKEND} backend does not expose embeddings")
+        return
+    try:
+        embedding_index = EmbeddingIndex(
+            EMBEDDING_INDEX_DIR, model.num_features, identity=embedding_identity(model),
+            nprobe=EMBEDDING_INDEX_NPROBE, read_only=not embedding_index_writable
+        )
+        print(f"Embedding index: {embedding_index.stats()}")
+    except ValueError as e:
+        print(f"⚠️ /similar is disabled: {e}")
+
+def index_prediction(embedding: torch.Tensor, result: Dict[str, Any], image_hash: str):
+    """Add a /predict upload to the similar-image index (runs off the event loop)"""
+    try:
+        embedding_index.add(embedding.numpy()[None], [{
+            "label": result["prediction"],
+            "confidence": round(result["confidence"], 4),
+            "source": "prediction",
+            "filename": result["filename"],
+            "image_hash": image_hash,
+            "model_id": model_id,
+        }])
+    except Exception as e:
+        print(f"⚠️ Failed to index prediction: {e}")
+
+async def log_prediction(
+    result: Dict[str, Any], endpoint: str, latency_ms: float, image_hash: str = None, cached: bool = False
+):
+    """Queue a prediction for the persistent log; waits only while the log's write buffer is full"""
+    if prediction_log:
+        await prediction_log.write(make_record(result, endpoint, latency_ms, image_hash, model_id, cached))
+
+def report_prediction_log_error(records: int, error: Exception):
+    """Called from the prediction log's writer thread when a batch could not be written"""
+    print(f"⚠️ Failed to write {records} prediction log records: {error}")
+
+def run_fast_batch(batch: torch.Tensor) -> torch.Tensor:
+    """Class probabilities from the cascade's first-pass model"""
+    with torch.no_grad(), autocast_context(precision):
+        outputs = fast_model(batch.to(DEVICE))
+    return torch.softmax(outputs.float(), dim=1).cpu()
+
+async def predict_with_cascade(img_tensor: torch.Tensor, deadline=None):
+    """
+    Predict one image, through the cascade if enabled; returns (probabilities, embedding, cascade stage)
+
+    The first-pass model answers when its top-1 confidence reaches CASCADE_THRESHOLD; otherwise the
+    image escalates to the ViT. Only ViT predictions come with an embedding.
+    """
+    if fast_engine is None:
+        probabilities, embedding = await inference_engine.submit(img_tensor, deadline=deadline)
+        return probabilities, embedding, None
+
+    fast_probabilities = await fast_engine.submit(img_tensor, deadline=deadline)
+    if float(fast_probabilities.max()) >= CASCADE_THRESHOLD:
+        cascade_stats["fast"] += 1
+        return fast_probabilities, None, "fast"
+
+    cascade_stats["escalated"] += 1
+    probabilities, embedding = await inference_engine.submit(img_tensor, deadline=deadline)
+    return probabilities, embedding, "escalated"
+
+def run_cascade_batch(batch: torch.Tensor) -> Tuple[torch.Tensor, List[Any]]:
+    """Batched version of `predict_with_cascade` for /predict/batch; returns (probabilities, stages)"""
+    if fast_model is None:
+        return run_model_batch(batch), [None] * len(batch)
+
+    probabilities = run_fast_batch(batch)
+    escalate = probabilities.max(dim=1).values < CASCADE_THRESHOLD
+    if escalate.any():
+        probabilities[escalate] = run_model_batch(batch[escalate])
+    return probabilities, ["escalated" if e else "fast" for e in escalate.tolist()]
+
+def run_tile_batches(tiles: torch.Tensor) -> Tuple[torch.Tensor, List[Any]]:
+    """`run_cascade_batch` over chunks of at most MAX_BATCH_SIZE tiles, batch sizes the warm-up has already run"""
+    probabilities, stages = [], []
+    for chunk in tiles.split(MAX_BATCH_SIZE):
+        chunk_probabilities, chunk_stages = run_cascade_batch(chunk)
+        probabilities.append(chunk_probabilities)
+        stages.extend(chunk_stages)
+    return torch.cat(probabilities), stages
+
+def get_cascade_stats() -> Dict[str, Any]:
+    total = cascade_stats["fast"] + cascade_stats["escalated"]
+    return {
+        "model": fast_model_name,
+        "threshold": CASCADE_THRESHOLD,
+        **cascade_stats,
+        "escalation_rate": round(cascade_stats["escalated"] / total, 4) if total else None,
+        "batching": fast_engine.stats() if fast_engine else None
+    }
+
+def format_prediction(filename: str, probabilities: torch.Tensor, cascade_stage: str = None) -> Dict[str, Any]:
+    """Build the /predict response for one image from its class probabilities"""
+    predicted_idx = int(torch.argmax(probabilities).item())
+    confidence = float(probabilities[predicted_idx].item())
+
+    # Get prediction result
+    predicted_class = class_names[predicted_idx]
+
+    # Get top 3 predictions for additional context
+    top3_prob, top3_idx = torch.topk(probabilities, 3)
+    top3_predictions = [
+        {
+            "class": class_names[int(idx)],
+            "confidence": float(prob)
+        }
+        for prob, idx in zip(top3_prob, top3_idx)
+    ]
+
+    result = {
+        "filename": filename,
+        "prediction": predicted_class,
+        "confidence": confidence,
+        "confidence_percentage": round(confidence * 100, 2),
+        "top3_predictions": top3_predictions,
+        "model": fast_model_name if cascade_stage == "fast" else "Vision Transformer (ViT-Base)",
+        "supported_crops": ["Apple", "Corn", "Potato", "Tomato"]
+    }
+    if cascade_stage is not None:
+        result["cascade_stage"] = cascade_stage
+    return result
 
-    # Initialize model
-    model = timm.create_model("vit_base_patch16_224", pretrained=False)
-    model.head = torch.nn.Linear(model.head.in_features, len(class_names))
-    model.load_state_dict(checkpoint["model_state_dict"])
-    model = model.to(DEVICE)
-    model.eval()
+class ArchiveTooLarge(ValueError):
+    """An archive holds more images or more uncompressed bytes than the request may extract"""
 
-    # Define transform (same as in predict.py)
-    transform = transforms.Compose([
-        transforms.Resize((224, 224)),
-        transforms.ToTensor(),
-        transforms.Normalize(mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5))
-    ])
 
-    print(f"Model loaded successfully with {len(class_names)} classes: {class_names}")
+def check_archive_limits(filename: str, count: int, size: int, max_files: int, max_bytes: int):
+    """Raise ArchiveTooLarge unless `count` images of `size` bytes in total fit in the remaining budget"""
+    if count > max_files:
+        raise ArchiveTooLarge(f"Too many images: {filename} adds {count}, only {max_files} more allowed "
+                              f"(maximum {MAX_BATCH_FILES})")
+    if size > max_bytes:
+        raise ArchiveTooLarge(f"Archive too large: {filename} extracts to {size / 1024 / 1024:.1f} MB, "
+                              f"only {max_bytes / 1024 / 1024:.1f} MB more allowed (maximum {MAX_ARCHIVE_EXTRACT_MB:g} MB)")
+
+
+def extract_archive_images(filename: str, contents: bytes, max_files: int, max_bytes: int) -> List[Tuple[str, bytes]]:
+    """
+    Return (name, bytes) for every image file inside a zip or tar archive
+
+    The member count and declared uncompressed sizes are checked against `max_files` and `max_bytes`
+    before anything is decompressed, so zip bombs and archives with huge member counts are rejected cheaply.
+    """
+    if filename.lower().endswith('.zip'):
+        with zipfile.ZipFile(io.BytesIO(contents)) as archive:
+            members = [info for info in archive.infolist()
+                       if not info.is_dir() and info.filename.lower().endswith(IMAGE_EXTENSIONS)]
+            check_archive_limits(filename, len(members), sum(info.file_size for info in members), max_files, max_bytes)
+            return [(info.filename, archive.read(info)) for info in members]
+
+    with tarfile.open(fileobj=io.BytesIO(contents), mode="r:*") as archive:
+        members = [member for member in archive.getmembers()
+                   if member.isfile() and member.name.lower().endswith(IMAGE_EXTENSIONS)]
+        check_archive_limits(filename, len(members), sum(member.size for member in members), max_files, max_bytes)
+        return [(member.name, archive.extractfile(member).read()) for member in members]
 
 def get_crop_type_from_disease(disease_name: str) -> str:
     """Extract crop type from disease class name"""
@@ -101,24 +615,9 @@ def get_crop_type_from_disease(disease_name: str) -> str:
     else:
         return 'Unknown Crop'
 
-def get_treatment_recommendations(disease_name: str, confidence_score: float) -> Dict[str, Any]:
-    """Get treatment recommendations from OpenRouter LLM"""
-
-    if not openai_client:
-        return {
-            "error": "LLM service not configured. Please set OPENROUTER_API_KEY environment variable.",
-            "available": False
-        }
-
-    try:
-        # Extract crop type from disease name
-        crop_type = get_crop_type_from_disease(disease_name)
-
-        # Convert disease name to user-friendly format
-        display_disease = disease_name.replace('___', ' ').replace('_', ' ').title()
-
-        # Create structured prompt
-        prompt = f"""You are an expert agricultural advisor. A crop disease has been detected.
+def build_treatment_prompt(display_disease: str, crop_type: str, confidence_score: float) -> str:
+    """Create the structured treatment prompt sent to the LLM"""
+    return f"""You are an expert agricultural advisor. A crop disease has been detected.
 
 Disease: {display_disease}
 Crop: {crop_type}
@@ -147,51 +646,221 @@ Provide ACTIONABLE treatment recommendations in this structure:
 
 Keep recommendations specific, practical, and evidence-based for agricultural professionals."""
 
-        # Make API call to OpenRouter
-        completion = openai_client.chat.completions.create(
-            extra_headers={
-                "HTTP-Referer": "https://cropguard-ai.vercel.app",
-                "X-Title": "CropGuard AI Disease Detection",
-            },
+async def get_treatment_recommendations(disease_name: str, confidence_score: float) -> Dict[str, Any]:
+    """Get treatment recommendations from OpenRouter LLM, cached per disease, crop and severity"""
+
+    if not openai_client:
+        return {
+            "error": "LLM service not configured. Please set OPENROUTER_API_KEY environment variable.",
+            "available": False
+        }
+
+    # Extract crop type from disease name
+    crop_type = get_crop_type_from_disease(disease_name)
+
+    # Convert disease name to user-friendly format
+    display_disease = disease_name.replace('___', ' ').replace('_', ' ').title()
+
+    async def fetch_recommendations() -> Dict[str, Any]:
+        try:
+            prompt = build_treatment_prompt(display_disease, crop_type, confidence_score)
+
+            # Make API call to OpenRouter
+            with timed_stage("llm"):
+                completion = await openai_client.chat.completions.create(
+                    extra_headers=LLM_EXTRA_HEADERS,
+                    model=OPENROUTER_MODEL,
+                    messages=[
+                        {
+                            "role": "user",
+                            "content": prompt
+                        }
+                    ],
+                    temperature=0.3,  # Lower temperature for more consistent recommendations
+                    max_tokens=1000
+                )
+
+            recommendations = completion.choices[0].message.content
+
+            return {
+                "available": True,
+                "disease": display_disease,
+                "crop": crop_type,
+                "confidence": confidence_score,
+                "recommendations": recommendations,
+                "model_used": OPENROUTER_MODEL
+            }
+
+        except Exception as e:
+            print(f"LLM API error: {str(e)}")
+            return {
+                "error": f"Failed to get treatment recommendations: {str(e)}",
+                "available": False
+            }
+
+    # Identical concurrent requests share one upstream call; only successful answers are cached
+    cache_key = make_treatment_key(disease_name, crop_type, confidence_score, OPENROUTER_MODEL)
+    result = await treatment_cache.get_or_create(
+        cache_key,
+        fetch_recommendations,
+        should_cache=lambda value: value.get("available", False),
+    )
+
+    if result.get("available", False):
+        result = {**result, "confidence": confidence_score}
+    return result
+
+def format_sse(event: str, data: Dict[str, Any]) -> str:
+    """Format one server-sent event"""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+async def stream_treatment_recommendations(disease_name: str, confidence_score: float):
+    """Yield treatment recommendations as server-sent events while the LLM generates them"""
+    crop_type = get_crop_type_from_disease(disease_name)
+    display_disease = disease_name.replace('___', ' ').replace('_', ' ').title()
+    cache_key = make_treatment_key(disease_name, crop_type, confidence_score, OPENROUTER_MODEL)
+
+    # Replay a cached answer immediately
+    cached = await treatment_cache.lookup(cache_key)
+    if cached is not None:
+        yield format_sse("meta", {
+            "disease": cached["disease"],
+            "crop": cached["crop"],
+            "confidence": confidence_score,
+            "model_used": cached["model_used"],
+            "cached": True
+        })
+        yield format_sse("token", {"text": cached["recommendations"]})
+        yield format_sse("done", {"cached": True})
+        return
+
+    yield format_sse("meta", {
+        "disease": display_disease,
+        "crop": crop_type,
+        "confidence": confidence_score,
+        "model_used": OPENROUTER_MODEL,
+        "cached": False
+    })
+
+    chunks = []
+    llm_start = time.perf_counter()
+    try:
+        stream = await openai_client.chat.completions.create(
+            extra_headers=LLM_EXTRA_HEADERS,
             model=OPENROUTER_MODEL,
             messages=[
                 {
                     "role": "user",
-                    "content": prompt
+                    "content": build_treatment_prompt(display_disease, crop_type, confidence_score)
                 }
             ],
-            temperature=0.3,  # Lower temperature for more consistent recommendations
-            max_tokens=1000
+            temperature=0.3,
+            max_tokens=1000,
+            stream=True
         )
-
-        recommendations = completion.choices[0].message.content
-
-        return {
-            "available": True,
-            "disease": display_disease,
-            "crop": crop_type,
-            "confidence": confidence_score,
-            "recommendations": recommendations,
-            "model_used": OPENROUTER_MODEL
-        }
-
+        async for chunk in stream:
+            if not chunk.choices:
+                continue
+            text = chunk.choices[0].delta.content
+            if text:
+                if not chunks:
+                    record_stage("llm_first_token", time.perf_counter() - llm_start)
+                chunks.append(text)
+                yield format_sse("token", {"text": text})
     except Exception as e:
         print(f"LLM API error: {str(e)}")
-        return {
-            "error": f"Failed to get treatment recommendations: {str(e)}",
-            "available": False
-        }
+        yield format_sse("error", {"error": f"Failed to get treatment recommendations: {str(e)}"})
+        return
+    record_stage("llm", time.perf_counter() - llm_start)
+
+    # Store the complete answer so later requests (streaming or not) are served from the cache
+    await treatment_cache.put(cache_key, {
+        "available": True,
+        "disease": display_disease,
+        "crop": crop_type,
+        "confidence": confidence_score,
+        "recommendations": "".join(chunks),
+        "model_used": OPENROUTER_MODEL
+    })
+    yield format_sse("done", {"cached": False})
 
 @app.on_event("startup")
 async def startup_event():
     """Load model on startup"""
+    global inference_engine, fast_engine, preprocess_executor, inference_executor, warmup_task, prediction_log
+    global warmup_batch_sizes
+
+    # Configuration errors stop startup here, before the model is loaded
     try:
-        load_model()
+        warmup_batch_sizes = get_warmup_batch_sizes()
+    except ValueError as e:
+        print(f"❌ {e}")
+        raise
+
+    try:
+        # serve.py loads the model once before forking, so workers share its weights
+        if model is None:
+            load_model()
+        # One torch thread per preprocessing worker; the forward pass gets the full budget
+        preprocess_executor = make_executor(PREPROCESS_WORKERS, 1, "preprocess")
+        inference_executor = make_executor(1, TORCH_THREADS, "inference")
+        open_embedding_index()
+        if PREDICTION_LOG_PATH:
+            prediction_log = PredictionLog(
+                PREDICTION_LOG_PATH,
+                max_pending=PREDICTION_LOG_MAX_PENDING,
+                max_wait=PREDICTION_LOG_MAX_WAIT_MS / 1000,
+                on_error=report_prediction_log_error,
+            )
+        inference_engine = BatchingInferenceEngine(
+            functools.partial(run_model_batch, with_embeddings=True),
+            max_batch_size=MAX_BATCH_SIZE,
+            max_wait_ms=BATCH_WAIT_MS,
+            executor=inference_executor,
+            max_queue_depth=MAX_QUEUE_DEPTH,
+        )
+        await inference_engine.start()
+        if fast_model is not None:
+            # Both models share the inference thread; they would only compete for the same cores
+            fast_engine = BatchingInferenceEngine(
+                run_fast_batch,
+                max_batch_size=MAX_BATCH_SIZE,
+                max_wait_ms=BATCH_WAIT_MS,
+                executor=inference_executor,
+                max_queue_depth=MAX_QUEUE_DEPTH,
+            )
+            await fast_engine.start()
+        print(f"Inference batching enabled: max_batch_size={MAX_BATCH_SIZE}, max_wait_ms={BATCH_WAIT_MS}")
+        print(f"Executors: {PREPROCESS_WORKERS} preprocess workers, {TORCH_THREADS} torch threads for inference")
+
+        # Warm up in the background so /health/live answers while it runs; /health/ready waits for it
+        warmup_task = asyncio.create_task(warm_up())
         print("CropGuard AI API started successfully!")
     except Exception as e:
         print(f"Failed to load model: {e}")
         raise
 
+@app.on_event("shutdown")
+async def shutdown_event():
+    """Stop the inference engine and executors on shutdown"""
+    if warmup_task and not warmup_task.done():
+        warmup_task.cancel()
+    for engine in (fast_engine, inference_engine):
+        if engine:
+            await engine.stop()
+    for executor in (preprocess_executor, inference_executor):
+        if executor:
+            executor.shutdown(wait=False)
+    if openai_client:
+        await openai_client.close()
+    treatment_cache.close()
+    if embedding_index is not None:
+        embedding_index.close()
+    if prediction_log:
+        # Writes out the records still buffered
+        if not await asyncio.to_thread(prediction_log.close):
+            print(f"⚠️ Prediction log writer did not finish, {prediction_log.stats()['pending']} records not written")
+
 @app.get("/")
 async def root():
     """Health check endpoint"""
@@ -221,56 +890,299 @@ async def predict_disease(file: UploadFile = File(...)):
     - **file**: Image file (jpg, jpeg, png)
     - Returns: Prediction result with confidence and class name
     """
-    if not model or not transform:
+    if not model or not transform or not inference_engine:
         raise HTTPException(status_code=503, detail="Model not loaded yet")
 
+    start = time.perf_counter()
+
     # Validate file type
-    if not file.filename.lower().endswith(('.jpg', '.jpeg', '.png')):
+    if not file.filename.lower().endswith(IMAGE_EXTENSIONS):
         raise HTTPException(
             status_code=400,
             detail="Invalid file type. Please upload a JPG, JPEG, or PNG image."
         )
 
+    deadline = time.monotonic() + REQUEST_DEADLINE_MS / 1000 if REQUEST_DEADLINE_MS > 0 else None
+
     try:
         # Read image
-        contents = await file.read()
-        image = Image.open(io.BytesIO(contents)).convert("RGB")
-
-        # Preprocess image
-        img_tensor = transform(image).unsqueeze(0).to(DEVICE)
-
-        # Make prediction
-        with torch.no_grad():
-            outputs = model(img_tensor)
-            probabilities = torch.softmax(outputs, dim=1)[0]
-            predicted_idx = int(torch.argmax(outputs, dim=1).item())
-            confidence = float(probabilities[predicted_idx].item())
-
-        # Get prediction result
-        predicted_class = class_names[predicted_idx]
-
-        # Get top 3 predictions for additional context
-        top3_prob, top3_idx = torch.topk(probabilities, 3)
-        top3_predictions = [
-            {
-                "class": class_names[int(idx)],
-                "confidence": float(prob)
-            }
-            for prob, idx in zip(top3_prob, top3_idx)
+        with timed_stage("read"):
+            contents = await file.read()
+
+        # Identical uploads are answered from the cache without decoding or inference
+        with timed_stage("cache"):
+            image_hash = hash_image_bytes(contents)
+            cache_key = PredictionCache.make_key(image_hash, model_id)
+            cached = prediction_cache.get(cache_key)
+        if cached is not None:
+            cached["filename"] = file.filename
+            await log_prediction(cached, "/predict", (time.perf_counter() - start) * 1000, image_hash, cached=True)
+            return cached
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+
+    # Reject early rather than letting decoded images pile up in memory
+    if not admission.try_acquire():
+        raise overloaded(429, "pending_limit", "Too many predictions in progress, please retry later")
+
+    try:
+        # Decode and preprocess image off the event loop
+        img_tensor = await run_in_executor(preprocess_executor, transform, contents)
+
+        # Make prediction (batched together with concurrent requests)
+        probabilities, embedding, cascade_stage = await predict_with_cascade(img_tensor, deadline)
+
+        with timed_stage("topk"):
+            result = format_prediction(file.filename, probabilities, cascade_stage)
+        prediction_cache.put(cache_key, result)
+        await log_prediction(result, "/predict", (time.perf_counter() - start) * 1000, image_hash)
+
+        # Cached repeats are skipped above, so each distinct image is indexed once per cache lifetime
+        if embedding is not None and embedding_index is not None and embedding_index_writable and INDEX_PREDICTIONS:
+            asyncio.get_running_loop().run_in_executor(
+                preprocess_executor, index_prediction, embedding, dict(result), image_hash
+            )
+        return result
+
+    except QueueFullError:
+        raise overloaded(503, "queue_full", "Inference queue is full, please retry later")
+    except DeadlineExceededError:
+        raise overloaded(503, "deadline", "Prediction deadline exceeded, please retry later")
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+    finally:
+        admission.release()
+
+def overloaded(status_code: int, reason: str, detail: str) -> HTTPException:
+    """Fast rejection with a Retry-After based on the current inference backlog"""
+    rejected_requests.inc(reason=reason)
+    wait = inference_engine.estimated_wait() if inference_engine else 1.0
+    return HTTPException(status_code=status_code, detail=detail, headers={"Retry-After": retry_after_seconds(wait)})
+
+async def stream_batch_predictions(images: List[Tuple[str, bytes]]):
+    """Decode images in parallel, run them in fixed-size batches and yield NDJSON lines"""
+    loop = asyncio.get_running_loop()
+
+    def decode_chunk(chunk):
+        return [
+            loop.run_in_executor(preprocess_executor, transform, contents)
+            for _, contents in chunk
         ]
 
+    chunks = [images[i:i + BATCH_PREDICT_SIZE] for i in range(0, len(images), BATCH_PREDICT_SIZE)]
+    pending = decode_chunk(chunks[0]) if chunks else []
+
+    for chunk_idx, chunk in enumerate(chunks):
+        chunk_start = time.perf_counter()
+        decoded = await asyncio.gather(*pending, return_exceptions=True)
+
+        # Start decoding the next chunk while this one runs through the model
+        pending = decode_chunk(chunks[chunk_idx + 1]) if chunk_idx + 1 < len(chunks) else []
+
+        results = [None] * len(chunk)
+        valid = []
+        for i, ((name, _), tensor) in enumerate(zip(chunk, decoded)):
+            if isinstance(tensor, Exception):
+                results[i] = {"filename": name, "error": f"Prediction failed: {str(tensor)}"}
+            else:
+                valid.append((i, tensor))
+
+        if valid:
+            batch = torch.stack([tensor for _, tensor in valid])
+            try:
+                probabilities, stages = await loop.run_in_executor(inference_executor, run_cascade_batch, batch)
+                for (i, _), row, stage in zip(valid, probabilities, stages):
+                    results[i] = format_prediction(chunk[i][0], row, stage)
+                    if stage is not None:
+                        cascade_stats[stage] += 1
+            except Exception as e:
+                for i, _ in valid:
+                    results[i] = {"filename": chunk[i][0], "error": f"Prediction failed: {str(e)}"}
+            else:
+                if prediction_log:
+                    # Images share their chunk's forward pass, so each is logged with its share of the chunk's time
+                    latency_ms = (time.perf_counter() - chunk_start) * 1000 / len(valid)
+                    hashes = await loop.run_in_executor(
+                        preprocess_executor, lambda: [hash_image_bytes(chunk[i][1]) for i, _ in valid]
+                    )
+                    for (i, _), image_hash in zip(valid, hashes):
+                        await log_prediction(results[i], "/predict/batch", latency_ms, image_hash)
+
+        for result in results:
+            yield json.dumps(result) + "\n"
+
+@app.post("/predict/batch")
+async def predict_disease_batch(files: List[UploadFile] = File(...)):
+    """
+    Predict plant disease for many images in one request
+
+    - **files**: Image files (jpg, jpeg, png) and/or zip/tar archives of images
+    - Returns: NDJSON stream with one /predict result (or error) per image, in upload order
+    """
+    if not model or not transform or not inference_executor:
+        raise HTTPException(status_code=503, detail="Model not loaded yet")
+
+    images = []
+    extracted_bytes = 0
+    for file in files:
+        name = file.filename or ""
+        contents = await file.read()
+
+        if name.lower().endswith(ARCHIVE_EXTENSIONS):
+            try:
+                extracted = extract_archive_images(
+                    name, contents,
+                    max_files=MAX_BATCH_FILES - len(images),
+                    max_bytes=int(MAX_ARCHIVE_EXTRACT_MB * 1024 * 1024) - extracted_bytes,
+                )
+            except ArchiveTooLarge as e:
+                raise HTTPException(status_code=413, detail=str(e))
+            except (zipfile.BadZipFile, tarfile.TarError) as e:
+                raise HTTPException(status_code=400, detail=f"Invalid archive {name}: {str(e)}")
+            images.extend(extracted)
+            extracted_bytes += sum(len(data) for _, data in extracted)
+        elif name.lower().endswith(IMAGE_EXTENSIONS):
+            images.append((name, contents))
+        else:
+            raise HTTPException(
+                status_code=400,
+                detail=f"Invalid file type: {name}. Please upload JPG, JPEG or PNG images, or a zip/tar archive."
+            )
+
+    if not images:
+        raise HTTPException(status_code=400, detail="No images found in upload")
+
+    if len(images) > MAX_BATCH_FILES:
+        raise HTTPException(
+            status_code=413,
+            detail=f"Too many images: {len(images)} (maximum {MAX_BATCH_FILES})"
+        )
+
+    if not admission.try_acquire():
+        raise overloaded(429, "pending_limit", "Too many predictions in progress, please retry later")
+
+    async def stream_and_release():
+        try:
+            async for line in stream_batch_predictions(images):
+                yield line
+        finally:
+            admission.release()
+
+    return StreamingResponse(stream_and_release(), media_type="application/x-ndjson")
+
+@app.post("/predict/tiled")
+async def predict_disease_tiled(file: UploadFile = File(...), max_tiles: int = TILE_MAX_TILES):
+    """
+    Predict plant disease on a high-resolution or multi-leaf image, tile by tile
+
+    - **file**: Image file (jpg, jpeg, png)
+    - **max_tiles**: Upper bound on the number of windows (larger images are downscaled to fit)
+    - Returns: Aggregated prediction, a coarse per-tile disease heatmap and the most diseased tiles
+    """
+    if not model or not transform or not inference_engine:
+        raise HTTPException(status_code=503, detail="Model not loaded yet")
+    if not 1 <= max_tiles <= TILE_MAX_TILES:
+        raise HTTPException(status_code=400, detail=f"max_tiles must be between 1 and {TILE_MAX_TILES}")
+    if not file.filename.lower().endswith(IMAGE_EXTENSIONS):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file type. Please upload a JPG, JPEG, or PNG image."
+        )
+
+    if not admission.try_acquire():
+        raise overloaded(429, "pending_limit", "Too many predictions in progress, please retry later")
+
+    start = time.perf_counter()
+    try:
+        with timed_stage("read"):
+            contents = await file.read()
+        tiles, grid = await run_in_executor(preprocess_executor, tile_upload, contents, max_tiles)
+
+        # Up to TILE_MAX_TILES tiles go through the model (and the cascade, if enabled) in warmed batch sizes, so
+        # a compile/ONNX backend never sees a new input shape on the request path
+        with timed_stage("forward"):
+            probabilities, stages = await run_in_executor(inference_executor, run_tile_batches, tiles)
+
+        with timed_stage("topk"):
+            result = aggregate_tiles(probabilities, class_names, grid, TILE_DISEASE_THRESHOLD)
+        if fast_model is not None:
+            for stage in stages:
+                cascade_stats[stage] += 1
+            result["escalated_tiles"] = stages.count("escalated")
+        # Like format_prediction: name the model(s) whose scores went into the tiles
+        models = [fast_model_name] if "fast" in stages else []
+        if fast_model is None or "escalated" in stages:
+            models.append("Vision Transformer (ViT-Base)")
+        result = {
+            "filename": file.filename,
+            **result,
+            "tiles": {key: grid[key] for key in ("rows", "cols", "tile_size", "stride", "image_size")},
+            "model": " + ".join(models),
+        }
+        if prediction_log:
+            image_hash = await run_in_executor(preprocess_executor, hash_image_bytes, contents)
+            await log_prediction(result, "/predict/tiled", (time.perf_counter() - start) * 1000, image_hash)
+        return result
+
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=f"Tiled prediction failed: {str(e)}")
+    finally:
+        admission.release()
+
+@app.post("/similar")
+async def find_similar(file: UploadFile = File(...), k: int = 5):
+    """
+    Find the indexed images (reference images and past predictions) most similar to an upload
+
+    - **file**: Image file (jpg, jpeg, png)
+    - **k**: Number of neighbors to return
+    - Returns: The upload's prediction and its nearest neighbors with labels and cosine similarity
+    """
+    if not model or not transform or not inference_engine:
+        raise HTTPException(status_code=503, detail="Model not loaded yet")
+    if embedding_index is None:
+        raise HTTPException(status_code=503, detail="Similar-image search is not available")
+    if not 1 <= k <= SIMILAR_MAX_K:
+        raise HTTPException(status_code=400, detail=f"k must be between 1 and {SIMILAR_MAX_K}")
+    if not file.filename.lower().endswith(IMAGE_EXTENSIONS):
+        raise HTTPException(
+            status_code=400,
+            detail="Invalid file type. Please upload a JPG, JPEG, or PNG image."
+        )
+
+    deadline = time.monotonic() + REQUEST_DEADLINE_MS / 1000 if REQUEST_DEADLINE_MS > 0 else None
+    if not admission.try_acquire():
+        raise overloaded(429, "pending_limit", "Too many predictions in progress, please retry later")
+
+    try:
+        with timed_stage("read"):
+            contents = await file.read()
+        img_tensor = await run_in_executor(preprocess_executor, transform, contents)
+        probabilities, embedding = await inference_engine.submit(img_tensor, deadline=deadline)
+
+        with timed_stage("search"):
+            start = time.perf_counter()
+            neighbors = await run_in_executor(preprocess_executor, embedding_index.search, embedding.numpy(), k)
+            search_ms = (time.perf_counter() - start) * 1000
+
+        prediction = format_prediction(file.filename, probabilities)
         return {
             "filename": file.filename,
-            "prediction": predicted_class,
-            "confidence": confidence,
-            "confidence_percentage": round(confidence * 100, 2),
-            "top3_predictions": top3_predictions,
-            "model": "Vision Transformer (ViT-Base)",
-            "supported_crops": ["Apple", "Corn", "Potato", "Tomato"]
+            "prediction": prediction["prediction"],
+            "confidence": prediction["confidence"],
+            "neighbors": neighbors,
+            "search_ms": round(search_ms, 2),
+            "index": embedding_index.stats()
         }
 
+    except QueueFullError:
+        raise overloaded(503, "queue_full", "Inference queue is full, please retry later")
+    except DeadlineExceededError:
+        raise overloaded(503, "deadline", "Prediction deadline exceeded, please retry later")
     except Exception as e:
-        raise HTTPException(status_code=500, detail=f"Prediction failed: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Similarity search failed: {str(e)}")
+    finally:
+        admission.release()
 
 @app.post("/treatment")
 async def get_treatment(request: TreatmentRequest):
@@ -281,7 +1193,7 @@ async def get_treatment(request: TreatmentRequest):
     - **confidence**: Confidence score from 0.0 to 1.0
     - Returns: Structured treatment recommendations or error message
     """
-    recommendations = get_treatment_recommendations(request.disease_name, request.confidence)
+    recommendations = await get_treatment_recommendations(request.disease_name, request.confidence)
 
     if not recommendations.get("available", False):
         error_msg = recommendations.get("error", "Treatment recommendations not available")
@@ -289,6 +1201,45 @@ async def get_treatment(request: TreatmentRequest):
 
     return recommendations
 
+@app.post("/treatment/stream")
+async def get_treatment_stream(request: TreatmentRequest):
+    """
+    Stream treatment recommendations as server-sent events
+
+    - **disease_name**: Name of the detected disease (e.g., "Apple___Apple_scab")
+    - **confidence**: Confidence score from 0.0 to 1.0
+    - Returns: `text/event-stream` with a `meta` event, `token` events carrying text
+      as it is generated, and a final `done` (or `error`) event
+    """
+    if not openai_client:
+        raise HTTPException(
+            status_code=503,
+            detail="LLM service not configured. Please set OPENROUTER_API_KEY environment variable."
+        )
+
+    return StreamingResponse(
+        stream_treatment_recommendations(request.disease_name, request.confidence),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+@app.get("/metrics")
+async def get_metrics():
+    """Prometheus metrics: per-stage and request latency histograms, queue depth and in-flight counts"""
+    return PlainTextResponse(registry.render(), media_type="text/plain; version=0.0.4")
+
+@app.get("/health/live")
+async def liveness():
+    """Liveness probe: the process is up and serving requests"""
+    return {"live": True}
+
+@app.get("/health/ready")
+async def readiness():
+    """Readiness probe: 200 once the model is loaded and warmed up, 503 before"""
+    ready = is_ready()
+    body = {"ready": ready, "warmup": get_warmup_state()}
+    return body if ready else JSONResponse(status_code=503, content=body)
+
 @app.get("/health")
 async def health_check():
     """Detailed health check"""
@@ -298,11 +1249,32 @@ async def health_check():
 
     return {
         "status": "healthy" if model else "unhealthy",
+        "live": True,
+        "ready": is_ready(),
+        "warmup": {
+            "state": get_warmup_state(),
+            "seconds": round(warmup_seconds, 3) if warmup_seconds is not None else None,
+            "batch_sizes": warmup_batch_sizes,
+            "error": warmup_error
+        },
         "model_status": model_status,
         "classes_loaded": classes_status,
         "llm_status": llm_status,
         "device": DEVICE,
-        "checkpoint_path": CHECKPOINT_PATH
+        "backend": MODEL_BACKEND,
+        "precision": precision,
+        "vit_mode": vit_mode,
+        "input_size": input_size,
+        "checkpoint_path": CHECKPOINT_PATH,
+        "model_load_seconds": round(model_load_seconds, 3) if model_load_seconds else None,
+        "batching": inference_engine.stats() if inference_engine else None,
+        "admission": admission.stats(),
+        "prediction_cache": prediction_cache.stats(),
+        "treatment_cache": treatment_cache.stats(),
+        "embedding_index": embedding_index.stats() if embedding_index is not None else None,
+        "prediction_log": prediction_log.stats() if prediction_log else None,
+        "cascade": get_cascade_stats() if fast_model is not None else None,
+        "workers": worker_pool.stats() if worker_pool else None
     }
 
 if __name__ == "__main__":
@@ -0,0 +1,92 @@
+"""
+Runtime backends for serving the classifier.
+
+- eager: the timm model as built from the checkpoint
+- compile: the eager model wrapped in torch.compile
+- torchscript: a traced and frozen TorchScript artifact (see export_model.py)
+- onnx: an ONNX artifact run with ONNX Runtime (optional dependency)
+
+Every backend is a callable taking a (N, 3, 224, 224) float tensor and
+returning (N, num_classes) logits as a torch tensor.
+"""
+
+import json
+import os
+from typing import Any, Dict, Optional
+
+import torch
+
+BACKENDS = ("eager", "compile", "torchscript", "onnx")
+MANIFEST_NAME = "manifest.json"
+ARTIFACT_FILES = {
+    "torchscript": "model.torchscript.pt",
+    "onnx": "model.onnx",
+}
+
+
+class OnnxRuntimeModel:
+    """Give an ONNX Runtime session the same call interface as the torch model"""
+
+    def __init__(self, path: str, num_threads: Optional[int] = None):
+        try:
+            import onnxruntime as ort
+        except ImportError:
+            raise ImportError("The onnx backend requires onnxruntime. Please run: pip install onnxruntime")
+
+        options = ort.SessionOptions()
+        if num_threads:
+            options.intra_op_num_threads = num_threads
+        self.session = ort.InferenceSession(path, options, providers=["CPUExecutionProvider"])
+        self.input_name = self.session.get_inputs()[0].name
+
+    def __call__(self, batch: torch.Tensor) -> torch.Tensor:
+        inputs = batch.detach().cpu().contiguous().numpy()
+        logits = self.session.run(None, {self.input_name: inputs})[0]
+        return torch.from_numpy(logits)
+
+    def eval(self):
+        return self
+
+
+def load_manifest(artifact_dir: str) -> Dict[str, Any]:
+    """Read the manifest written by export_model.py"""
+    manifest_path = os.path.join(artifact_dir, MANIFEST_NAME)
+    if not os.path.exists(manifest_path):
+        raise FileNotFoundError(
+            f"Artifact manifest not found: {manifest_path}. Run: python export_model.py export"
+        )
+    with open(manifest_path) as f:
+        return json.load(f)
+
+
+def artifact_path(artifact_dir: str, backend: str) -> str:
+    path = os.path.join(artifact_dir, ARTIFACT_FILES[backend])
+    if not os.path.exists(path):
+        raise FileNotFoundError(
+            f"{backend} artifact not found: {path}. Run: python export_model.py export --formats {backend}"
+        )
+    return path
+
+
+def load_backend(
+    backend: str,
+    eager_model: Optional[torch.nn.Module] = None,
+    artifact_dir: Optional[str] = None,
+    num_threads: Optional[int] = None,
+):
+    """Return a callable model for the requested backend"""
+    if backend not in BACKENDS:
+        raise ValueError(f"Unknown backend '{backend}'. Choose one of: {', '.join(BACKENDS)}")
+
+    if backend in ("eager", "compile"):
+        if eager_model is None:
+            raise ValueError(f"The {backend} backend needs the eager model")
+        return eager_model if backend == "eager" else torch.compile(eager_model)
+
+    path = artifact_path(artifact_dir, backend)
+    if backend == "torchscript":
+        model = torch.jit.load(path, map_location="cpu")
+        model.eval()
+        return model
+
+    return OnnxRuntimeModel(path, num_threads=num_threads)
@@ -0,0 +1,132 @@
+#!/usr/bin/env python3
+"""
+Shared loader for the trained ViT classifier.
+
+The model skeleton is built on the meta device (no random initialization)
+and the checkpoint weights are memory-mapped and assigned in place, so cold
+start does not deserialize a full copy of the weights and several worker
+processes loading the same file share its pages through the OS page cache.
+
+Architectures with non-persistent buffers (Swin, LeViT, ...) keep those
+buffers out of the checkpoint, so they are built on the target device and
+loaded normally instead.
+
+Checkpoints record their timm architecture (`model_name`), so small first-pass
+models for the serving cascade load the same way; older checkpoints without it
+are ViT-Base.
+
+A checkpoint can also be converted once to safetensors, which is preferred
+automatically when it is newer than the .pth file:
+
+    python model_loader.py --convert vit_plantvillage.pth
+"""
+
+import argparse
+import json
+import os
+import pickle
+import time
+from typing import Dict, List, Tuple
+
+import timm
+import torch
+
+MODEL_NAME = "vit_base_patch16_224"
+
+
+def safetensors_path_for(checkpoint_path: str) -> str:
+    return os.path.splitext(checkpoint_path)[0] + ".safetensors"
+
+
+def create_classifier(num_classes: int, device: str = "meta", model_name: str = MODEL_NAME) -> torch.nn.Module:
+    """Build the model with a `num_classes` head; on the meta device no memory is allocated"""
+    with torch.device(device):
+        return timm.create_model(model_name, pretrained=False, num_classes=num_classes)
+
+
+def has_meta_tensors(model: torch.nn.Module) -> bool:
+    return any(t.is_meta for t in (*model.parameters(), *model.buffers()))
+
+
+def read_checkpoint(checkpoint_path: str) -> Tuple[Dict[str, torch.Tensor], List[str], str]:
+    """Return (state_dict, class_names, model_name), memory-mapping the weights where possible"""
+    if checkpoint_path.endswith(".safetensors"):
+        from safetensors import safe_open
+        from safetensors.torch import load_file
+
+        with safe_open(checkpoint_path, framework="pt") as f:
+            metadata = f.metadata()
+        return load_file(checkpoint_path, device="cpu"), json.loads(metadata["class_names"]), \
+            metadata.get("model_name", MODEL_NAME)
+
+    try:
+        checkpoint = torch.load(checkpoint_path, map_location="cpu", mmap=True, weights_only=True)
+    except (RuntimeError, TypeError, pickle.UnpicklingError):
+        # Legacy (non-zipfile) checkpoints cannot be memory-mapped, older pickles are rejected by weights_only
+        checkpoint = torch.load(checkpoint_path, map_location="cpu", weights_only=False)
+    return checkpoint["model_state_dict"], checkpoint["class_names"], checkpoint.get("model_name", MODEL_NAME)
+
+
+def load_classifier(
+    checkpoint_path: str,
+    device: str = "cpu",
+    prefer_safetensors: bool = True,
+) -> Tuple[torch.nn.Module, List[str]]:
+    """Load the trained classifier in eval mode; returns (model, class_names)"""
+    start = time.perf_counter()
+
+    source = checkpoint_path
+    converted = safetensors_path_for(checkpoint_path)
+    if (
+        prefer_safetensors
+        and not checkpoint_path.endswith(".safetensors")
+        and os.path.exists(converted)
+        and os.path.getmtime(converted) >= os.path.getmtime(checkpoint_path)
+    ):
+        source = converted
+
+    state_dict, class_names, model_name = read_checkpoint(source)
+
+    model = create_classifier(len(class_names), model_name=model_name)
+    model.load_state_dict(state_dict, assign=True)
+    if has_meta_tensors(model):
+        # Non-persistent buffers are computed in __init__, not saved, so they were never assigned
+        model = create_classifier(len(class_names), device, model_name)
+        model.load_state_dict(state_dict)
+    model = model.to(device)
+    model.eval()
+
+    elapsed = time.perf_counter() - start
+    print(f"Loaded {source} in {elapsed * 1000:.0f} ms")
+    return model, class_names
+
+
+def convert_to_safetensors(checkpoint_path: str) -> str:
+    """Write a safetensors copy of a training checkpoint next to it"""
+    from safetensors.torch import save_file
+
+    state_dict, class_names, model_name = read_checkpoint(checkpoint_path)
+    output_path = safetensors_path_for(checkpoint_path)
+    save_file(
+        {name: tensor.contiguous() for name, tensor in state_dict.items()},
+        output_path,
+        metadata={"class_names": json.dumps(class_names), "model_name": model_name},
+    )
+    return output_path
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load, convert or time the model checkpoint")
+    parser.add_argument("checkpoint", nargs="?", default="vit_plantvillage.pth")
+    parser.add_argument("--convert", action="store_true", help="Write a .safetensors copy of the checkpoint")
+    args = parser.parse_args()
+
+    if args.convert:
+        output_path = convert_to_safetensors(args.checkpoint)
+        print(f"✅ Wrote {output_path}")
+
+    load_classifier(args.checkpoint)
+
+
+if __name__ == "__main__":
+    main()
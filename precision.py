@@ -0,0 +1,54 @@
+"""
+Inference precision modes for CPU serving.
+
+- fp32: the model as trained
+- bf16: fp32 weights with bfloat16 autocast, on CPUs with native bf16 support
+- int8: dynamic INT8 quantization of the Linear layers (most of ViT's compute)
+"""
+
+import contextlib
+import warnings
+
+import torch
+
+PRECISIONS = ("fp32", "bf16", "int8")
+
+
+def bf16_supported() -> bool:
+    """Whether this CPU has native bfloat16 kernels"""
+    try:
+        return bool(torch.ops.mkldnn._is_mkldnn_bf16_supported())
+    except (AttributeError, RuntimeError):
+        return False
+
+
+def resolve_precision(precision: str) -> str:
+    """Validate a precision mode, falling back to fp32 when bf16 is unavailable"""
+    precision = precision.lower()
+    if precision not in PRECISIONS:
+        raise ValueError(f"Unknown precision '{precision}'. Choose one of: {', '.join(PRECISIONS)}")
+
+    if precision == "bf16" and not bf16_supported():
+        print("⚠️ bf16 is not supported on this CPU, falling back to fp32")
+        return "fp32"
+
+    return precision
+
+
+def apply_precision(model: torch.nn.Module, precision: str) -> torch.nn.Module:
+    """Return the model prepared for the given precision mode"""
+    if precision == "int8":
+        with warnings.catch_warnings():
+            # torch.ao dynamic quantization is deprecated in favour of torchao but still works
+            warnings.simplefilter("ignore")
+            return torch.ao.quantization.quantize_dynamic(
+                model, {torch.nn.Linear}, dtype=torch.qint8
+            )
+    return model
+
+
+def autocast_context(precision: str):
+    """Context manager to wrap the forward pass in"""
+    if precision == "bf16":
+        return torch.autocast("cpu", dtype=torch.bfloat16)
+    return contextlib.nullcontext()
@@ -1,30 +1,38 @@
 import os
+import sys
+import csv
+import glob
+import json
+import time
+import argparse
+from collections import deque
+from typing import Dict, Iterable, Iterator, List, Optional, Set, Tuple
 import torch
-from PIL import Image
-from torchvision import transforms
-import timm
+from model_loader import load_classifier
+from preprocess import preprocess_image
+from precision import PRECISIONS, apply_precision, autocast_context, resolve_precision
+from inference import make_executor
 
 # --- Config ---
 _CHECKPOINT_PATH = "vit_plantvillage.pth"
-_DEVICE = "cuda"
+_DEVICE = "cuda" if torch.cuda.is_available() else "cpu"
+_IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+_CSV_FIELDS = ["path", "prediction", "confidence", "top3", "error"]
 
-# --- Load checkpoint and class names ---
-checkpoint = torch.load(_CHECKPOINT_PATH, map_location=_DEVICE)
-class_names = checkpoint["class_names"]
+# --- Model and class names (loaded on first use) ---
+model = None
+class_names = None
+precision = "fp32"
 
-# --- Model ---
-model = timm.create_model("vit_base_patch16_224", pretrained=False)
-model.head = torch.nn.Linear(model.head.in_features, len(class_names))
-model.load_state_dict(checkpoint["model_state_dict"])
-model = model.to(_DEVICE)
-model.eval()
 
-# --- Transform ---
-transform = transforms.Compose([
-    transforms.Resize((224, 224)),
-    transforms.ToTensor(),
-    transforms.Normalize(mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5))
-])
+def load_model(checkpoint_path: str = _CHECKPOINT_PATH, precision_mode: str = "fp32"):
+    """Load the classifier once; later calls return the already loaded model."""
+    global model, class_names, precision
+    if model is None:
+        model, class_names = load_classifier(checkpoint_path, _DEVICE)
+        precision = resolve_precision(precision_mode) if _DEVICE == "cpu" else "fp32"
+        model = apply_precision(model, precision)
+    return model, class_names
 
 
 def predict_image(image_path: str) -> str:
@@ -42,17 +50,203 @@ def predict_image(image_path: str) -> str:
     if not os.path.exists(image_path):
         raise FileNotFoundError(f"Image not found: {image_path}")
 
-    if not image_path.lower().endswith(('.jpg', '.jpeg', '.png')):
-        # Let PIL attempt to open other types, but warn early for common cases.
-        pass
+    load_model()
+    probabilities = predict_batch(preprocess_image(image_path).unsqueeze(0))
+    return class_names[int(torch.argmax(probabilities[0]).item())]
 
-    img = Image.open(image_path).convert("RGB")
-    img_t = transform(img).unsqueeze(0).to(_DEVICE)
 
-    with torch.no_grad():
-        output = model(img_t)
-        pred_idx = int(torch.argmax(output, dim=1).item())
+def predict_batch(batch: torch.Tensor) -> torch.Tensor:
+    """Class probabilities for a batch of preprocessed images."""
+    with torch.inference_mode(), autocast_context(precision):
+        outputs = model(batch.to(_DEVICE))
+    return torch.softmax(outputs.float(), dim=1).cpu()
 
-    return class_names[pred_idx]
 
-print(predict_image(r"C:\Ketan\projects\plant\test\test\CornCommonRust3.JPG"))
+# --- Batch mode ---
+def find_images(inputs: Iterable[str]) -> List[str]:
+    """Expand files, directories (recursively) and glob patterns into a sorted list of image paths."""
+    paths = set()
+    for item in inputs:
+        if os.path.isdir(item):
+            for directory, _, files in os.walk(item):
+                paths.update(os.path.join(directory, f) for f in files if f.lower().endswith(_IMAGE_EXTENSIONS))
+        elif os.path.isfile(item):
+            paths.add(item)
+        else:
+            paths.update(p for p in glob.glob(item, recursive=True)
+                         if os.path.isfile(p) and p.lower().endswith(_IMAGE_EXTENSIONS))
+    return sorted(paths)
+
+
+def output_format(output_path: str) -> str:
+    return "csv" if output_path.lower().endswith(".csv") else "jsonl"
+
+
+def read_processed(output_path: str) -> Set[str]:
+    """Paths already predicted in an earlier run's output; failed files are left out so they get retried.
+
+    A partially written last line (from an interrupted run) is cut off so new results append cleanly.
+    """
+    if not os.path.exists(output_path):
+        return set()
+
+    with open(output_path, "rb") as f:
+        data = f.read()
+    complete = data.rfind(b"\n") + 1
+    if complete < len(data):
+        with open(output_path, "r+b") as f:
+            f.truncate(complete)
+
+    lines = data[:complete].decode("utf-8").splitlines()
+    if output_format(output_path) == "csv":
+        records = csv.DictReader(lines)
+    else:
+        records = (json.loads(line) for line in lines if line.strip())
+    return {os.path.abspath(r["path"]) for r in records if r.get("prediction") and not r.get("error")}
+
+
+def iter_decoded(paths: List[str], workers: int, prefetch: int) -> Iterator[Tuple[str, Optional[torch.Tensor], Optional[str]]]:
+    """Decode images on a thread pool, keeping up to `prefetch` images in flight ahead of the consumer.
+
+    Yields (path, tensor, None) or (path, None, error) in input order.
+    """
+    # One torch thread per decoding worker; the forward pass on the main thread keeps the rest
+    executor = make_executor(workers, 1, "decode")
+    pending = deque()
+    remaining = iter(paths)
+    try:
+        for path in remaining:
+            pending.append((path, executor.submit(preprocess_image, path)))
+            if len(pending) >= prefetch:
+                break
+        while pending:
+            path, future = pending.popleft()
+            next_path = next(remaining, None)
+            if next_path is not None:
+                pending.append((next_path, executor.submit(preprocess_image, next_path)))
+            try:
+                yield path, future.result(), None
+            except Exception as e:
+                yield path, None, str(e)
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def format_record(path: str, probabilities: torch.Tensor) -> Dict:
+    top3_prob, top3_idx = torch.topk(probabilities, min(3, len(class_names)))
+    return {
+        "path": path,
+        "prediction": class_names[int(top3_idx[0])],
+        "confidence": round(float(top3_prob[0]), 6),
+        "top3": [{"class": class_names[int(i)], "confidence": round(float(p), 6)} for p, i in zip(top3_prob, top3_idx)],
+    }
+
+
+class PredictionWriter:
+    """Appends prediction records to a JSONL or CSV file (or JSONL to stdout), flushing after every batch."""
+
+    def __init__(self, output_path: Optional[str]):
+        self.format = output_format(output_path) if output_path else "jsonl"
+        if output_path:
+            write_header = not os.path.exists(output_path) or os.path.getsize(output_path) == 0
+            self.file = open(output_path, "a", newline="", encoding="utf-8")
+        else:
+            write_header = False
+            self.file = sys.stdout
+        if self.format == "csv":
+            self.csv = csv.DictWriter(self.file, fieldnames=_CSV_FIELDS)
+            if write_header:
+                self.csv.writeheader()
+
+    def write(self, records: List[Dict]):
+        for record in records:
+            if self.format == "csv":
+                top3 = ";".join(f"{t['class']}:{t['confidence']}" for t in record.get("top3", []))
+                self.csv.writerow({**{k: record.get(k, "") for k in _CSV_FIELDS}, "top3": top3})
+            else:
+                self.file.write(json.dumps(record) + "\n")
+        self.file.flush()
+
+    def close(self):
+        if self.file is not sys.stdout:
+            self.file.close()
+
+
+def predict_files(paths: List[str], writer: PredictionWriter, batch_size: int, workers: int):
+    """Run every image through the model in batches while the next images decode; returns (succeeded, failed)."""
+    done, failed = 0, 0
+    start = time.perf_counter()
+    batch_paths, batch_tensors, records = [], [], []
+
+    def flush():
+        nonlocal done
+        if not batch_tensors and not records:
+            return
+        if batch_tensors:
+            probabilities = predict_batch(torch.stack(batch_tensors))
+            records.extend(format_record(p, row) for p, row in zip(batch_paths, probabilities))
+        writer.write(records)
+        done += len(records)
+        batch_paths.clear()
+        batch_tensors.clear()
+        records.clear()
+        rate = done / (time.perf_counter() - start)
+        print(f"   {done}/{len(paths)} images ({rate:.1f} images/s)", end="\r", file=sys.stderr)
+
+    for path, tensor, error in iter_decoded(paths, workers, prefetch=2 * batch_size):
+        if error is not None:
+            failed += 1
+            records.append({"path": path, "error": error})
+        else:
+            batch_paths.append(path)
+            batch_tensors.append(tensor)
+        if len(batch_tensors) >= batch_size:
+            flush()
+    flush()
+    print(file=sys.stderr)
+    return done - failed, failed
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Classify plant images: one file, directories or glob patterns")
+    parser.add_argument("inputs", nargs="+", help="Image files, directories (searched recursively) or glob patterns")
+    parser.add_argument("--output", help="JSONL or CSV file to append predictions to (default: JSONL on stdout)")
+    parser.add_argument("--overwrite", action="store_true", help="Start the output over instead of resuming")
+    parser.add_argument("--checkpoint", default=_CHECKPOINT_PATH)
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="Threads reading and decoding images ahead of the model")
+    parser.add_argument("--precision", default="fp32", choices=PRECISIONS)
+    args = parser.parse_args()
+
+    # A single image without --output keeps the original behaviour: print the class name
+    if len(args.inputs) == 1 and os.path.isfile(args.inputs[0]) and not args.output:
+        load_model(args.checkpoint, args.precision)
+        print(predict_image(args.inputs[0]))
+        return
+
+    paths = find_images(args.inputs)
+    if args.output and args.overwrite and os.path.exists(args.output):
+        os.remove(args.output)
+    processed = read_processed(args.output) if args.output else set()
+    todo = [p for p in paths if os.path.abspath(p) not in processed]
+    skipped = len(paths) - len(todo)
+    print(f"🔍 Found {len(paths)} images, {skipped} already predicted, {len(todo)} to go", file=sys.stderr)
+    if not todo:
+        print(f"✅ Nothing to do: {skipped} skipped (already predicted)", file=sys.stderr)
+        return
+
+    load_model(args.checkpoint, args.precision)
+    writer = PredictionWriter(args.output)
+    try:
+        start = time.perf_counter()
+        succeeded, failed = predict_files(todo, writer, args.batch_size, args.workers)
+    finally:
+        writer.close()
+    # Counts cover this run only; images predicted by an earlier run are reported as skipped
+    print(f"✅ {succeeded} succeeded, {failed} failed in {time.perf_counter() - start:.1f}s; "
+          f"{skipped} skipped (already predicted)", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
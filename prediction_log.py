@@ -0,0 +1,346 @@
+#!/usr/bin/env python3
+"""
+Persistent log of served predictions, for auditing and picking images to label.
+
+Every prediction (image hash, top-3, latency, model id, ...) is appended to a
+SQLite database in WAL mode. Requests never write to SQLite themselves: they
+put the record on a bounded in-memory queue, and one background thread per
+process drains it, inserting up to `batch_size` records per transaction.
+WAL mode lets several serve.py workers append to the same file while it is
+being queried.
+
+When the queue is full (the disk cannot keep up), a request waits up to
+`max_wait` seconds for room and then drops its record, so a slow disk costs
+a bounded amount of latency and memory; dropped records are counted. Failed
+writes are counted and passed to the `on_error` callback.
+
+Low-confidence samples to label can be pulled out from the command line:
+
+    python prediction_log.py low-confidence --threshold 0.6 --limit 200 --output to_label.jsonl
+    python prediction_log.py low-confidence --by margin --since 2026-10-01
+    python prediction_log.py stats
+"""
+
+import argparse
+import asyncio
+import json
+import queue
+import sqlite3
+import threading
+import time
+from datetime import datetime
+from typing import Any, Callable, Dict, List, Optional
+
+# --- Config ---
+LOG_PATH = "predictions.db"
+MAX_PENDING = 10000  # Records buffered in memory before requests have to wait
+BATCH_SIZE = 256  # Records per transaction
+FLUSH_INTERVAL = 1.0  # Seconds a record may wait for its batch to fill
+MAX_WAIT = 0.05  # Seconds a request waits for room in a full buffer before the record is dropped
+
+_COLUMNS = (
+    "created_at", "endpoint", "filename", "image_hash", "prediction", "confidence",
+    "margin", "top3", "latency_ms", "model_id", "cascade_stage", "cached",
+)
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS predictions (
+    id INTEGER PRIMARY KEY,
+    created_at REAL NOT NULL,
+    endpoint TEXT NOT NULL,
+    filename TEXT,
+    image_hash TEXT,
+    prediction TEXT NOT NULL,
+    confidence REAL NOT NULL,
+    margin REAL,
+    top3 TEXT NOT NULL,
+    latency_ms REAL,
+    model_id TEXT,
+    cascade_stage TEXT,
+    cached INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS predictions_confidence ON predictions (confidence);
+CREATE INDEX IF NOT EXISTS predictions_created_at ON predictions (created_at);
+"""
+
+
+def connect(path: str, read_only: bool = False) -> sqlite3.Connection:
+    if read_only:
+        db = sqlite3.connect(f"file:{path}?mode=ro", uri=True)
+    else:
+        # Opened at startup, then used only by the writer thread
+        db = sqlite3.connect(path, check_same_thread=False)
+        db.execute("PRAGMA journal_mode=WAL")
+        db.execute("PRAGMA synchronous=NORMAL")  # Durable across process crashes, fsync only at checkpoints
+        db.executescript(_SCHEMA)
+    db.execute("PRAGMA busy_timeout=5000")  # Other workers may hold the write lock for a moment
+    db.row_factory = sqlite3.Row
+    return db
+
+
+def make_record(
+    result: Dict[str, Any],
+    endpoint: str,
+    latency_ms: Optional[float],
+    image_hash: Optional[str],
+    model_id: Optional[str],
+    cached: bool = False,
+) -> Dict[str, Any]:
+    """Log record for a /predict-style result (prediction, confidence, top3_predictions, ...)"""
+    top3 = [{"class": p["class"], "confidence": round(p["confidence"], 6)} for p in result["top3_predictions"]]
+    return {
+        "created_at": time.time(),
+        "endpoint": endpoint,
+        "filename": result.get("filename"),
+        "image_hash": image_hash,
+        "prediction": result["prediction"],
+        "confidence": result["confidence"],
+        # Gap between the two best classes; small margins are the most useful images to label
+        "margin": top3[0]["confidence"] - top3[1]["confidence"] if len(top3) > 1 else None,
+        "top3": top3,
+        "latency_ms": round(latency_ms, 3) if latency_ms is not None else None,
+        "model_id": model_id,
+        "cascade_stage": result.get("cascade_stage"),
+        "cached": cached,
+    }
+
+
+class PredictionLog:
+    """Append-only SQLite prediction log written by a background thread in batches"""
+
+    def __init__(
+        self,
+        path: str = LOG_PATH,
+        max_pending: int = MAX_PENDING,
+        batch_size: int = BATCH_SIZE,
+        flush_interval: float = FLUSH_INTERVAL,
+        max_wait: float = MAX_WAIT,
+        on_error: Optional[Callable[[int, Exception], None]] = None,
+    ):
+        self.path = path
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_wait = max_wait
+        self.on_error = on_error
+        self._queue: queue.Queue = queue.Queue(maxsize=max_pending)
+        self._stop = object()
+
+        self.written = 0
+        self.dropped = 0
+        self.failed = 0
+        self.batches = 0
+        self.last_error: Optional[str] = None
+
+        # Open (and create the schema) up front so a bad path fails at startup, not in the thread
+        self._db = connect(path)
+        self._thread = threading.Thread(target=self._run, name="prediction-log", daemon=True)
+        self._thread.start()
+
+    def put(self, record: Dict[str, Any], timeout: float = 0.0) -> bool:
+        """Queue a record, waiting up to `timeout` seconds for room; False (and counted) if it was dropped"""
+        try:
+            if timeout > 0:
+                self._queue.put(record, timeout=timeout)
+            else:
+                self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            self.dropped += 1
+            return False
+
+    async def write(self, record: Dict[str, Any]) -> bool:
+        """Queue a record from the event loop; only waits (off the loop) when the buffer is full"""
+        try:
+            self._queue.put_nowait(record)
+            return True
+        except queue.Full:
+            return await asyncio.to_thread(self.put, record, self.max_wait)
+
+    def _run(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.flush_interval
+            while len(batch) < self.batch_size and batch[-1] is not self._stop:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+
+            stopping = batch[-1] is self._stop
+            if stopping:
+                batch.pop()
+            if batch:
+                self._insert(batch)
+            if stopping:
+                return
+
+    def _insert(self, records: List[Dict[str, Any]]):
+        try:
+            rows = [
+                tuple(json.dumps(r["top3"]) if c == "top3" else int(r["cached"]) if c == "cached" else r.get(c)
+                      for c in _COLUMNS)
+                for r in records
+            ]
+            with self._db:
+                self._db.executemany(
+                    f"INSERT INTO predictions ({', '.join(_COLUMNS)}) VALUES ({', '.join('?' * len(_COLUMNS))})",
+                    rows,
+                )
+            self.written += len(rows)
+            self.batches += 1
+        except Exception as e:
+            # Any failure (SQLite, or a record value that cannot be serialized or bound) costs this batch only;
+            # the writer thread keeps running
+            self.failed += len(records)
+            self.last_error = f"{type(e).__name__}: {e}"
+            if self.on_error is not None:
+                self.on_error(len(records), e)
+
+    def close(self, timeout: float = 10.0) -> bool:
+        """Write out everything queued so far and stop the writer thread; False if that took over `timeout` seconds"""
+        deadline = time.monotonic() + timeout
+        if self._thread.is_alive():
+            try:
+                self._queue.put(self._stop, timeout=timeout)
+            except queue.Full:
+                # The writer is stuck or gone, so the buffer never drains; give up on the pending records
+                return False
+            self._thread.join(max(0.0, deadline - time.monotonic()))
+        if self._thread.is_alive():
+            return False
+        self._db.close()
+        return True
+
+    def stats(self) -> Dict[str, Any]:
+        """Writer counters for /health"""
+        return {
+            "path": self.path,
+            "pending": self._queue.qsize(),
+            "max_pending": self._queue.maxsize,
+            "written": self.written,
+            "batches": self.batches,
+            "dropped": self.dropped,
+            "failed": self.failed,
+            "last_error": self.last_error,
+        }
+
+
+# --- Queries ---
+def _row_to_dict(row: sqlite3.Row) -> Dict[str, Any]:
+    record = dict(row)
+    record["top3"] = json.loads(record["top3"])
+    record["cached"] = bool(record["cached"])
+    return record
+
+
+def low_confidence_samples(
+    path: str = LOG_PATH,
+    threshold: float = 0.6,
+    limit: int = 100,
+    by: str = "confidence",
+    since: Optional[float] = None,
+    model_id: Optional[str] = None,
+    distinct: bool = True,
+) -> List[Dict[str, Any]]:
+    """
+    Logged predictions with top-1 confidence below `threshold`, least certain first
+
+    `by` orders by top-1 `confidence` or by the top-1/top-2 `margin`. With `distinct`, each image hash
+    is returned once (its least certain prediction), so repeated uploads are labelled once.
+    """
+    if by not in ("confidence", "margin"):
+        raise ValueError(f"Unknown order '{by}', use confidence or margin")
+
+    conditions, params = ["confidence < ?"], [threshold]
+    if since is not None:
+        conditions.append("created_at >= ?")
+        params.append(since)
+    if model_id:
+        conditions.append("model_id = ?")
+        params.append(model_id)
+    where = " AND ".join(conditions)
+    order = f"{by} IS NULL, {by}, created_at"
+
+    if distinct:
+        query = (
+            f"SELECT * FROM (SELECT *, ROW_NUMBER() OVER (PARTITION BY COALESCE(image_hash, id) "
+            f"ORDER BY {order}) AS rank FROM predictions WHERE {where}) WHERE rank = 1 ORDER BY {order} LIMIT ?"
+        )
+    else:
+        query = f"SELECT * FROM predictions WHERE {where} ORDER BY {order} LIMIT ?"
+
+    db = connect(path, read_only=True)
+    try:
+        rows = db.execute(query, (*params, limit)).fetchall()
+    finally:
+        db.close()
+    samples = [_row_to_dict(row) for row in rows]
+    for sample in samples:
+        sample.pop("rank", None)
+    return samples
+
+
+def log_stats(path: str = LOG_PATH) -> Dict[str, Any]:
+    """Row counts, time range and per-class mean confidence of the log"""
+    db = connect(path, read_only=True)
+    try:
+        total, first, last, mean = db.execute(
+            "SELECT COUNT(*), MIN(created_at), MAX(created_at), AVG(confidence) FROM predictions"
+        ).fetchone()
+        classes = db.execute(
+            "SELECT prediction, COUNT(*), AVG(confidence) FROM predictions GROUP BY prediction ORDER BY 2 DESC"
+        ).fetchall()
+        models = db.execute("SELECT model_id, COUNT(*) FROM predictions GROUP BY model_id ORDER BY 2 DESC").fetchall()
+    finally:
+        db.close()
+    return {
+        "predictions": total,
+        "first": datetime.fromtimestamp(first).isoformat(timespec="seconds") if first else None,
+        "last": datetime.fromtimestamp(last).isoformat(timespec="seconds") if last else None,
+        "mean_confidence": round(mean, 4) if mean is not None else None,
+        "classes": {name: {"count": count, "mean_confidence": round(avg, 4)} for name, count, avg in classes},
+        "models": {name: count for name, count in models},
+    }
+
+
+def parse_since(value: str) -> float:
+    """ISO date/time or a number of hours ago, e.g. "2026-10-01" or "24h" """
+    if value.endswith("h"):
+        return time.time() - float(value[:-1]) * 3600
+    return datetime.fromisoformat(value).timestamp()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query the persistent prediction log")
+    parser.add_argument("--db", default=LOG_PATH, help="Prediction log database (PREDICTION_LOG_PATH of the API)")
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    low_parser = subparsers.add_parser("low-confidence", help="Export the least certain predictions for labelling")
+    low_parser.add_argument("--threshold", type=float, default=0.6, help="Only predictions below this confidence")
+    low_parser.add_argument("--limit", type=int, default=100)
+    low_parser.add_argument("--by", default="confidence", choices=["confidence", "margin"])
+    low_parser.add_argument("--since", type=parse_since, help='ISO date/time or hours ago, e.g. "24h"')
+    low_parser.add_argument("--model-id", help="Only predictions of this model version")
+    low_parser.add_argument("--all", action="store_true", help="Keep repeated uploads of the same image")
+    low_parser.add_argument("--output", help="JSONL file to write (default: stdout)")
+
+    subparsers.add_parser("stats", help="Print log statistics")
+    args = parser.parse_args()
+
+    if args.command == "stats":
+        print(json.dumps(log_stats(args.db), indent=1))
+        return
+
+    samples = low_confidence_samples(
+        args.db, args.threshold, args.limit, args.by, args.since, args.model_id, distinct=not args.all
+    )
+    lines = "".join(json.dumps(sample) + "\n" for sample in samples)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(lines)
+        print(f"💾 {len(samples)} low-confidence predictions saved to {args.output}")
+    else:
+        print(lines, end="")
+
+
+if __name__ == "__main__":
+    main()
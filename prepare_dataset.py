@@ -0,0 +1,222 @@
+#!/usr/bin/env python3
+"""
+Convert the image splits to pre-resized, memory-mapped uint8 shards.
+
+Each split directory holds `shard_NNNNN.npy` arrays of shape (N, 3, 224, 224)
+plus an `index.json` that maps every source image to its shard row and label.
+Training and evaluation read these with zero-copy slicing instead of decoding
+and resizing JPEGs on every pass. Re-running the converter only writes new
+shards for images that are new or changed since the last run:
+
+    python prepare_dataset.py --data-dir data/ --test-dir test/test_renamed
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import torch
+from torch.utils.data import Dataset
+
+from preprocess import IMAGE_SIZE, decode_image, normalize, resize_uint8, to_uint8_tensor
+
+# --- Config ---
+DATA_DIR = "data/"
+TEST_DIR = "test/test_renamed"
+OUTPUT_DIR = "prepared"
+SHARD_SIZE = 1024
+INDEX_NAME = "index.json"
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def list_imagefolder(split_dir: str) -> Tuple[List[Tuple[str, int]], List[str]]:
+    """(path, label) pairs for an ImageFolder-style split, plus its class names"""
+    class_names = sorted(d.name for d in os.scandir(split_dir) if d.is_dir())
+    samples = []
+    for label, class_name in enumerate(class_names):
+        class_dir = os.path.join(split_dir, class_name)
+        for root, _, files in sorted(os.walk(class_dir)):
+            for fname in sorted(files):
+                if fname.lower().endswith(IMAGE_EXTENSIONS):
+                    samples.append((os.path.join(root, fname), label))
+    return samples, class_names
+
+
+def list_test_dir(test_dir: str, class_names: List[str]) -> List[Tuple[str, int]]:
+    """(path, label) pairs for the flat test directory, labelled from file names like eval.py"""
+    from eval import extract_label
+
+    samples = []
+    for fname in sorted(os.listdir(test_dir)):
+        if not fname.lower().endswith(IMAGE_EXTENSIONS):
+            continue
+        label_name = extract_label(fname)
+        if label_name not in class_names:
+            print(f"⚠️ Skipping {fname}: unknown class {label_name}")
+            continue
+        samples.append((os.path.join(test_dir, fname), class_names.index(label_name)))
+    return samples
+
+
+def load_resized(path: str, size: int) -> np.ndarray:
+    image = decode_image(path, size)
+    return resize_uint8(to_uint8_tensor(image), (size, size)).numpy()
+
+
+def convert_split(samples, class_names, output_dir, shard_size, size, workers):
+    """Append shards for new or changed images and update the split index"""
+    os.makedirs(output_dir, exist_ok=True)
+    index_path = os.path.join(output_dir, INDEX_NAME)
+
+    index = {"class_names": class_names, "image_size": size, "shards": [], "files": {}}
+    if os.path.exists(index_path):
+        with open(index_path) as f:
+            index = json.load(f)
+        if index["class_names"] != class_names or index["image_size"] != size:
+            raise ValueError(f"{output_dir} was prepared with different classes or image size; remove it first")
+
+    # Images are keyed by path; size and mtime detect files that changed in place
+    pending = []
+    current = set()
+    for path, label in samples:
+        stat = os.stat(path)
+        signature = [stat.st_size, stat.st_mtime_ns]
+        current.add(path)
+        entry = index["files"].get(path)
+        if entry is None or entry["signature"] != signature or entry["label"] != label:
+            pending.append((path, label, signature))
+
+    removed = [path for path in index["files"] if path not in current]
+    for path in removed:
+        del index["files"][path]
+
+    print(f"{output_dir}: {len(samples)} images, {len(pending)} new or changed, {len(removed)} removed")
+
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for chunk_start in range(0, len(pending), shard_size):
+            chunk = pending[chunk_start:chunk_start + shard_size]
+            shard_id = len(index["shards"])
+            shard_file = f"shard_{shard_id:05d}.npy"
+
+            shard = np.lib.format.open_memmap(
+                os.path.join(output_dir, shard_file), mode="w+", dtype=np.uint8,
+                shape=(len(chunk), 3, size, size)
+            )
+            for row, pixels in enumerate(executor.map(lambda item: load_resized(item[0], size), chunk)):
+                shard[row] = pixels
+            shard.flush()
+            del shard
+
+            index["shards"].append({"file": shard_file, "count": len(chunk)})
+            for row, (path, label, signature) in enumerate(chunk):
+                index["files"][path] = {"shard": shard_id, "row": row, "label": label, "signature": signature}
+
+            # Rewrite the index after every shard so an interrupted run keeps finished shards
+            write_index(index_path, index)
+            done = chunk_start + len(chunk)
+            print(f"   {done}/{len(pending)} images written ({done / (time.perf_counter() - start):.1f} images/sec)")
+
+    write_index(index_path, index)
+
+
+def write_index(index_path: str, index: Dict):
+    tmp_path = index_path + ".tmp"
+    with open(tmp_path, "w") as f:
+        json.dump(index, f)
+    os.replace(tmp_path, index_path)
+
+
+class PreparedImageDataset(Dataset):
+    """Zero-copy reader for a split written by prepare_dataset.py"""
+
+    def __init__(self, split_dir: str):
+        with open(os.path.join(split_dir, INDEX_NAME)) as f:
+            index = json.load(f)
+
+        self.classes = index["class_names"]
+        self.image_size = index["image_size"]
+        self.shard_paths = [os.path.join(split_dir, shard["file"]) for shard in index["shards"]]
+        self._shards = None
+
+        entries = sorted(index["files"].items())
+        self.paths = [path for path, _ in entries]
+        self.locations = np.array([[e["shard"], e["row"]] for _, e in entries], dtype=np.int64).reshape(-1, 2)
+        self.labels = [e["label"] for _, e in entries]
+
+    def __getstate__(self):
+        # Re-open the mappings in DataLoader workers instead of pickling the arrays
+        state = self.__dict__.copy()
+        state["_shards"] = None
+        return state
+
+    @property
+    def shards(self):
+        if self._shards is None:
+            # Copy-on-write mappings: pages are shared with the OS cache and never copied unless written
+            self._shards = [np.load(path, mmap_mode="c") for path in self.shard_paths]
+        return self._shards
+
+    def __len__(self):
+        return len(self.paths)
+
+    def __getitem__(self, idx):
+        shard, row = self.locations[idx]
+        return normalize(torch.from_numpy(self.shards[shard][row])), self.labels[idx]
+
+    def iter_batches(self, batch_size: int):
+        """Yield (images, labels) using contiguous shard slices where possible, without per-item collation"""
+        start = 0
+        while start < len(self):
+            shard, row = self.locations[start]
+            end = start + 1
+            # Extend the batch while rows stay consecutive within the same shard
+            while (
+                end < len(self) and end - start < batch_size
+                and self.locations[end][0] == shard and self.locations[end][1] == row + (end - start)
+            ):
+                end += 1
+            pixels = torch.from_numpy(self.shards[shard][row:row + (end - start)])
+            yield normalize(pixels), torch.tensor(self.labels[start:end])
+            start = end
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Write memory-mapped, pre-resized dataset shards")
+    parser.add_argument("--data-dir", default=DATA_DIR, help="ImageFolder root with train/ and valid/")
+    parser.add_argument("--test-dir", default=TEST_DIR, help="Flat test directory labelled by file name")
+    parser.add_argument("--output-dir", default=OUTPUT_DIR)
+    parser.add_argument("--checkpoint", default="vit_plantvillage.pth",
+                        help="Source of class names when data/train is not available")
+    parser.add_argument("--shard-size", type=int, default=SHARD_SIZE, help="Images per shard")
+    parser.add_argument("--image-size", type=int, default=IMAGE_SIZE)
+    parser.add_argument("--workers", type=int, default=min(8, os.cpu_count() or 1))
+    args = parser.parse_args()
+
+    class_names: Optional[List[str]] = None
+    for split in ("train", "valid"):
+        split_dir = os.path.join(args.data_dir, split)
+        if not os.path.isdir(split_dir):
+            continue
+        samples, split_classes = list_imagefolder(split_dir)
+        class_names = class_names or split_classes
+        convert_split(samples, split_classes, os.path.join(args.output_dir, split),
+                      args.shard_size, args.image_size, args.workers)
+
+    if args.test_dir and os.path.isdir(args.test_dir):
+        if class_names is None:
+            from model_loader import read_checkpoint
+            _, class_names, _ = read_checkpoint(args.checkpoint)
+        samples = list_test_dir(args.test_dir, class_names)
+        convert_split(samples, class_names, os.path.join(args.output_dir, "test"),
+                      args.shard_size, args.image_size, args.workers)
+
+    print(f"✅ Prepared dataset written to {args.output_dir}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,213 @@
+#!/usr/bin/env python3
+"""
+Pre-fork multi-process server for the CropGuard AI API.
+
+The model is loaded once in this supervisor process and N uvicorn workers
+are forked from it afterwards, so they share the weights copy-on-write
+instead of loading a copy each. Every worker gets a fixed torch thread
+budget so workers don't oversubscribe the cores, workers that crash are
+restarted, and `/health` only reports `ready` once every worker has finished
+its warm-up (see `warm_up` in main.py):
+
+    python serve.py --workers 4 --threads-per-worker 2
+
+Requires `os.fork` (Linux/macOS). Prediction caches and `/metrics` are per
+worker. Only worker 0 adds predictions to the similar-image index; the other
+workers search the index as it was when they started.
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import signal
+import socket
+import sys
+import time
+from typing import Dict
+
+import torch
+
+# --- Config ---
+HOST = "0.0.0.0"
+PORT = 8000
+MIN_UPTIME = 10.0  # Seconds; workers that die sooner are restarted with backoff
+MAX_BACKOFF = 30.0
+
+
+class WorkerPool:
+    """Readiness flags in shared memory, written by the workers and read by every worker's /health"""
+
+    def __init__(self, size: int):
+        self.size = size
+        self.ready = multiprocessing.Array("b", size)
+        self.restarts = multiprocessing.Value("i", 0)
+
+    def mark(self, slot: int, ready: bool):
+        self.ready[slot] = 1 if ready else 0
+
+    def ready_count(self) -> int:
+        return sum(self.ready[:])
+
+    def all_ready(self) -> bool:
+        return self.ready_count() == self.size
+
+    def stats(self) -> Dict[str, int]:
+        return {"workers": self.size, "ready": self.ready_count(), "restarts": self.restarts.value}
+
+
+def run_worker(slot: int, sock: socket.socket, pool: WorkerPool, args):
+    """Body of a forked worker: configure threads, serve on the shared socket"""
+    import uvicorn
+    import main as api
+
+    # Forked children inherit the supervisor's handlers; uvicorn installs its own
+    signal.signal(signal.SIGTERM, signal.SIG_DFL)
+    signal.signal(signal.SIGINT, signal.SIG_DFL)
+
+    torch.set_num_threads(args.threads_per_worker)
+    api.TORCH_THREADS = args.threads_per_worker
+    api.PREPROCESS_WORKERS = args.preprocess_workers
+    api.worker_pool = pool
+    # Index files are append-only logs; a single writer keeps them consistent
+    api.embedding_index_writable = slot == 0
+    api.treatment_cache.reopen()
+
+    async def wait_for_warmup():
+        await api.warmup_task
+        if api.warmup_error is None:
+            pool.mark(slot, True)
+            print(f"🔥 Worker {slot} (pid {os.getpid()}) ready")
+
+    async def mark_ready():
+        # main.startup_event has started the warm-up; the worker counts as ready once it finishes
+        asyncio.create_task(wait_for_warmup())
+
+    async def mark_stopped():
+        pool.mark(slot, False)
+
+    api.app.router.add_event_handler("startup", mark_ready)
+    api.app.router.add_event_handler("shutdown", mark_stopped)
+
+    config = uvicorn.Config(api.app, log_level=args.log_level)
+    uvicorn.Server(config).run(sockets=[sock])
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Serve the API from N pre-forked workers sharing one model")
+    parser.add_argument("--host", default=HOST)
+    parser.add_argument("--port", type=int, default=PORT)
+    parser.add_argument("--workers", type=int, default=2)
+    parser.add_argument("--threads-per-worker", type=int, default=None,
+                        help="Torch intra-op threads per worker (default: cores / workers)")
+    parser.add_argument("--preprocess-workers", type=int, default=None,
+                        help="Decoding threads per worker (default: threads per worker)")
+    parser.add_argument("--log-level", default="info")
+    args = parser.parse_args()
+
+    if not hasattr(os, "fork"):
+        print("❌ Multi-process serving needs os.fork; on this platform run main.py with one worker")
+        return 1
+
+    args.threads_per_worker = args.threads_per_worker or max(1, (os.cpu_count() or 1) // args.workers)
+    args.preprocess_workers = args.preprocess_workers or args.threads_per_worker
+
+    import main as api
+
+    # Fail once here rather than in a crash-looping worker
+    try:
+        api.get_warmup_batch_sizes()
+    except ValueError as e:
+        print(f"❌ {e}")
+        return 1
+
+    # Load once before forking so all workers share the weights. CUDA contexts and
+    # onnxruntime thread pools do not survive fork, so those load in each worker instead.
+    if api.DEVICE == "cpu" and api.MODEL_BACKEND != "onnx":
+        api.load_model()
+    else:
+        print(f"⚠️ {api.MODEL_BACKEND} on {api.DEVICE}: each worker loads its own copy of the model")
+
+    sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+    sock.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
+    sock.bind((args.host, args.port))
+    sock.listen(2048)
+    sock.set_inheritable(True)
+
+    pool = WorkerPool(args.workers)
+    children: Dict[int, int] = {}  # pid -> slot
+    started: Dict[int, float] = {}  # slot -> start time
+    crashes: Dict[int, int] = {}  # slot -> consecutive early exits
+    respawn_at: Dict[int, float] = {}  # slot -> when to restart it
+
+    def spawn(slot: int):
+        pid = os.fork()
+        if pid == 0:
+            code = 0
+            try:
+                run_worker(slot, sock, pool, args)
+            except BaseException as e:
+                print(f"❌ Worker {slot} failed: {e}")
+                code = 1
+            finally:
+                os._exit(code)
+        children[pid] = slot
+        started[slot] = time.monotonic()
+
+    stopping = False
+
+    def request_stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGTERM, request_stop)
+    signal.signal(signal.SIGINT, request_stop)
+
+    print(f"🚀 Starting {args.workers} workers on http://{args.host}:{args.port} "
+          f"({args.threads_per_worker} torch threads each)")
+    for slot in range(args.workers):
+        spawn(slot)
+
+    announced = False
+    while not stopping:
+        try:
+            pid, status = os.waitpid(-1, os.WNOHANG)
+        except ChildProcessError:
+            pid, status = 0, 0
+
+        if pid and pid in children:
+            slot = children.pop(pid)
+            pool.mark(slot, False)
+            announced = False
+            uptime = time.monotonic() - started[slot]
+
+            # Back off when a worker keeps dying right after start, e.g. out of memory while warming up
+            crashes[slot] = crashes.get(slot, 0) + 1 if uptime < MIN_UPTIME else 0
+            delay = min(MAX_BACKOFF, 2 ** crashes[slot]) if crashes[slot] else 0.0
+            respawn_at[slot] = time.monotonic() + delay
+            print(f"⚠️ Worker {slot} (pid {pid}) exited with status {os.waitstatus_to_exitcode(status)} "
+                  f"after {uptime:.1f}s; restarting in {delay:.0f}s")
+
+        for slot, due in list(respawn_at.items()):
+            if time.monotonic() >= due and not stopping:
+                del respawn_at[slot]
+                with pool.restarts.get_lock():
+                    pool.restarts.value += 1
+                spawn(slot)
+
+        if not announced and pool.all_ready():
+            print(f"✅ All {args.workers} workers warm; ready to serve")
+            announced = True
+        if not pid:
+            time.sleep(0.2)
+
+    print("👋 Stopping workers...")
+    for pid in children:
+        os.kill(pid, signal.SIGTERM)
+    for pid in list(children):
+        os.waitpid(pid, 0)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -3,6 +3,7 @@
 Script to start the CropGuard AI API server
 """
 
+import argparse
 import subprocess
 import sys
 import os
@@ -31,19 +32,24 @@ def check_model():
         print("Please ensure the trained model is in the project root.")
         return False
 
-def start_server():
-    """Start the FastAPI server"""
+def start_server(workers=1, threads_per_worker=None, port=8000):
+    """Start the FastAPI server, pre-forking several workers that share the model when workers > 1"""
     print("🚀 Starting CropGuard AI API server...")
-    print("📡 API will be available at: http://localhost:8000")
-    print("📖 API documentation at: http://localhost:8000/docs")
+    print(f"📡 API will be available at: http://localhost:{port}")
+    print(f"📖 API documentation at: http://localhost:{port}/docs")
     print("🔄 Press Ctrl+C to stop the server")
     print("-" * 50)
 
+    if workers > 1:
+        command = [sys.executable, "serve.py", "--workers", str(workers), "--port", str(port)]
+        if threads_per_worker:
+            command += ["--threads-per-worker", str(threads_per_worker)]
+    else:
+        command = [sys.executable, "-m", "uvicorn", "main:app", "--host", "0.0.0.0", "--port", str(port)]
+
     try:
         # Run the server
-        subprocess.run([
-            sys.executable, "main.py"
-        ], check=True)
+        subprocess.run(command, check=True)
     except KeyboardInterrupt:
         print("\n👋 Server stopped by user")
     except subprocess.CalledProcessError as e:
@@ -54,6 +60,13 @@ def start_server():
 
 def main():
     """Main function"""
+    parser = argparse.ArgumentParser(description="Start the CropGuard AI API server")
+    parser.add_argument("--workers", type=int, default=1,
+                        help="Worker processes; more than one forks them from a shared, pre-loaded model")
+    parser.add_argument("--threads-per-worker", type=int, help="Torch threads per worker (default: cores / workers)")
+    parser.add_argument("--port", type=int, default=8000)
+    args = parser.parse_args()
+
     print("🌱 CropGuard AI API Launcher")
     print("=" * 40)
 
@@ -65,7 +78,7 @@ def main():
         return 1
 
     # Start server
-    success = start_server()
+    success = start_server(args.workers, args.threads_per_worker, args.port)
 
     return 0 if success else 1
 
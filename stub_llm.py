@@ -0,0 +1,116 @@
+#!/usr/bin/env python3
+"""
+Local stub of the OpenAI-compatible chat completions API.
+
+Lets the treatment endpoint and its cache be exercised offline:
+
+    python stub_llm.py --port 8001 --delay 0.5
+    OPENROUTER_BASE_URL=http://localhost:8001/v1 OPENROUTER_API_KEY=stub python main.py
+"""
+
+import argparse
+import asyncio
+import json
+import re
+import time
+import uuid
+
+from fastapi import FastAPI, Request
+from fastapi.responses import StreamingResponse
+
+STUB_RESPONSE = """1. IMMEDIATE ACTIONS (first 24-48 hours):
+   - Pesticide: Stub fungicide, 2 ml per liter
+   - Application method: Foliar spray
+
+2. TREATMENT PROTOCOL (next 7-14 days):
+   - Chemical options: Rotate stub fungicides every 7 days
+   - Biological options: Stub biopesticide
+   - Cultural practices: Remove infected leaves
+
+3. PREVENTION MEASURES:
+   - Resistant varieties
+   - Crop rotation strategy
+   - Field sanitation
+
+4. CAUTIONS:
+   - Local regulations
+   - Environmental impact
+   - Pesticide resistance management"""
+
+app = FastAPI(title="Stub LLM")
+app.state.delay = 0.0
+app.state.calls = 0
+
+
+async def stream_completion(completion_id: str, model: str):
+    """Yield the canned response word by word as OpenAI-style SSE chunks"""
+    tokens = re.findall(r"\S+\s*", STUB_RESPONSE)
+    for i, token in enumerate(tokens):
+        await asyncio.sleep(app.state.delay / len(tokens))
+        chunk = {
+            "id": completion_id,
+            "object": "chat.completion.chunk",
+            "created": int(time.time()),
+            "model": model,
+            "choices": [
+                {
+                    "index": 0,
+                    "delta": {"content": token},
+                    "finish_reason": "stop" if i == len(tokens) - 1 else None,
+                }
+            ],
+        }
+        yield f"data: {json.dumps(chunk)}\n\n"
+    yield "data: [DONE]\n\n"
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    """Return a canned completion after the configured delay"""
+    body = await request.json()
+    app.state.calls += 1
+    completion_id = f"chatcmpl-{uuid.uuid4().hex}"
+
+    if body.get("stream"):
+        return StreamingResponse(
+            stream_completion(completion_id, body.get("model", "stub")),
+            media_type="text/event-stream",
+        )
+
+    await asyncio.sleep(app.state.delay)
+    return {
+        "id": completion_id,
+        "object": "chat.completion",
+        "created": int(time.time()),
+        "model": body.get("model", "stub"),
+        "choices": [
+            {
+                "index": 0,
+                "message": {"role": "assistant", "content": STUB_RESPONSE},
+                "finish_reason": "stop",
+            }
+        ],
+        "usage": {"prompt_tokens": 0, "completion_tokens": 0, "total_tokens": 0},
+    }
+
+
+@app.get("/stats")
+async def stats():
+    """Number of completions served, used to verify caching and coalescing"""
+    return {"calls": app.state.calls}
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run a local stub LLM server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8001)
+    parser.add_argument("--delay", type=float, default=0.5, help="Seconds to wait before answering")
+    args = parser.parse_args()
+
+    import uvicorn
+    app.state.delay = args.delay
+    uvicorn.run(app, host=args.host, port=args.port)
+
+
+if __name__ == "__main__":
+    main()
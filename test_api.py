@@ -6,11 +6,15 @@ Run this script to test the API endpoints and functionality.
 
 import requests
 import os
+import sys
+import json
 import time
+from concurrent.futures import ThreadPoolExecutor
 from pathlib import Path
 
 # API base URL
 BASE_URL = "http://localhost:8000"
+STUB_LLM_URL = os.getenv("STUB_LLM_URL", "http://localhost:8001")  # stub_llm.py, counts upstream calls
 
 def test_health_check():
     """Test the health check endpoint"""
@@ -82,6 +86,77 @@ def test_prediction():
         print(f"❌ Prediction failed: {e}")
         return False
 
+def test_batch_prediction():
+    """Test the batch prediction endpoint with several sample images"""
+    print("\n🗂️  Testing batch prediction endpoint...")
+
+    test_dir = Path("test/test_renamed")
+    test_images = list(test_dir.glob("*.JPG"))[:4] if test_dir.exists() else []
+    if not test_images:
+        print("❌ No test images found in test/test_renamed/")
+        return False
+
+    try:
+        files = [
+            ("files", (image.name, open(image, "rb"), "image/jpeg"))
+            for image in test_images
+        ]
+        response = requests.post(f"{BASE_URL}/predict/batch", files=files, stream=True)
+        response.raise_for_status()
+
+        results = [json.loads(line) for line in response.iter_lines() if line]
+        for _, (_, f, _) in files:
+            f.close()
+
+        if len(results) != len(test_images):
+            print(f"❌ Expected {len(test_images)} results, got {len(results)}")
+            return False
+
+        print(f"✅ Batch prediction successful: {len(results)} images")
+        for result in results:
+            print(f"   {result['filename']}: {result.get('prediction', result.get('error'))}")
+        return True
+    except Exception as e:
+        print(f"❌ Batch prediction failed: {e}")
+        return False
+
+def test_treatment_cache():
+    """Test that repeated and concurrent treatment requests reach the LLM once; None when skipped"""
+    print("\n💊 Testing treatment recommendations cache...")
+    # A severity no other run uses, so the first request is a guaranteed miss
+    payload = {"disease_name": "Apple___Apple_scab", "confidence": round(time.time() % 1000 / 1000, 3)}
+
+    try:
+        calls_before = requests.get(f"{STUB_LLM_URL}/stats").json()["calls"]
+    except requests.RequestException:
+        reason = f"stub_llm.py is not running at {STUB_LLM_URL}"
+        if "pytest" in sys.modules:
+            import pytest
+            pytest.skip(reason)
+        print(f"⏭️  Skipped: {reason}")
+        print("   Start it and point the API at it with OPENROUTER_BASE_URL to test offline.")
+        return None
+
+    try:
+        with ThreadPoolExecutor(max_workers=5) as pool:
+            concurrent = list(pool.map(lambda _: requests.post(f"{BASE_URL}/treatment", json=payload), range(5)))
+        start = time.time()
+        repeated = [requests.post(f"{BASE_URL}/treatment", json=payload) for _ in range(3)]
+        elapsed = (time.time() - start) / len(repeated)
+        for response in concurrent + repeated:
+            response.raise_for_status()
+        calls = requests.get(f"{STUB_LLM_URL}/stats").json()["calls"] - calls_before
+
+        if len({r.json()["recommendations"] for r in concurrent + repeated}) != 1 or calls != 1:
+            print(f"❌ {len(concurrent) + len(repeated)} treatment requests made {calls} LLM calls, expected 1")
+            return False
+
+        print(f"✅ Treatment cache working: 8 requests, 1 LLM call, cached responses in {elapsed * 1000:.1f} ms")
+        return True
+    except Exception as e:
+        print(f"❌ Treatment cache test failed: {e}")
+        return False
+
 def test_detailed_health():
     """Test the detailed health endpoint"""
     print("\n🏥 Testing detailed health check...")
@@ -110,18 +185,18 @@ def main():
         test_health_check,
         test_get_classes,
         test_detailed_health,
-        test_prediction
+        test_prediction,
+        test_batch_prediction,
+        test_treatment_cache
     ]
 
-    passed = 0
-    total = len(tests)
-
-    for test in tests:
-        if test():
-            passed += 1
+    results = [test() for test in tests]
+    passed = results.count(True)
+    skipped = results.count(None)
+    total = len(tests) - skipped
 
     print("\n" + "=" * 50)
-    print(f"📊 Test Results: {passed}/{total} tests passed")
+    print(f"📊 Test Results: {passed}/{total} tests passed ({skipped} skipped)")
 
     if passed == total:
         print("🎉 All tests passed! API is working correctly.")
@@ -0,0 +1,112 @@
+#!/usr/bin/env python3
+"""
+Test script for archive uploads to /predict/batch
+Serves a tiny randomly initialized ViT through the real app and checks that
+archives are limited by member count and uncompressed size before anything
+is decompressed. Runs under pytest.
+"""
+
+import io
+import json
+import tarfile
+import zipfile
+
+import numpy as np
+import pytest
+import torch
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import main
+from model_loader import create_classifier
+
+CLASS_NAMES = ["Tomato___Early_blight", "Tomato___healthy", "Potato___Late_blight"]
+TINY_MODEL = "vit_tiny_patch16_224"
+MAX_FILES = 4
+MAX_EXTRACT_MB = 1
+
+def make_image(seed):
+    pixels = np.random.default_rng(seed).integers(0, 256, (64, 64, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+def make_zip(members):
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w", compression=zipfile.ZIP_DEFLATED) as archive:
+        for name, data in members:
+            archive.writestr(name, data)
+    return buffer.getvalue()
+
+def make_tar(members):
+    buffer = io.BytesIO()
+    with tarfile.open(fileobj=buffer, mode="w:gz") as archive:
+        for name, data in members:
+            info = tarfile.TarInfo(name)
+            info.size = len(data)
+            archive.addfile(info, io.BytesIO(data))
+    return buffer.getvalue()
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("batch")
+    checkpoint = tmp_path / "tiny.pth"
+    model = create_classifier(len(CLASS_NAMES), "cpu", TINY_MODEL)
+    torch.save({"model_state_dict": model.state_dict(), "class_names": CLASS_NAMES, "model_name": TINY_MODEL},
+               checkpoint)
+
+    patch = pytest.MonkeyPatch()
+    patch.setattr(main, "CHECKPOINT_PATH", str(checkpoint))
+    patch.setattr(main, "EMBEDDING_INDEX_DIR", "")
+    patch.setattr(main, "PREDICTION_LOG_PATH", "")
+    patch.setattr(main, "WARMUP_BATCH_SIZES", "0")
+    patch.setattr(main, "MAX_BATCH_FILES", MAX_FILES)
+    patch.setattr(main, "MAX_ARCHIVE_EXTRACT_MB", MAX_EXTRACT_MB)
+    patch.setattr(main, "model", None)
+    with TestClient(main.app) as test_client:
+        yield test_client
+    patch.undo()
+
+@pytest.fixture
+def no_extraction(monkeypatch):
+    """Fail the test if any member is decompressed"""
+    def refuse(*args, **kwargs):
+        raise AssertionError("archive member was decompressed")
+    monkeypatch.setattr(zipfile.ZipFile, "read", refuse)
+    monkeypatch.setattr(tarfile.TarFile, "extractfile", refuse)
+
+def upload(client, name, contents):
+    return client.post("/predict/batch", files=[("files", (name, contents, "application/octet-stream"))])
+
+def test_archive_within_limits_is_predicted(client):
+    archive = make_zip([(f"leaf{i}.jpg", make_image(i)) for i in range(MAX_FILES)])
+    response = upload(client, "leaves.zip", archive)
+    assert response.status_code == 200
+    results = [json.loads(line) for line in response.text.splitlines()]
+    assert [r["filename"] for r in results] == [f"leaf{i}.jpg" for i in range(MAX_FILES)]
+
+@pytest.mark.parametrize("make_archive, name", [(make_zip, "bomb.zip"), (make_tar, "bomb.tar.gz")])
+def test_zip_bomb_is_rejected(client, no_extraction, make_archive, name):
+    # A few KB compressed, 8 MB once decompressed
+    archive = make_archive([("leaf.jpg", bytes(8 * 1024 * 1024))])
+    assert len(archive) < 100 * 1024
+    response = upload(client, name, archive)
+    assert response.status_code == 413
+    assert "Archive too large" in response.json()["detail"]
+
+@pytest.mark.parametrize("make_archive, name", [(make_zip, "many.zip"), (make_tar, "many.tar.gz")])
+def test_too_many_members_is_rejected(client, no_extraction, make_archive, name):
+    archive = make_archive([(f"leaf{i}.jpg", b"x") for i in range(MAX_FILES + 1)])
+    response = upload(client, name, archive)
+    assert response.status_code == 413
+    assert "Too many images" in response.json()["detail"]
+
+def test_limits_cover_the_whole_request(client, no_extraction):
+    """Images uploaded next to the archive count towards the same limit"""
+    archive = make_zip([(f"leaf{i}.jpg", b"x") for i in range(MAX_FILES - 1)])
+    response = client.post("/predict/batch", files=[
+        ("files", ("loose0.jpg", make_image(0), "image/jpeg")),
+        ("files", ("loose1.jpg", make_image(1), "image/jpeg")),
+        ("files", ("leaves.zip", archive, "application/zip")),
+    ])
+    assert response.status_code == 413
@@ -0,0 +1,50 @@
+#!/usr/bin/env python3
+"""
+Test script for the checkpoint loader
+Saves small randomly initialized timm models and checks that load_classifier
+restores them exactly, including architectures with non-persistent buffers
+that are not stored in the checkpoint. Runs under pytest.
+"""
+
+import argparse
+
+import pytest
+import torch
+
+from model_loader import create_classifier, load_classifier
+
+CLASS_NAMES = ["Tomato___Early_blight", "Tomato___healthy", "Potato___Late_blight"]
+
+@pytest.mark.parametrize("model_name", [
+    "mobilenetv3_small_050",  # Every buffer is persistent
+    "levit_128s",  # Non-persistent attention_bias_idxs
+    "swin_tiny_patch4_window7_224",  # Non-persistent relative_position_index and attn_mask
+])
+def test_checkpoint_round_trip(tmp_path, model_name):
+    torch.manual_seed(0)
+    model = create_classifier(len(CLASS_NAMES), "cpu", model_name).eval()
+    checkpoint = tmp_path / "model.pth"
+    torch.save({"model_state_dict": model.state_dict(), "class_names": CLASS_NAMES, "model_name": model_name},
+               checkpoint)
+
+    loaded, class_names = load_classifier(str(checkpoint))
+
+    assert class_names == CLASS_NAMES
+    assert not any(t.is_meta for t in (*loaded.parameters(), *loaded.buffers()))
+    images = torch.randn(2, 3, 224, 224)
+    with torch.no_grad():
+        torch.testing.assert_close(loaded(images), model(images))
+
+def test_pickled_checkpoint_falls_back(tmp_path):
+    """Older checkpoints pickled objects such as the argparse namespace, which weights_only rejects"""
+    model = create_classifier(len(CLASS_NAMES), "cpu", "mobilenetv3_small_050").eval()
+    checkpoint = tmp_path / "model.pth"
+    torch.save({"model_state_dict": model.state_dict(), "class_names": CLASS_NAMES,
+                "model_name": "mobilenetv3_small_050", "args": argparse.Namespace(lr=1e-4)}, checkpoint)
+
+    loaded, class_names = load_classifier(str(checkpoint))
+
+    assert class_names == CLASS_NAMES
+    images = torch.randn(1, 3, 224, 224)
+    with torch.no_grad():
+        torch.testing.assert_close(loaded(images), model(images))
@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Test script for the persistent prediction log
+Checks that a bad batch is counted as failed without stopping the writer
+thread, and that close() gives up on a stuck writer. Runs under pytest.
+"""
+
+import threading
+import time
+
+from prediction_log import PredictionLog, make_record
+
+RESULT = {
+    "prediction": "Tomato___healthy",
+    "confidence": 0.9,
+    "top3_predictions": [{"class": "Tomato___healthy", "confidence": 0.9}, {"class": "Tomato___Early_blight",
+                                                                            "confidence": 0.1}],
+}
+
+def make(**overrides):
+    return {**make_record(RESULT, "/predict", 12.5, "hash", "model"), **overrides}
+
+def wait_for(condition, timeout=5.0):
+    deadline = time.monotonic() + timeout
+    while not condition() and time.monotonic() < deadline:
+        time.sleep(0.01)
+    return condition()
+
+def test_bad_record_fails_its_batch_only(tmp_path):
+    errors = []
+    log = PredictionLog(str(tmp_path / "log.db"), flush_interval=0.01,
+                        on_error=lambda records, error: errors.append((records, type(error))))
+
+    log.put(make(top3=[{"class": object()}]))  # Not JSON serializable
+    assert wait_for(lambda: log.failed == 1)
+    log.put(make())
+    assert wait_for(lambda: log.written == 1)
+
+    assert log.close()
+    assert errors == [(1, TypeError)]
+    assert log.stats()["last_error"].startswith("TypeError")
+
+def test_close_gives_up_on_a_stuck_writer(tmp_path):
+    log = PredictionLog(str(tmp_path / "log.db"), max_pending=1)
+    release = threading.Event()
+    log._insert = lambda records: release.wait()
+
+    log.put(make())
+    assert wait_for(lambda: log.stats()["pending"] == 0)
+    log.put(make())  # The buffer is now full and never drains
+
+    start = time.monotonic()
+    assert not log.close(timeout=0.2)
+    assert time.monotonic() - start < 1.0
+    release.set()
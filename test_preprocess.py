@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Test script for the fast preprocessing path
+Checks that preprocess.py produces model inputs numerically close to the
+original torchvision transform. Runs standalone or under pytest.
+"""
+
+import io
+
+import numpy as np
+import torch
+from PIL import Image
+
+from preprocess import IMAGE_SIZE, preprocess_image, reference_transform
+
+# Mean and worst-case absolute difference allowed, in normalized units ([-1, 1] range)
+MEAN_TOLERANCE = 0.02
+MAX_TOLERANCE = 0.35
+
+def make_leaf_like_image(width, height):
+    """Smooth synthetic photo; JPEG-friendly like real leaf images, unlike random noise"""
+    y, x = np.mgrid[0:height, 0:width]
+    arr = np.stack([
+        (np.sin(x / 37.0) + 1) * 120,
+        (np.cos(y / 23.0) + 1) * 120,
+        (x + y) % 255,
+    ], axis=-1).astype("uint8")
+    return Image.fromarray(arr)
+
+def encode(image, fmt):
+    buffer = io.BytesIO()
+    image.save(buffer, format=fmt, quality=92) if fmt == "JPEG" else image.save(buffer, format=fmt)
+    return buffer.getvalue()
+
+def compare(contents):
+    reference = reference_transform(Image.open(io.BytesIO(contents)).convert("RGB"))
+    fast = preprocess_image(contents)
+    diff = (reference - fast).abs()
+    return fast, float(diff.mean()), float(diff.max())
+
+def test_output_shape_and_dtype():
+    """Fast path returns a (3, 224, 224) float32 tensor"""
+    fast = preprocess_image(encode(make_leaf_like_image(640, 480), "JPEG"))
+    assert fast.shape == (3, IMAGE_SIZE, IMAGE_SIZE)
+    assert fast.dtype == torch.float32
+
+def test_matches_reference_for_jpeg():
+    """JPEGs of phone-like resolutions stay close to the reference transform"""
+    for width, height in [(256, 256), (640, 480), (1600, 1200), (4000, 3000)]:
+        _, mean_diff, max_diff = compare(encode(make_leaf_like_image(width, height), "JPEG"))
+        print(f"   JPEG {width}x{height}: mean |Δ| = {mean_diff:.4f}, max |Δ| = {max_diff:.4f}")
+        assert mean_diff < MEAN_TOLERANCE
+        assert max_diff < MAX_TOLERANCE
+
+def test_matches_reference_for_png():
+    """PNGs (no draft mode) and RGBA input stay close to the reference transform"""
+    image = make_leaf_like_image(800, 600).convert("RGBA")
+    _, mean_diff, max_diff = compare(encode(image, "PNG"))
+    print(f"   PNG 800x600 RGBA: mean |Δ| = {mean_diff:.4f}, max |Δ| = {max_diff:.4f}")
+    assert mean_diff < MEAN_TOLERANCE
+    assert max_diff < MAX_TOLERANCE
+
+def test_exact_size_is_identical():
+    """At 224x224 no resize happens, so only float rounding differs"""
+    _, _, max_diff = compare(encode(make_leaf_like_image(IMAGE_SIZE, IMAGE_SIZE), "PNG"))
+    assert max_diff < 1e-5
+
+def main():
+    """Run all tests"""
+    print("🚀 Starting preprocessing tests")
+    print("=" * 50)
+
+    tests = [
+        test_output_shape_and_dtype,
+        test_matches_reference_for_jpeg,
+        test_matches_reference_for_png,
+        test_exact_size_is_identical
+    ]
+
+    passed = 0
+    for test in tests:
+        try:
+            test()
+            print(f"✅ {test.__doc__}")
+            passed += 1
+        except AssertionError:
+            print(f"❌ {test.__doc__}")
+
+    print("\n" + "=" * 50)
+    print(f"📊 Test Results: {passed}/{len(tests)} tests passed")
+    return 0 if passed == len(tests) else 1
+
+if __name__ == "__main__":
+    exit(main())
@@ -0,0 +1,74 @@
+#!/usr/bin/env python3
+"""
+Test script for the similar-image index behind /similar
+Serves a tiny randomly initialized ViT through the real app and checks that
+/predict uploads end up in the embedding index. Runs under pytest.
+"""
+
+import io
+import time
+
+import numpy as np
+import pytest
+import torch
+from fastapi.testclient import TestClient
+from PIL import Image
+
+import main
+from model_loader import create_classifier
+
+CLASS_NAMES = ["Tomato___Early_blight", "Tomato___healthy", "Potato___Late_blight"]
+TINY_MODEL = "vit_tiny_patch16_224"
+
+def make_upload(seed):
+    pixels = np.random.default_rng(seed).integers(0, 256, (240, 320, 3), dtype=np.uint8)
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format="JPEG")
+    return buffer.getvalue()
+
+@pytest.fixture(scope="module")
+def client(tmp_path_factory):
+    tmp_path = tmp_path_factory.mktemp("similar")
+    checkpoint = tmp_path / "tiny.pth"
+    model = create_classifier(len(CLASS_NAMES), "cpu", TINY_MODEL)
+    torch.save({"model_state_dict": model.state_dict(), "class_names": CLASS_NAMES, "model_name": TINY_MODEL},
+               checkpoint)
+
+    patch = pytest.MonkeyPatch()
+    patch.setattr(main, "CHECKPOINT_PATH", str(checkpoint))
+    patch.setattr(main, "EMBEDDING_INDEX_DIR", str(tmp_path / "index"))
+    patch.setattr(main, "PREDICTION_LOG_PATH", "")
+    patch.setattr(main, "WARMUP_BATCH_SIZES", "0")
+    patch.setattr(main, "model", None)
+    with TestClient(main.app) as test_client:
+        yield test_client
+    patch.undo()
+
+def wait_for_vectors(client, count, timeout=10.0):
+    """Uploads are indexed in the background after /predict returns"""
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        index = client.get("/health").json()["embedding_index"]
+        if index is not None and index["vectors"] >= count:
+            return index
+        time.sleep(0.05)
+    return client.get("/health").json()["embedding_index"]
+
+def test_empty_index_is_reported(client):
+    index = client.get("/health").json()["embedding_index"]
+    assert index is not None
+    assert index["vectors"] == 0
+
+def test_predict_uploads_are_indexed(client):
+    for seed in range(3):
+        response = client.post("/predict", files={"file": (f"leaf{seed}.jpg", make_upload(seed), "image/jpeg")})
+        assert response.status_code == 200
+
+    assert wait_for_vectors(client, 3)["vectors"] == 3
+    assert "cropguard_embedding_index_vectors 3" in client.get("/metrics").text
+
+    response = client.post("/similar?k=1", files={"file": ("query.jpg", make_upload(1), "image/jpeg")})
+    assert response.status_code == 200
+    neighbors = response.json()["neighbors"]
+    assert neighbors[0]["filename"] == "leaf1.jpg"
+    assert neighbors[0]["score"] > 0.99
@@ -0,0 +1,108 @@
+#!/usr/bin/env python3
+"""
+Test script for the treatment recommendation cache
+Checks that concurrent requests for the same key share one upstream call,
+including when the caller that started it is cancelled, and that /treatment
+served by stub_llm.py reaches the LLM once. Runs under pytest.
+"""
+
+import asyncio
+
+import httpx
+import pytest
+from openai import AsyncOpenAI
+
+import main
+import stub_llm
+from treatment_cache import TreatmentCache
+
+def make_factory(calls, delay=0.05):
+    async def factory():
+        calls.append(1)
+        await asyncio.sleep(delay)
+        return {"available": True, "recommendations": "spray"}
+    return factory
+
+def test_concurrent_requests_share_one_call():
+    async def run():
+        cache, calls = TreatmentCache(), []
+        results = await asyncio.gather(*(cache.get_or_create("key", make_factory(calls)) for _ in range(5)))
+        again = await cache.get_or_create("key", make_factory(calls))
+        return cache, calls, results, again
+
+    cache, calls, results, again = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(r["recommendations"] == "spray" for r in results + [again])
+    stats = cache.stats()
+    assert (stats["misses"], stats["coalesced"], stats["hits"], stats["inflight"]) == (1, 4, 1, 0)
+
+def test_cancelled_leader_does_not_cancel_waiters():
+    async def run():
+        cache, calls = TreatmentCache(), []
+        leader = asyncio.create_task(cache.get_or_create("key", make_factory(calls)))
+        await asyncio.sleep(0)
+        waiters = [asyncio.create_task(cache.get_or_create("key", make_factory(calls))) for _ in range(3)]
+        await asyncio.sleep(0.01)
+        leader.cancel()
+        with pytest.raises(asyncio.CancelledError):
+            await leader
+        return cache, calls, await asyncio.gather(*waiters)
+
+    cache, calls, results = asyncio.run(run())
+    assert len(calls) == 1
+    assert all(r["recommendations"] == "spray" for r in results)
+    assert cache.stats()["inflight"] == 0
+
+def test_answer_is_cached_after_every_caller_left():
+    async def run():
+        cache, calls = TreatmentCache(), []
+        caller = asyncio.create_task(cache.get_or_create("key", make_factory(calls)))
+        await asyncio.sleep(0.01)
+        caller.cancel()
+        await asyncio.sleep(0.1)
+        return calls, await cache.get("key")
+
+    calls, cached = asyncio.run(run())
+    assert len(calls) == 1
+    assert cached["recommendations"] == "spray"
+
+def test_errors_reach_every_caller_and_are_not_cached():
+    async def failing():
+        await asyncio.sleep(0.01)
+        raise RuntimeError("upstream down")
+
+    async def run():
+        cache = TreatmentCache()
+        results = await asyncio.gather(*(cache.get_or_create("key", failing) for _ in range(3)),
+                                       return_exceptions=True)
+        return cache, results
+
+    cache, results = asyncio.run(run())
+    assert all(isinstance(r, RuntimeError) for r in results)
+    assert cache.stats()["entries"] == 0
+    assert cache.stats()["inflight"] == 0
+
+def test_treatment_endpoint_reaches_the_llm_once(monkeypatch):
+    """Repeated and concurrent /treatment requests against stub_llm.py make a single upstream call"""
+    monkeypatch.setattr(stub_llm.app.state, "delay", 0.2)
+    monkeypatch.setattr(stub_llm.app.state, "calls", 0)
+    monkeypatch.setattr(main, "treatment_cache", TreatmentCache())
+    payload = {"disease_name": "Apple___Apple_scab", "confidence": 0.95}
+
+    async def run():
+        stub_client = httpx.AsyncClient(transport=httpx.ASGITransport(app=stub_llm.app))
+        monkeypatch.setattr(main, "openai_client", AsyncOpenAI(
+            base_url="http://stub-llm/v1", api_key="stub", http_client=stub_client))
+        async with httpx.AsyncClient(transport=httpx.ASGITransport(app=main.app), base_url="http://api") as api:
+            concurrent = await asyncio.gather(*(api.post("/treatment", json=payload) for _ in range(5)))
+            repeated = [await api.post("/treatment", json=payload) for _ in range(3)]
+            health = (await api.get("/health")).json()
+        await stub_client.aclose()
+        return concurrent + repeated, health
+
+    responses, health = asyncio.run(run())
+    assert [r.status_code for r in responses] == [200] * len(responses)
+    assert len({r.json()["recommendations"] for r in responses}) == 1
+    assert stub_llm.app.state.calls == 1
+    stats = health["treatment_cache"]
+    assert (stats["misses"], stats["coalesced"], stats["hits"]) == (1, 4, 3)
@@ -0,0 +1,136 @@
+"""
+Tiled inference for high-resolution and multi-leaf field images.
+
+Instead of squashing the whole upload to the model's input size, the image
+is covered by a grid of model-sized windows, so small lesions keep their
+pixels. The grid is chosen first (at most `max_tiles` windows, at native
+resolution when that fits), the image is decoded and resized once to exactly
+the size the grid covers, and the windows are cut out with `Tensor.unfold`
+(strided views over one pixel buffer; no per-tile crops) and normalized as a
+single batch for one forward pass.
+
+Tile probabilities are aggregated into one class distribution: if any tile is
+clearly diseased, the most confident diseased tile's, otherwise the average
+over tiles. The prediction and top-3 both come from that distribution. The
+per-tile disease probability forms a coarse heatmap.
+"""
+
+import io
+from typing import Any, Dict, List, Sequence, Tuple, Union
+
+import torch
+from PIL import Image
+
+from preprocess import normalize, resize_uint8, to_uint8_tensor
+
+MAX_TILES = 64
+DISEASE_THRESHOLD = 0.5  # A tile this confident that the leaf is not healthy marks the image as diseased
+
+
+def plan_grid(width: int, height: int, tile: int, stride: int, max_tiles: int) -> Tuple[int, int]:
+    """(rows, cols) of windows covering the image at about native resolution, capped at max_tiles"""
+    cols = max(1, round((width - tile) / stride) + 1)
+    rows = max(1, round((height - tile) / stride) + 1)
+    # Shrink the grid (and so the image) until it fits, keeping its aspect ratio
+    aspect = cols / rows
+    while rows * cols > max_tiles:
+        if rows == 1 or (cols > 1 and cols / rows >= aspect):
+            cols -= 1
+        else:
+            rows -= 1
+    return rows, cols
+
+
+def decode_tiles(
+    source: Union[bytes, str], tile: int, stride: int = None, max_tiles: int = MAX_TILES
+) -> Tuple[torch.Tensor, Dict[str, Any]]:
+    """
+    Decode an image into a (rows * cols, 3, tile, tile) normalized batch in row-major order
+
+    Returns the batch and the grid geometry; `scale_x`/`scale_y` map resized pixels back to the original.
+    """
+    stride = stride or tile
+    image = Image.open(io.BytesIO(source) if isinstance(source, bytes) else source)
+    width, height = image.size
+    rows, cols = plan_grid(width, height, tile, stride, max_tiles)
+    target_w, target_h = stride * (cols - 1) + tile, stride * (rows - 1) + tile
+
+    # Let the JPEG decoder do most of the downscaling; draft never goes below the requested size
+    if image.format == "JPEG":
+        image.draft("RGB", (target_w, target_h))
+    pixels = resize_uint8(to_uint8_tensor(image.convert("RGB")), (target_h, target_w))
+
+    # (3, H, W) -> (3, rows, cols, tile, tile) views -> (rows * cols, 3, tile, tile), copied once
+    windows = pixels.unfold(1, tile, stride).unfold(2, tile, stride)
+    tiles = normalize(windows.permute(1, 2, 0, 3, 4).reshape(rows * cols, 3, tile, tile))
+
+    grid = {
+        "rows": rows,
+        "cols": cols,
+        "tile_size": tile,
+        "stride": stride,
+        "image_size": [width, height],
+        "scale_x": width / target_w,
+        "scale_y": height / target_h,
+    }
+    return tiles, grid
+
+
+def tile_box(grid: Dict[str, Any], index: int) -> List[int]:
+    """[x0, y0, x1, y1] of a tile in original image pixels"""
+    row, col = divmod(index, grid["cols"])
+    x0, y0 = col * grid["stride"], row * grid["stride"]
+    x1, y1 = x0 + grid["tile_size"], y0 + grid["tile_size"]
+    return [round(x0 * grid["scale_x"]), round(y0 * grid["scale_y"]),
+            round(x1 * grid["scale_x"]), round(y1 * grid["scale_y"])]
+
+
+def aggregate_tiles(
+    probabilities: torch.Tensor,
+    class_names: Sequence[str],
+    grid: Dict[str, Any],
+    disease_threshold: float = DISEASE_THRESHOLD,
+    hotspots: int = 3,
+) -> Dict[str, Any]:
+    """Combine (tiles, classes) probabilities into one prediction, a disease heatmap and the top hotspots"""
+    healthy = torch.tensor(["healthy" in name.lower() for name in class_names])
+    disease_scores = 1.0 - probabilities[:, healthy].sum(dim=1)
+    tile_confidence, tile_class = probabilities.max(dim=1)
+
+    # Tiles predicting a disease, with enough disease probability to trust it
+    diseased = ~healthy[tile_class] & (disease_scores >= disease_threshold)
+    if diseased.any():
+        # One clearly diseased tile decides the image: use the most confident one's distribution
+        deciding_tile = int(tile_confidence.masked_fill(~diseased, -1.0).argmax())
+        scores = probabilities[deciding_tile]
+        aggregation = "max_disease_tile"
+    else:
+        scores = probabilities.mean(dim=0)
+        aggregation = "mean"
+
+    top3_scores, top3_idx = torch.topk(scores, min(3, len(class_names)))
+    predicted_idx = int(top3_idx[0])
+    confidence = float(top3_scores[0])
+    hotspot_idx = torch.topk(disease_scores, min(hotspots, len(disease_scores))).indices.tolist()
+    return {
+        "prediction": class_names[predicted_idx],
+        "confidence": confidence,
+        "confidence_percentage": round(confidence * 100, 2),
+        "aggregation": aggregation,
+        "top3_predictions": [
+            {"class": class_names[int(i)], "confidence": float(p)} for p, i in zip(top3_scores, top3_idx)
+        ],
+        "heatmap": [
+            [round(float(score), 3) for score in row]
+            for row in disease_scores.view(grid["rows"], grid["cols"])
+        ],
+        "hotspots": [
+            {
+                "box": tile_box(grid, i),
+                "disease_probability": round(float(disease_scores[i]), 4),
+                "class": class_names[int(probabilities[i].argmax())],
+                "confidence": round(float(probabilities[i].max()), 4),
+            }
+            for i in hotspot_idx
+        ],
+    }
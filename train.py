@@ -1,9 +1,15 @@
 import torch
 import torch.nn as nn
-from torch.utils.data import DataLoader
+import torch.nn.functional as F
+from torch.utils.data import DataLoader, Sampler
 from torchvision import datasets, transforms
 import timm
 import os
+import time
+import argparse
+import contextlib
+from prepare_dataset import PreparedImageDataset
+from model_loader import MODEL_NAME, load_classifier
 
 # --- Setup ---
 data_dir = "data/"   # adjust path if needed
@@ -17,37 +23,191 @@ transform = transforms.Compose([
     transforms.Normalize(mean=(0.5, 0.5, 0.5), std=(0.5, 0.5, 0.5))
 ])
 
-train_ds = datasets.ImageFolder(os.path.join(data_dir, "train"), transform=transform)
-val_ds = datasets.ImageFolder(os.path.join(data_dir, "valid"), transform=transform)
 
-train_loader = DataLoader(train_ds, batch_size=32, shuffle=True)
-val_loader = DataLoader(val_ds, batch_size=32)
+class ResumableRandomSampler(Sampler):
+    """Shuffles with a per-epoch seed so an interrupted epoch can resume where it stopped"""
 
-# --- Model ---
-model = timm.create_model('vit_base_patch16_224', pretrained=True)
-model.head = nn.Linear(model.head.in_features, len(train_ds.classes))
-model = model.to(device)
+    def __init__(self, data_source, seed=0):
+        self.num_samples = len(data_source)
+        self.seed = seed
+        self.epoch = 0
+        self.start_index = 0
 
-# --- Training setup ---
-criterion = nn.CrossEntropyLoss()
-optimizer = torch.optim.Adam(model.parameters(), lr=1e-4)
+    def set_epoch(self, epoch, start_index=0):
+        self.epoch = epoch
+        self.start_index = start_index
+
+    def __iter__(self):
+        generator = torch.Generator()
+        generator.manual_seed(self.seed + self.epoch)
+        order = torch.randperm(self.num_samples, generator=generator).tolist()
+        return iter(order[self.start_index:])
+
+    def __len__(self):
+        return self.num_samples - self.start_index
+
+
+def resume_path_for(path):
+    return os.path.splitext(path)[0] + ".train_state.pth"
+
+
+def distillation_loss(student_logits, teacher_logits, labels, alpha, temperature):
+    """Blend of hard-label cross-entropy and KL divergence to the teacher's softened predictions"""
+    hard = F.cross_entropy(student_logits, labels)
+    soft = F.kl_div(
+        F.log_softmax(student_logits / temperature, dim=1),
+        F.softmax(teacher_logits / temperature, dim=1),
+        reduction="batchmean"
+    ) * temperature ** 2
+    return (1 - alpha) * hard + alpha * soft
+
+
+def save_train_state(path, model, optimizer, epoch, batches_done, class_names):
+    """Write a resumable checkpoint; the temp file + rename keeps the previous one valid if interrupted"""
+    tmp_path = path + ".tmp"
+    torch.save({
+        "model_state_dict": model.state_dict(),
+        "optimizer_state_dict": optimizer.state_dict(),
+        "epoch": epoch,
+        "batches_done": batches_done,
+        "class_names": class_names
+    }, tmp_path)
+    os.replace(tmp_path, path)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Fine-tune the ViT on the PlantVillage dataset")
+    parser.add_argument("--data-dir", default=data_dir)
+    parser.add_argument("--model", default=MODEL_NAME,
+                        help="timm architecture, e.g. a small first-pass model for the serving cascade")
+    parser.add_argument("--save-path", default=save_path)
+    parser.add_argument("--teacher", help="Checkpoint to distill from (e.g. the trained ViT)")
+    parser.add_argument("--distill-alpha", type=float, default=0.5, help="Weight of the teacher loss")
+    parser.add_argument("--distill-temperature", type=float, default=2.0)
+    parser.add_argument("--epochs", type=int, default=3)  # short run for demo
+    parser.add_argument("--batch-size", type=int, default=32)
+    parser.add_argument("--lr", type=float, default=1e-4)
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1),
+                        help="DataLoader worker processes for decoding and prefetching")
+    parser.add_argument("--prefetch-factor", type=int, default=2, help="Batches prefetched per worker")
+    parser.add_argument("--bf16", action="store_true", help="Use bfloat16 autocast for the forward pass")
+    parser.add_argument("--accum-steps", type=int, default=1,
+                        help="Micro-batches per optimizer step (effective batch = batch size x accum steps)")
+    parser.add_argument("--checkpoint-every", type=int, default=200,
+                        help="Save a resumable checkpoint every N optimizer steps (0 disables)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Resume from <save path stem>.train_state.pth if it exists")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--prepared", help="Read train/valid from a prepare_dataset.py output directory")
+    args = parser.parse_args()
+    resume_path = resume_path_for(args.save_path)
+
+    if args.prepared:
+        # Pre-resized uint8 shards: no JPEG decoding or resizing per epoch
+        train_ds = PreparedImageDataset(os.path.join(args.prepared, "train"))
+        val_ds = PreparedImageDataset(os.path.join(args.prepared, "valid"))
+    else:
+        train_ds = datasets.ImageFolder(os.path.join(args.data_dir, "train"), transform=transform)
+        val_ds = datasets.ImageFolder(os.path.join(args.data_dir, "valid"), transform=transform)
+
+    sampler = ResumableRandomSampler(train_ds, seed=args.seed)
+    loader_kwargs = {
+        "batch_size": args.batch_size,
+        "num_workers": args.workers,
+        "pin_memory": device.type == "cuda",
+    }
+    if args.workers > 0:
+        loader_kwargs["prefetch_factor"] = args.prefetch_factor
+    train_loader = DataLoader(train_ds, sampler=sampler, **loader_kwargs)
+    val_loader = DataLoader(val_ds, **loader_kwargs)
+
+    # --- Model ---
+    # Resumed weights replace the pretrained ones straight away, so don't download them
+    resuming = args.resume and os.path.exists(resume_path)
+    model = timm.create_model(args.model, pretrained=not resuming)
+    model.reset_classifier(len(train_ds.classes))
+    model = model.to(device)
+
+    teacher = None
+    if args.teacher:
+        teacher, teacher_classes = load_classifier(args.teacher, str(device))
+        if teacher_classes != train_ds.classes:
+            raise ValueError(f"{args.teacher} was trained on different classes than {args.data_dir}")
+        print(f"Distilling from {args.teacher} (alpha={args.distill_alpha}, T={args.distill_temperature})")
+
+    # --- Training setup ---
+    criterion = nn.CrossEntropyLoss()
+    optimizer = torch.optim.Adam(model.parameters(), lr=args.lr)
+
+    start_epoch, batches_done = 0, 0
+    if resuming:
+        state = torch.load(resume_path, map_location=device)
+        if state["class_names"] != train_ds.classes:
+            raise ValueError(f"{resume_path} was trained on different classes than {args.data_dir}")
+        model.load_state_dict(state["model_state_dict"])
+        optimizer.load_state_dict(state["optimizer_state_dict"])
+        start_epoch, batches_done = state["epoch"], state["batches_done"]
+        print(f"Resuming from epoch {start_epoch + 1}, batch {batches_done}")
+
+    def autocast():
+        if args.bf16:
+            return torch.autocast(device.type, dtype=torch.bfloat16)
+        return contextlib.nullcontext()
+
+    # --- Training loop ---
+    for epoch in range(start_epoch, args.epochs):
+        sampler.set_epoch(epoch, start_index=batches_done * args.batch_size)
+        model.train()
+        running_loss, num_batches, num_samples = 0.0, 0, 0
+        epoch_batches = batches_done + len(train_loader)
+        epoch_start = time.perf_counter()
 
-# --- Training loop ---
-for epoch in range(3):  # short run for demo
-    model.train()
-    running_loss = 0.0
-    for imgs, labels in train_loader:
-        imgs, labels = imgs.to(device), labels.to(device)
         optimizer.zero_grad()
-        loss = criterion(model(imgs), labels)
-        loss.backward()
-        optimizer.step()
-        running_loss += loss.item()
-    print(f"Epoch {epoch+1}: Loss = {running_loss/len(train_loader):.4f}")
-
-# --- Save model ---
-torch.save({
-    "model_state_dict": model.state_dict(),
-    "class_names": train_ds.classes
-}, save_path)
-print(f"Model saved to {save_path}")
+        for imgs, labels in train_loader:
+            imgs = imgs.to(device, non_blocking=True)
+            labels = labels.to(device, non_blocking=True)
+            with autocast():
+                if teacher is not None:
+                    with torch.no_grad():
+                        teacher_logits = teacher(imgs)
+                    loss = distillation_loss(
+                        model(imgs), teacher_logits.float(), labels, args.distill_alpha, args.distill_temperature
+                    )
+                else:
+                    loss = criterion(model(imgs), labels)
+            # Average over the micro-batches of this group; the last group of the epoch may be partial
+            group_start = batches_done - batches_done % args.accum_steps
+            (loss / min(args.accum_steps, epoch_batches - group_start)).backward()
+
+            running_loss += loss.item()
+            num_batches += 1
+            num_samples += imgs.size(0)
+            batches_done += 1
+
+            # Step on accumulation boundaries and on the last (possibly partial) group of the epoch
+            if batches_done % args.accum_steps == 0 or num_batches == len(train_loader):
+                optimizer.step()
+                optimizer.zero_grad()
+
+                optimizer_steps = batches_done // args.accum_steps
+                if args.checkpoint_every and optimizer_steps % args.checkpoint_every == 0:
+                    save_train_state(resume_path, model, optimizer, epoch, batches_done, train_ds.classes)
+
+        elapsed = time.perf_counter() - epoch_start
+        print(f"Epoch {epoch+1}: Loss = {running_loss/max(num_batches, 1):.4f}, "
+              f"{num_samples / elapsed:.1f} samples/sec ({elapsed:.0f}s)")
+
+        batches_done = 0
+        save_train_state(resume_path, model, optimizer, epoch + 1, 0, train_ds.classes)
+
+    # --- Save model ---
+    torch.save({
+        "model_state_dict": model.state_dict(),
+        "class_names": train_ds.classes,
+        "model_name": args.model
+    }, args.save_path)
+    print(f"Model saved to {args.save_path}")
+
+
+if __name__ == "__main__":
+    main()
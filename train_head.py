@@ -0,0 +1,187 @@
+#!/usr/bin/env python3
+"""
+Retrain only the classification head on a frozen ViT backbone.
+
+The backbone runs once over data/train and data/valid and its pooled
+embeddings are cached as memory-mapped .npy arrays. Training the replacement
+`model.head` Linear from that cache takes seconds on CPU, so adding a class or
+relabelling data does not require a full fine-tune:
+
+    python train_head.py --epochs 50
+
+The result is written to a new checkpoint (vit_plantvillage_head.pth by
+default); point CHECKPOINT_PATH at it or rename it once it has been evaluated.
+"""
+
+import argparse
+import hashlib
+import json
+import os
+import time
+
+import numpy as np
+import torch
+import torch.nn as nn
+from torch.utils.data import DataLoader
+from torchvision import datasets
+
+from model_loader import MODEL_NAME, load_classifier
+from preprocess import preprocess_image
+
+# --- Config ---
+DATA_DIR = "data/"
+CHECKPOINT_PATH = "vit_plantvillage.pth"
+FEATURE_DIR = "features"
+SAVE_PATH = "vit_plantvillage_head.pth"  # Never the input checkpoint, which may be serving
+
+
+def backbone_identity(model):
+    """Hash the backbone weights, so retraining only the head keeps the feature cache valid"""
+    digest = hashlib.sha256()
+    for name, tensor in model.state_dict().items():
+        if not name.startswith("head."):
+            digest.update(name.encode())
+            digest.update(tensor.detach().contiguous().numpy().tobytes())
+    return digest.hexdigest()
+
+
+def split_fingerprint(dataset, backbone_id):
+    """Identify a split's file list and the backbone that embedded it"""
+    digest = hashlib.sha256(backbone_id.encode())
+    for path, label in dataset.samples:
+        stat = os.stat(path)
+        digest.update(f"{path}:{label}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+    return digest.hexdigest()
+
+
+@torch.inference_mode()
+def extract_features(backbone, dataset, output_prefix, batch_size, workers):
+    """Write pooled embeddings and labels for a split to memory-mapped .npy files"""
+    loader = DataLoader(dataset, batch_size=batch_size, num_workers=workers)
+    features = np.lib.format.open_memmap(
+        output_prefix + ".features.npy", mode="w+", dtype=np.float32,
+        shape=(len(dataset), backbone.num_features)
+    )
+    labels = np.empty(len(dataset), dtype=np.int64)
+
+    offset = 0
+    start = time.perf_counter()
+    for imgs, targets in loader:
+        # Pooled pre-logits embedding, i.e. the input of model.head
+        embeddings = backbone.forward_head(backbone.forward_features(imgs), pre_logits=True)
+        features[offset:offset + len(imgs)] = embeddings.numpy()
+        labels[offset:offset + len(imgs)] = targets.numpy()
+        offset += len(imgs)
+        print(f"   {offset}/{len(dataset)} images", end="\r")
+
+    features.flush()
+    np.save(output_prefix + ".labels.npy", labels)
+    elapsed = time.perf_counter() - start
+    print(f"   {len(dataset)} images embedded in {elapsed:.1f}s ({len(dataset) / elapsed:.1f} images/sec)")
+
+
+def load_split(args, split, backbone, backbone_id, class_names):
+    """Return memory-mapped (features, labels) for a split, embedding it first if the cache is stale"""
+    dataset = datasets.ImageFolder(os.path.join(args.data_dir, split), loader=preprocess_image)
+    if dataset.classes != class_names:
+        raise ValueError(f"Classes in {split} {dataset.classes} do not match train classes {class_names}")
+
+    prefix = os.path.join(args.feature_dir, split)
+    meta_path = prefix + ".meta.json"
+    fingerprint = split_fingerprint(dataset, backbone_id)
+
+    cached = False
+    if os.path.exists(meta_path):
+        with open(meta_path) as f:
+            cached = json.load(f).get("fingerprint") == fingerprint
+
+    if cached:
+        print(f"✅ Using cached {split} features from {prefix}.features.npy")
+    else:
+        print(f"🔄 Embedding {split} split with the frozen backbone...")
+        extract_features(backbone, dataset, prefix, args.batch_size, args.workers)
+        with open(meta_path, "w") as f:
+            json.dump({"fingerprint": fingerprint, "class_names": class_names, "count": len(dataset)}, f)
+
+    # Copy-on-write mapping: zero-copy, and writable as far as torch is concerned
+    features = np.load(prefix + ".features.npy", mmap_mode="c")
+    labels = np.load(prefix + ".labels.npy")
+    return torch.from_numpy(features), torch.from_numpy(labels)
+
+
+def train_head(train_x, train_y, val_x, val_y, num_classes, args):
+    head = nn.Linear(train_x.shape[1], num_classes)
+    optimizer = torch.optim.AdamW(head.parameters(), lr=args.lr, weight_decay=args.weight_decay)
+    criterion = nn.CrossEntropyLoss()
+    generator = torch.Generator().manual_seed(args.seed)
+
+    start = time.perf_counter()
+    for epoch in range(args.epochs):
+        head.train()
+        order = torch.randperm(len(train_x), generator=generator)
+        running_loss = 0.0
+        for i in range(0, len(order), args.head_batch_size):
+            idx = order[i:i + args.head_batch_size]
+            optimizer.zero_grad()
+            loss = criterion(head(train_x[idx]), train_y[idx])
+            loss.backward()
+            optimizer.step()
+            running_loss += loss.item() * len(idx)
+
+        if (epoch + 1) % 10 == 0 or epoch + 1 == args.epochs:
+            head.eval()
+            with torch.no_grad():
+                val_acc = (head(val_x).argmax(dim=1) == val_y).float().mean().item() if len(val_x) else 0.0
+            print(f"Epoch {epoch+1}: Loss = {running_loss / len(train_x):.4f}, Val Accuracy = {val_acc * 100:.2f}%")
+
+    print(f"Head trained in {time.perf_counter() - start:.1f}s")
+    return head
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Retrain the classification head on cached backbone features")
+    parser.add_argument("--data-dir", default=DATA_DIR)
+    parser.add_argument("--checkpoint", default=CHECKPOINT_PATH, help="Checkpoint whose backbone is kept frozen")
+    parser.add_argument("--feature-dir", default=FEATURE_DIR)
+    parser.add_argument("--save-path", default=SAVE_PATH)
+    parser.add_argument("--batch-size", type=int, default=32, help="Batch size for embedding images")
+    parser.add_argument("--workers", type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument("--epochs", type=int, default=50)
+    parser.add_argument("--head-batch-size", type=int, default=256)
+    parser.add_argument("--lr", type=float, default=1e-3)
+    parser.add_argument("--weight-decay", type=float, default=1e-4)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    if os.path.abspath(args.save_path) == os.path.abspath(args.checkpoint):
+        parser.error("--save-path must differ from --checkpoint; the input checkpoint is never overwritten")
+
+    os.makedirs(args.feature_dir, exist_ok=True)
+
+    backbone, _ = load_classifier(args.checkpoint)
+    backbone_id = backbone_identity(backbone)
+    class_names = datasets.ImageFolder(os.path.join(args.data_dir, "train")).classes
+
+    train_x, train_y = load_split(args, "train", backbone, backbone_id, class_names)
+    val_x, val_y = load_split(args, "valid", backbone, backbone_id, class_names)
+
+    head = train_head(train_x, train_y, val_x, val_y, len(class_names), args)
+
+    # --- Save model in the same format as train.py ---
+    state_dict = {k: v for k, v in backbone.state_dict().items() if not k.startswith("head.")}
+    state_dict["head.weight"] = head.weight.detach().clone()
+    state_dict["head.bias"] = head.bias.detach().clone()
+
+    # Write to a temp file and rename it into place, so an interrupted save never leaves a truncated checkpoint
+    tmp_path = args.save_path + ".tmp"
+    torch.save({
+        "model_state_dict": state_dict,
+        "class_names": class_names,
+        "model_name": backbone.pretrained_cfg.get("architecture", MODEL_NAME)
+    }, tmp_path)
+    os.replace(tmp_path, args.save_path)
+    print(f"Model saved to {args.save_path}")
+
+
+if __name__ == "__main__":
+    main()
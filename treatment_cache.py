@@ -0,0 +1,179 @@
+"""
+Cache for LLM treatment recommendations.
+
+Treatment prompts depend only on the disease, crop and rounded severity, so
+responses are cached in memory and optionally persisted to a small SQLite
+store that survives restarts. Concurrent requests for the same key share a
+single upstream call. Disease names come from clients, so both stores are
+bounded: the in-memory cache is an LRU and the oldest rows on disk are pruned.
+"""
+
+import asyncio
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional
+
+
+def make_treatment_key(disease_name: str, crop_type: str, confidence: float, model_name: str) -> str:
+    """Normalize the prompt inputs into a cache key"""
+    return json.dumps(
+        [disease_name.strip(), crop_type, f"{confidence:.1f}", model_name],
+        separators=(",", ":"),
+    )
+
+
+class TreatmentCache:
+    """In-memory LRU treatment cache with an optional on-disk SQLite store"""
+
+    def __init__(self, db_path: Optional[str] = None, max_size: int = 1024, max_disk_entries: int = 10000):
+        self.db_path = db_path
+        self.max_size = max_size
+        self.max_disk_entries = max_disk_entries
+        self._memory: "OrderedDict[str, Dict[str, Any]]" = OrderedDict()
+        self._inflight: Dict[str, "asyncio.Task"] = {}
+        self._db: Optional[sqlite3.Connection] = None
+        self._db_lock = threading.Lock()
+
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self.coalesced = 0
+        self.evictions = 0
+
+        if db_path:
+            self._connect()
+
+    def _connect(self):
+        self._db = sqlite3.connect(self.db_path, check_same_thread=False)
+        self._db.execute(
+            "CREATE TABLE IF NOT EXISTS treatments ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, created_at REAL NOT NULL)"
+        )
+        self._db.commit()
+
+    def reopen(self):
+        """Open a new SQLite connection in a forked worker; connections must not be shared across fork"""
+        if self.db_path:
+            self._db_lock = threading.Lock()
+            self._connect()
+
+    def _disk_get(self, key: str) -> Optional[Dict[str, Any]]:
+        with self._db_lock:
+            row = self._db.execute("SELECT value FROM treatments WHERE key = ?", (key,)).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def _disk_put(self, key: str, value: Dict[str, Any]):
+        with self._db_lock:
+            self._db.execute(
+                "INSERT OR REPLACE INTO treatments (key, value, created_at) VALUES (?, ?, ?)",
+                (key, json.dumps(value), time.time()),
+            )
+            self._db.execute(
+                "DELETE FROM treatments WHERE key NOT IN "
+                "(SELECT key FROM treatments ORDER BY created_at DESC LIMIT ?)",
+                (self.max_disk_entries,),
+            )
+            self._db.commit()
+
+    def _remember(self, key: str, value: Dict[str, Any]):
+        """Store in memory, evicting the least recently used entries beyond max_size"""
+        self._memory[key] = value
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.max_size:
+            self._memory.popitem(last=False)
+            self.evictions += 1
+
+    async def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """Look up a cached response in memory, then on disk"""
+        value = self._memory.get(key)
+        if value is not None:
+            self._memory.move_to_end(key)
+            return value
+
+        if self._db is not None:
+            value = await asyncio.to_thread(self._disk_get, key)
+            if value is not None:
+                self._remember(key, value)
+                self.disk_hits += 1
+                return value
+
+        return None
+
+    async def lookup(self, key: str) -> Optional[Dict[str, Any]]:
+        """Like `get`, but counted as a cache hit or miss"""
+        value = await self.get(key)
+        if value is not None:
+            self.hits += 1
+        else:
+            self.misses += 1
+        return value
+
+    async def put(self, key: str, value: Dict[str, Any]):
+        self._remember(key, value)
+        if self._db is not None:
+            await asyncio.to_thread(self._disk_put, key, value)
+
+    async def get_or_create(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Dict[str, Any]]],
+        should_cache: Callable[[Dict[str, Any]], bool] = lambda value: True,
+    ) -> Dict[str, Any]:
+        """Return the cached value, or run `factory` once for all concurrent callers"""
+        value = await self.get(key)
+        if value is not None:
+            self.hits += 1
+            return value
+
+        inflight = self._inflight.get(key)
+        if inflight is not None:
+            self.coalesced += 1
+            return await asyncio.shield(inflight)
+
+        self.misses += 1
+        # The upstream call runs in its own task, so a caller that is cancelled (e.g. its client disconnected)
+        # only stops waiting; callers coalesced onto it still get the answer, and it is cached for later ones
+        task = asyncio.create_task(self._create(key, factory, should_cache))
+        self._inflight[key] = task
+        task.add_done_callback(lambda done: self._finish(key, done))
+        return await asyncio.shield(task)
+
+    async def _create(
+        self,
+        key: str,
+        factory: Callable[[], Awaitable[Dict[str, Any]]],
+        should_cache: Callable[[Dict[str, Any]], bool],
+    ) -> Dict[str, Any]:
+        value = await factory()
+        if should_cache(value):
+            await self.put(key, value)
+        return value
+
+    def _finish(self, key: str, task: "asyncio.Task"):
+        del self._inflight[key]
+        # Mark the exception as retrieved when nobody is waiting on it any more
+        if not task.cancelled():
+            task.exception()
+
+    def close(self):
+        if self._db is not None:
+            with self._db_lock:
+                self._db.close()
+            self._db = None
+
+    def stats(self) -> Dict[str, Any]:
+        """Cache counters for /health"""
+        return {
+            "entries": len(self._memory),
+            "max_size": self.max_size,
+            "evictions": self.evictions,
+            "persistent": self.db_path is not None,
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "coalesced": self.coalesced,
+            "inflight": len(self._inflight),
+        }